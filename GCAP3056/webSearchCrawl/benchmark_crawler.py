@@ -0,0 +1,626 @@
+#!/usr/bin/env python3
+"""
+Crawler Benchmark
+Times the sequential, async and pipelined crawl modes against the local test server
+and reports pages per second for each, the cost of an incremental
+re-crawl of an unchanged site, the cost of each link extraction backend,
+the memory taken by the crawler's URL sets, the scaling of sharded crawls,
+HTTP/1.1 against HTTP/2, the cost of logging and the disk space and save
+time of compressed page storage.
+
+The `scenarios` benchmark is the one to track over time: it crawls fixed
+synthetic sites in fresh processes, reports pages/s, CPU time and peak RSS,
+and can save its results and compare a later run against them:
+
+    python benchmark_crawler.py scenarios --save baseline.json
+    python benchmark_crawler.py scenarios --compare baseline.json
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from crawl_logging import TEXT_FORMAT
+from link_extractors import LINK_EXTRACTORS
+from local_test_server import SyntheticSite, start_http2_server, start_server
+from ofca_crawler import OFCACrawler
+from sharded_crawl import ShardedCrawl
+from url_sets import CompactURLSet, open_url_set_store
+
+
+def make_crawler(base_url, work_dir, name):
+    """Create a crawler writing into a fresh directory under work_dir"""
+    crawler = OFCACrawler(base_url=base_url, download_dir=str(Path(work_dir) / name))
+    # Per-page INFO lines would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    return crawler
+
+
+def time_crawl(label, crawl):
+    """Run a crawl callable and print its throughput"""
+    start = time.perf_counter()
+    crawler = crawl()
+    elapsed = time.perf_counter() - start
+    pages = crawler.crawl_stats['pages_crawled']
+    print(f"  {label:<32} {pages:>5} pages in {elapsed:7.2f}s  = {pages / elapsed:8.1f} pages/s")
+    return pages / elapsed
+
+
+def benchmark_modes(args):
+    """Compare crawl_site with the concurrent crawl modes at several concurrency levels"""
+    site = SyntheticSite(pages=args.pages, fanout=args.fanout, latency=args.latency)
+    server, base_url = start_server(site)
+    work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+    print(f"Synthetic site: {args.pages} pages, fan-out {args.fanout}, "
+          f"{args.latency * 1000:.0f} ms latency at {base_url}")
+
+    try:
+        def sequential():
+            crawler = make_crawler(base_url, work_dir, 'sequential')
+            crawler.crawl_site(max_pages=args.pages, delay=0.0)
+            return crawler
+
+        baseline = time_crawl("crawl_site (sequential)", sequential)
+
+        for concurrency in args.concurrency:
+            def run_async(concurrency=concurrency):
+                crawler = make_crawler(base_url, work_dir, f'async_{concurrency}')
+                crawler.crawl_site_async(max_pages=args.pages, concurrency=concurrency,
+                                         per_host_limit=concurrency, delay=0.0)
+                return crawler
+
+            rate = time_crawl(f"crawl_site_async (x{concurrency})", run_async)
+            print(f"  {'':<32} speed-up {rate / baseline:.1f}x")
+
+            def run_pipelined(concurrency=concurrency):
+                crawler = make_crawler(base_url, work_dir, f'pipelined_{concurrency}')
+                crawler.crawl_site_pipelined(max_pages=args.pages, fetch_workers=concurrency,
+                                             per_host_limit=concurrency, delay=0.0)
+                return crawler
+
+            rate = time_crawl(f"crawl_site_pipelined (x{concurrency})", run_pipelined)
+            print(f"  {'':<32} speed-up {rate / baseline:.1f}x")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_recrawl(args):
+    """Crawl the site twice into the same directory and compare the two runs"""
+    site = SyntheticSite(pages=args.pages, fanout=args.fanout, latency=args.latency)
+    server, base_url = start_server(site)
+    work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+    print("Incremental re-crawl of an unchanged site:")
+
+    try:
+        for label in ("first crawl", "re-crawl (conditional GET)"):
+            start = time.perf_counter()
+            crawler = make_crawler(base_url, work_dir, 'recrawl')
+            crawler.crawl_site_async(max_pages=args.pages, concurrency=8, per_host_limit=8)
+            elapsed = time.perf_counter() - start
+            stats = crawler.crawl_stats
+            print(f"  {label:<32} {elapsed:7.2f}s  {stats['bytes_downloaded']:>10,} bytes  "
+                  f"{stats['pages_unchanged']:>5} unchanged")
+            crawler.state.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def sample_page(links=300, paragraphs=60):
+    """An OFCA-sized page: navigation chrome, a <base> tag and body text"""
+    nav = '\n'.join(f'<li><a href="/en/section/{i}/index.html#top">Section {i}</a></li>'
+                    for i in range(links))
+    text = '\n'.join(f'<p>Paragraph {i} about telecommunications regulation in Hong Kong. ' * 4 + '</p>'
+                     for i in range(paragraphs))
+    return ('<!DOCTYPE html><html><head><base href="/en/"><title>Sample</title>'
+            '<script>var a = "<a href=\'/not-a-link\'>";</script></head>'
+            f'<body><!-- <a href="/commented-out">x</a> --><ul>{nav}</ul>'
+            f'<a href="about/index.html">About</a><A HREF="../tc/home/index.html">TC</A>{text}</body></html>')
+
+
+def benchmark_link_extraction(args):
+    """Compare per-page parse time and crawl CPU share of the link backends"""
+    page = sample_page()
+    print(f"Link extraction on a {len(page) // 1024} KB page:")
+
+    results = {}
+    for name, backend in LINK_EXTRACTORS.items():
+        extractor = backend()
+        results[name] = set(extractor.extract(page, 'https://www.ofca.gov.hk/en/home/index.html'))
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            extractor.extract(page, 'https://www.ofca.gov.hk/en/home/index.html')
+        per_page = (time.perf_counter() - start) / rounds
+        print(f"  {name:<28} {per_page * 1000:7.2f} ms/page")
+
+    link_sets = list(results.values())
+    print(f"  {'identical link sets':<28} {all(links == link_sets[0] for links in link_sets)}")
+
+    site = SyntheticSite(pages=args.pages, fanout=args.fanout, latency=0.0)
+    server, base_url = start_server(site)
+    work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+    print("Share of crawl CPU time spent in extract_links:")
+
+    try:
+        for name in LINK_EXTRACTORS:
+            crawler = make_crawler(base_url, work_dir, f'links_{name.replace(".", "_")}')
+            crawler.link_extractor = LINK_EXTRACTORS[name]()
+            extract_links = crawler.extract_links
+            parse_time = [0.0]
+
+            def timed_extract_links(html_content, page_url):
+                start = time.process_time()
+                try:
+                    return extract_links(html_content, page_url)
+                finally:
+                    parse_time[0] += time.process_time() - start
+
+            crawler.extract_links = timed_extract_links
+            start = time.process_time()
+            crawler.crawl_site(max_pages=args.pages, delay=0.0)
+            cpu = time.process_time() - start
+            print(f"  {name:<28} {parse_time[0]:6.2f}s of {cpu:6.2f}s CPU = {parse_time[0] / cpu:5.1%}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def current_rss():
+    """Resident set size of this process in bytes (Linux), or 0 if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def measure_url_set(kind, count, work_dir, results):
+    """Child process: fill one kind of URL set and report its memory and speed"""
+    urls = (f"https://www.ofca.gov.hk/en/consumer/notice/page_{i}.html?lang=en&ref={i * 7919}"
+            for i in range(count))
+    base_rss = current_rss()
+
+    start = time.perf_counter()
+    if kind == 'set':
+        url_set = set(urls)
+    else:
+        url_set = CompactURLSet(open_url_set_store(Path(work_dir) / 'url_sets.sqlite3'),
+                                'bench', capacity=count)
+        url_set.update(urls)
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    probes = 20000
+    hits = sum(f"https://www.ofca.gov.hk/en/consumer/notice/page_{i}.html?lang=en&ref={i * 7919}" in url_set
+               for i in range(0, 2 * probes, 2))
+    lookup_time = (time.perf_counter() - start) / probes
+    results.put((current_rss() - base_rss, insert_time, lookup_time, hits,
+                 url_set.stats() if kind == 'compact' else None))
+
+
+def benchmark_url_sets(args):
+    """Memory of a Python set against a CompactURLSet at 10^5 and 10^6 URLs"""
+    print("URL set memory (RSS growth in a fresh process):")
+    context = multiprocessing.get_context('spawn')
+    for count in (100_000, 1_000_000):
+        for kind in ('set', 'compact'):
+            work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+            results = context.Queue()
+            process = context.Process(target=measure_url_set, args=(kind, count, work_dir, results))
+            process.start()
+            rss, insert_time, lookup_time, hits, stats = results.get()
+            process.join()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+            label = 'Python set' if kind == 'set' else 'Bloom + SQLite'
+            print(f"  {count:>9,} URLs {label:<15} {rss / 2 ** 20:8.1f} MB  "
+                  f"insert {insert_time:6.2f}s  lookup {lookup_time * 1e6:6.1f} us")
+            if stats:
+                print(f"  {'':<31}Bloom filter {stats['bloom_bytes'] / 2 ** 20:.1f} MB, "
+                      f"expected false positives {stats['expected_false_positive_rate']:.3%}")
+
+
+def benchmark_shards(args):
+    """Compare a single-process async crawl with sharded crawls over 2 and 4 processes"""
+    site = SyntheticSite(pages=args.pages, fanout=args.fanout, latency=args.latency)
+    server, base_url = start_server(site)
+    work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+    concurrency = max(args.concurrency)
+    print(f"Sharded crawls on {os.cpu_count()} CPUs, x{concurrency} per process:")
+
+    try:
+        def single():
+            crawler = make_crawler(base_url, work_dir, 'single')
+            crawler.crawl_site_async(max_pages=args.pages, concurrency=concurrency,
+                                     per_host_limit=concurrency, delay=0.0)
+            return crawler
+
+        baseline = time_crawl("crawl_site_async (1 process)", single)
+
+        for workers in (2, 4):
+            start = time.perf_counter()
+            summary = ShardedCrawl(num_workers=workers, base_url=base_url, log_level=logging.WARNING,
+                                   download_dir=str(Path(work_dir) / f'shards_{workers}')).run(
+                max_pages=args.pages, concurrency=concurrency,
+                per_host_limit=concurrency * workers, delay=0.0)
+            elapsed = time.perf_counter() - start
+            pages = summary['total_pages_crawled']
+            rate = pages / elapsed
+            print(f"  {f'ShardedCrawl ({workers} processes)':<32} {pages:>5} pages in {elapsed:7.2f}s  "
+                  f"= {rate:8.1f} pages/s")
+            print(f"  {'':<32} speed-up {rate / baseline:.1f}x")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_http2(args):
+    """Compare the requests backend (HTTP/1.1) with httpx over HTTP/2 on the same server"""
+    site = SyntheticSite(pages=args.pages, fanout=args.fanout, latency=args.latency)
+    try:
+        # Checked before the server starts, so a missing client package leaves no server behind
+        import httpx, h2  # noqa: F401
+        server, base_url = start_http2_server(site)
+    except ImportError as e:
+        print(f"Skipping HTTP/2 benchmark, {e.name} is not installed (pip install hypercorn \"httpx[http2]\")")
+        return
+    work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+    print(f"HTTP/1.1 and HTTP/2 (h2c) from one Hypercorn server at {base_url}:")
+
+    try:
+        for concurrency in args.concurrency:
+            for backend, options in (('requests', {}), ('httpx', {'prior_knowledge': True})):
+                def run_async(concurrency=concurrency, backend=backend, options=options):
+                    crawler = OFCACrawler(base_url=base_url, log_level=logging.WARNING,
+                                          download_dir=str(Path(work_dir) / f'{backend}_{concurrency}'),
+                                          http_backend=backend, http_options=options)
+                    crawler.crawl_site_async(max_pages=args.pages, concurrency=concurrency,
+                                             per_host_limit=concurrency, delay=0.0)
+                    return crawler
+
+                server.app.connections.clear()
+                server.app.http_versions.clear()
+                time_crawl(f"{backend} (x{concurrency})", run_async)
+                versions = ', '.join(f"HTTP/{version}: {count}"
+                                     for version, count in sorted(server.app.http_versions.items()))
+                print(f"  {'':<32} {len(server.app.connections)} connections ({versions})")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Fixed sites for regression runs; the page count comes from --pages
+SCENARIOS = {
+    'clean': dict(fanout=5, latency=0.01),
+    'realistic': dict(fanout=5, latency=0.01, page_size=30 * 1024, duplicates=0.1, traps=10,
+                      downloads=10, download_size=2 * 2 ** 20, disallowed=10, error_rate=0.02),
+    'large-pages': dict(fanout=5, latency=0.01, page_size=200 * 1024),
+}
+# Measurements compared between runs, and whether higher is better
+TRACKED = {'pages_per_second': True, 'cpu_ms_per_page': False, 'peak_rss_mb': False}
+
+
+def run_scenario(base_url, download_dir, max_pages, concurrency, results):
+    """Child process: crawl a scenario's site and report time, CPU and memory"""
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    # Retry warnings are expected with injected errors
+    crawler = OFCACrawler(base_url=base_url, download_dir=download_dir, log_level=logging.ERROR)
+    crawler.crawl_site_async(max_pages=max_pages, concurrency=concurrency, per_host_limit=concurrency, delay=0.0)
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    stats = crawler.crawl_stats
+    cpu = (usage.ru_utime - start_usage.ru_utime) + (usage.ru_stime - start_usage.ru_stime)
+    results.put({
+        'pages_crawled': stats['pages_crawled'],
+        'pages_failed': stats['pages_failed'],
+        'pages_skipped': stats['pages_skipped'],
+        'bytes_downloaded': stats['bytes_downloaded'],
+        'seconds': elapsed,
+        'pages_per_second': stats['pages_crawled'] / elapsed,
+        'cpu_seconds': cpu,
+        'cpu_ms_per_page': 1000 * cpu / max(stats['pages_crawled'], 1),
+        # ru_maxrss is in KB on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+    })
+
+
+def benchmark_scenarios(args):
+    """Crawl each fixed scenario in fresh processes; save or compare the medians"""
+    concurrency = max(args.concurrency)
+    context = multiprocessing.get_context('spawn')
+    config = {'pages': args.pages, 'concurrency': concurrency, 'repeat': args.repeat,
+              'python': platform.python_version(), 'cpus': os.cpu_count()}
+    print(f"Scenarios, {args.pages} pages, x{concurrency}, median of {args.repeat} runs in fresh processes:")
+
+    results = {}
+    for name, settings in SCENARIOS.items():
+        runs = []
+        for _ in range(args.repeat):
+            site = SyntheticSite(pages=args.pages, **settings)
+            server, base_url = start_server(site)
+            work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+            queue = context.Queue()
+            try:
+                # Large enough to crawl the whole site, so every run does the same work
+                process = context.Process(target=run_scenario, args=(
+                    base_url, str(Path(work_dir) / name), 10 * args.pages, concurrency, queue))
+                process.start()
+                run = queue.get()
+                process.join()
+            finally:
+                server.shutdown()
+                shutil.rmtree(work_dir, ignore_errors=True)
+            run['requests'] = dict(site.requests)
+            runs.append(run)
+
+        result = {key: statistics.median(run[key] for run in runs) for key in runs[0] if key != 'requests'}
+        result['requests'] = runs[-1]['requests']
+        # Relative range across the runs: how noisy each measurement is here
+        result['spread'] = {key: (max(run[key] for run in runs) - min(run[key] for run in runs)) / result[key]
+                            for key in TRACKED if result[key]}
+        results[name] = result
+        print(f"  {name:<14} {result['pages_crawled']:>5.0f} pages  {result['pages_per_second']:8.1f} pages/s  "
+              f"CPU {result['cpu_ms_per_page']:6.2f} ms/page  peak RSS {result['peak_rss_mb']:6.1f} MB  "
+              f"(spread {max(result['spread'].values(), default=0):.0%})")
+        violations = result['requests'].get('disallowed', 0)
+        if violations:
+            print(f"  {'':<14} {violations} requests to paths disallowed by robots.txt")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+        print(f"  Saved to {args.save}")
+    if args.compare:
+        return compare_results(args.compare, config, results, args.tolerance)
+    return True
+
+
+def compare_results(baseline_file, config, results, tolerance):
+    """Print the change against a saved run; return False if anything regressed
+
+    A change only counts as a regression beyond both the tolerance and the
+    run-to-run spread the two runs measured, so a noisy machine does not
+    report regressions that are not there.
+    """
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline_file}:")
+    differences = [key for key in ('pages', 'concurrency', 'python', 'cpus')
+                   if baseline['config'].get(key) != config[key]]
+    if differences:
+        print(f"  Warning: runs differ in {', '.join(differences)}, results may not be comparable")
+
+    ok = True
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if not before:
+            print(f"  {name:<14} not in baseline")
+            continue
+        changes = []
+        for key, higher_is_better in TRACKED.items():
+            change = (result[key] - before[key]) / before[key] if before[key] else 0.0
+            noise = result['spread'].get(key, 0.0) + before.get('spread', {}).get(key, 0.0)
+            regressed = (-change if higher_is_better else change) > max(tolerance, noise)
+            ok = ok and not regressed
+            changes.append(f"{key} {change:+.1%}{' REGRESSION' if regressed else ''}")
+        print(f"  {name:<14} {', '.join(changes)}")
+    return ok
+
+
+# Logging set-ups for the logging benchmark; as logging is configured once
+# per process, each runs in a fresh one. 'synchronous' writes through plain
+# handlers on the crawl threads, as before background logging
+LOG_MODES = {
+    'off (WARNING)': dict(log_level=logging.WARNING),
+    'INFO, synchronous handlers': dict(log_level=logging.INFO, synchronous=True),
+    'INFO': dict(log_level=logging.INFO),
+    'INFO, 1 page in 10': dict(log_level=logging.INFO, log_sample=0.1),
+    'INFO, JSON lines': dict(log_level=logging.INFO, log_format='json'),
+}
+
+
+def run_logged_crawl(base_url, download_dir, max_pages, concurrency, crawler_kwargs, results):
+    """Child process: crawl with the given logging settings, console output discarded"""
+    sys.stderr = open(os.devnull, 'w')
+    crawler_kwargs = dict(crawler_kwargs)
+    if crawler_kwargs.pop('synchronous', False):
+        # start_background_logging leaves a root logger with handlers alone
+        Path(download_dir).mkdir(parents=True, exist_ok=True)
+        logging.basicConfig(level=crawler_kwargs['log_level'], format=TEXT_FORMAT, handlers=[
+            logging.FileHandler(Path(download_dir) / 'crawl_log.txt'), logging.StreamHandler()])
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    crawler = OFCACrawler(base_url=base_url, download_dir=download_dir, **crawler_kwargs)
+    crawler.crawl_site_async(max_pages=max_pages, concurrency=concurrency, per_host_limit=concurrency, delay=0.0)
+    logging.shutdown()
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (usage.ru_utime - start_usage.ru_utime) + (usage.ru_stime - start_usage.ru_stime)
+    log_file = Path(download_dir) / 'crawl_log.txt'
+    results.put({
+        'pages_per_second': crawler.crawl_stats['pages_crawled'] / elapsed,
+        'cpu_ms_per_page': 1000 * cpu / max(crawler.crawl_stats['pages_crawled'], 1),
+        'log_bytes': log_file.stat().st_size if log_file.exists() else 0,
+    })
+
+
+def benchmark_logging(args):
+    """Measure what logging costs the crawl, per logging set-up, against no per-page logging"""
+    concurrency = max(args.concurrency)
+    context = multiprocessing.get_context('spawn')
+    site = SyntheticSite(pages=args.pages, fanout=args.fanout, latency=0.0)
+    server, base_url = start_server(site)
+    print(f"Logging overhead, {args.pages} pages with no server latency, x{concurrency}, "
+          f"median of {args.repeat} runs in fresh processes:")
+
+    # Modes take turns, so drift in the machine's speed affects them all alike
+    runs = {label: [] for label in LOG_MODES}
+    try:
+        for _ in range(args.repeat):
+            for label, crawler_kwargs in LOG_MODES.items():
+                work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+                queue = context.Queue()
+                try:
+                    process = context.Process(target=run_logged_crawl, args=(
+                        base_url, str(Path(work_dir) / 'crawl'), args.pages, concurrency, crawler_kwargs, queue))
+                    process.start()
+                    runs[label].append(queue.get())
+                    process.join()
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        server.shutdown()
+
+    baseline = None
+    for label, mode_runs in runs.items():
+        result = {key: statistics.median(run[key] for run in mode_runs) for key in mode_runs[0]}
+        baseline = baseline or result
+        overhead = result['cpu_ms_per_page'] - baseline['cpu_ms_per_page']
+        print(f"  {label:<28} {result['pages_per_second']:8.1f} pages/s  "
+              f"CPU {result['cpu_ms_per_page']:6.2f} ms/page ({overhead:+.2f})  "
+              f"log {result['log_bytes'] / 1024:7.0f} KB")
+
+
+# Page storage set-ups for the compression benchmark: (page_compression,
+# whether the body arrived gzipped)
+PAGE_FORMATS = {
+    'plain .html': (None, False),
+    'gzip, kept as received': ('gzip', True),
+    'gzip, compressed here': ('gzip', False),
+    'zstd, compressed here': ('zstd', False),
+}
+
+
+def page_response(url, body, gzipped):
+    """A response for a page as fetch_once leaves it, optionally received gzipped"""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers['Content-Type'] = 'text/html; charset=utf-8'
+    response.encoding = 'utf-8'
+    response._content = body
+    response.raw_body = gzip.compress(body, mtime=0) if gzipped else None
+    return response
+
+
+def saved_pages_size(download_dir):
+    """(files, bytes, bytes allocated on disk) of the pages saved under a download directory"""
+    files = size = allocated = 0
+    for root, _, names in os.walk(download_dir):
+        for name in names:
+            if name.endswith(('.html', '.html.gz', '.html.zst')):
+                stat = os.stat(os.path.join(root, name))
+                files += 1
+                size += stat.st_size
+                allocated += stat.st_blocks * 512
+    return files, size, allocated
+
+
+def benchmark_compression(args):
+    """Compare plain .html files with compressed page storage: disk footprint and save throughput
+
+    Pages are saved straight from responses held in memory, so only saving
+    is timed.
+    """
+    site = SyntheticSite(pages=args.pages, fanout=args.fanout, latency=0.0, page_size=30 * 1024)
+    server, base_url = start_server(site)
+    print(f"Page storage, {args.pages} pages of about 30 KB, no deduplication, median of {args.repeat} runs:")
+
+    runs = {label: [] for label in PAGE_FORMATS}
+    try:
+        for _ in range(args.repeat):
+            for label, (compression, gzipped) in PAGE_FORMATS.items():
+                if label not in runs:
+                    continue
+                work_dir = tempfile.mkdtemp(prefix='ofca_bench_')
+                try:
+                    try:
+                        crawler = OFCACrawler(base_url=base_url, download_dir=str(Path(work_dir) / 'crawl'),
+                                              log_level=logging.WARNING, dedup=False, metrics_format=None,
+                                              page_compression=compression)
+                    except ImportError as e:
+                        print(f"  {label:<28} skipped: {e}")
+                        runs.pop(label)
+                        continue
+                    responses = [page_response(f"{base_url}{site.page_path(page_id)}",
+                                               site.page_body(page_id), gzipped) for page_id in range(args.pages)]
+                    start = time.perf_counter()
+                    for response in responses:
+                        crawler.save_response(response.url, response)
+                    elapsed = time.perf_counter() - start
+                    runs[label].append((elapsed, *saved_pages_size(crawler.download_dir)))
+                    crawler.state.close()
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        server.shutdown()
+
+    content_bytes = sum(len(site.page_body(page_id)) for page_id in range(args.pages))
+    baseline = None
+    for label, mode_runs in runs.items():
+        elapsed = statistics.median(run[0] for run in mode_runs)
+        files, size, allocated = mode_runs[-1][1:]
+        baseline = baseline or size
+        print(f"  {label:<28} {size / 2 ** 20:6.1f} MB ({size / baseline:4.0%})  "
+              f"{allocated / 2 ** 20:6.1f} MB allocated  {files / elapsed:7.0f} pages/s  "
+              f"{content_bytes / elapsed / 2 ** 20:6.1f} MB/s of HTML")
+
+
+BENCHMARKS = {
+    'modes': benchmark_modes,
+    'recrawl': benchmark_recrawl,
+    'links': benchmark_link_extraction,
+    'urlsets': benchmark_url_sets,
+    'shards': benchmark_shards,
+    'http2': benchmark_http2,
+    'scenarios': benchmark_scenarios,
+    'logging': benchmark_logging,
+    'compression': benchmark_compression,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OFCA crawler offline")
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--repeat', type=int, default=3, help="runs per scenario, the median is reported")
+    parser.add_argument('--save', metavar='FILE', help="save the scenario results as JSON")
+    parser.add_argument('--compare', metavar='FILE', help="compare the scenario results with a saved run")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="relative change counted as a regression (default 0.10)")
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    ok = True
+    for name in args.benchmarks or BENCHMARKS:
+        ok = BENCHMARKS[name](args) is not False and ok
+    # Non-zero exit status when a scenario regressed, e.g. for CI
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
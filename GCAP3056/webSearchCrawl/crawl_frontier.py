@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Crawl Frontier for the OFCA Crawler
+Decides which discovered page is crawled next, so that a crawl cut short by
+max_pages or a budget has spent it on the pages that matter most:
+
+    'bfs'       shallowest pages first, in discovery order within a level
+    'priority'  highest page score first (see url_score)
+
+Either mode can be limited to a maximum link depth from the seeds, and to a
+quota of pages per path prefix, e.g. {'/en/media_focus/': 200}. URLs matched
+by a `tail` predicate, such as the other language trees (see
+language_mirrors.py), are crawled only once nothing else is queued.
+"""
+
+import heapq
+import itertools
+from urllib.parse import urlparse
+
+FRONTIER_MODES = ('bfs', 'priority')
+# Heap key of tail URLs, after every depth and score
+TAIL_KEY = float('inf')
+
+
+def url_score(url, depth):
+    """Default page score for 'priority' mode: higher is crawled first
+
+    Prefers pages close to the seeds and high up the path hierarchy, and
+    section index pages over the articles below them.
+    """
+    path = urlparse(url).path
+    segments = [segment for segment in path.split('/') if segment]
+    score = -2.0 * depth - len(segments)
+    if not segments or segments[-1].startswith('index.'):
+        score += 1.0
+    return score
+
+
+class CrawlFrontier:
+    """Queue of URLs waiting to be crawled, with depth limit and per-prefix quotas
+
+    `discovered` is the URL set (plain or compact) of everything ever queued,
+    so a URL is only queued once per run.
+    """
+
+    def __init__(self, discovered, mode='bfs', max_depth=None, prefix_quotas=None, score=None, tail=None):
+        if mode not in FRONTIER_MODES:
+            raise ValueError(f"Unknown frontier mode {mode!r}, choose one of {', '.join(FRONTIER_MODES)}")
+        self.discovered = discovered
+        self.mode = mode
+        self.max_depth = max_depth
+        self.prefix_quotas = dict(prefix_quotas or {})
+        self.score = score or url_score
+        self.tail = tail
+
+        # Heap of (key, sequence, url, depth); the sequence keeps discovery
+        # order among equal keys and makes the tuples always comparable
+        self.heap = []
+        self.sequence = itertools.count()
+        # Depth of each URL handed out by pop() whose links are not back yet
+        self.in_progress = {}
+        self.prefix_counts = dict.fromkeys(self.prefix_quotas, 0)
+        self.stats = {'queued': 0, 'skipped_depth': 0, 'skipped_quota': 0, 'max_depth_seen': 0, 'tail_queued': 0}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+    def prefix_of(self, url):
+        """The longest quota prefix matching a URL's path, or None"""
+        path = urlparse(url).path
+        matches = [prefix for prefix in self.prefix_quotas if path.startswith(prefix)]
+        return max(matches, key=len) if matches else None
+
+    def count_prefix(self, url):
+        """Count a queued URL against its prefix quota"""
+        prefix = self.prefix_of(url)
+        if prefix is not None:
+            self.prefix_counts[prefix] += 1
+
+    def push(self, url, depth):
+        """Queue a URL without any checks, e.g. when restoring a saved frontier"""
+        if self.tail is not None and self.tail(url):
+            key = TAIL_KEY
+            self.stats['tail_queued'] += 1
+        else:
+            key = depth if self.mode == 'bfs' else -self.score(url, depth)
+        heapq.heappush(self.heap, (key, next(self.sequence), url, depth))
+        self.stats['queued'] += 1
+        self.stats['max_depth_seen'] = max(self.stats['max_depth_seen'], depth)
+
+    def restore(self, pending, queued_urls=()):
+        """Reload the frontier of an interrupted run
+
+        pending holds (url, depth) pairs still to crawl, and queued_urls every
+        URL queued so far, which counts against the prefix quotas.
+        """
+        for url in queued_urls:
+            self.count_prefix(url)
+        for url, depth in pending:
+            self.push(url, depth)
+
+    def pop(self):
+        """Return the next URL to crawl"""
+        _, _, url, depth = heapq.heappop(self.heap)
+        self.in_progress[url] = depth
+        return url
+
+    def add_links(self, url, links):
+        """Queue the links found on a crawled page; return the ones newly queued
+
+        Links already discovered, deeper than max_depth or beyond their
+        prefix quota are left out.
+        """
+        return self.queue_links(links, self.in_progress.pop(url, 0) + 1)
+
+    def queue_links(self, links, depth):
+        """Queue links found at a given depth; return the ones newly queued"""
+        new_links = set()
+        for link in sorted(links):
+            if link in self.discovered:
+                continue
+            if self.max_depth is not None and depth > self.max_depth:
+                self.stats['skipped_depth'] += 1
+                continue
+            prefix = self.prefix_of(link)
+            if prefix is not None:
+                if self.prefix_counts[prefix] >= self.prefix_quotas[prefix]:
+                    self.stats['skipped_quota'] += 1
+                    continue
+                self.prefix_counts[prefix] += 1
+            self.discovered.add(link)
+            self.push(link, depth)
+            new_links.add(link)
+        return new_links
+
+    def summary(self):
+        """Frontier settings and statistics for crawl_summary.json"""
+        return dict(self.stats, mode=self.mode, max_depth=self.max_depth, remaining=len(self.heap),
+                    prefix_quotas={prefix: {'quota': quota, 'queued': self.prefix_counts[prefix]}
+                                   for prefix, quota in self.prefix_quotas.items()})
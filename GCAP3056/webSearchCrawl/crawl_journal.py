@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Crawl Journal for the OFCA Crawler
+Appends one JSON line per finished page to crawl_journal.jsonl the moment the
+page is done, so the record of a crawl survives the process dying:
+
+    {"url": "https://www.ofca.gov.hk/en/home/index.html", "outcome": "crawled",
+     "status": 200, "bytes": 18211, "hash": "9f2c...", "links": 48,
+     "ms": {"queue_wait": 0.1, "connect": 3.2, "ttfb": 41.7, "download": 0.9, "save": 0.4, "parse": 2.1},
+     "at": "2025-03-01T10:15:02"}
+
+The outcome is crawled, unchanged (304), fresh (not fetched, saved after its
+sitemap lastmod), skipped (not HTML) or failed, with an "error". A crawled
+page that nearly duplicates an earlier one names it in "duplicate_of". Every
+checkpoint_interval seconds the running totals and the journal's length go to
+crawl_checkpoint.json, replaced in one step.
+
+crawl_summary.json is derived from the journal at the end of the run by
+streaming over it, so the visited and failed URL lists are never held in
+memory. A resumed run appends to the journal of the interrupted one; a new
+run moves the previous journal to crawl_journal.previous.jsonl.
+"""
+
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+OUTCOMES = ('crawled', 'unchanged', 'fresh', 'skipped', 'failed')
+
+
+def iter_journal(path):
+    """Yield the page entries of a journal, skipping a line cut off by a crash"""
+    try:
+        f = open(path, encoding='utf-8')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'url' in entry:
+                yield entry
+
+
+def write_summary(path, summary, journals):
+    """Write a crawl summary with visited_urls and failed_urls streamed from journals
+
+    summary holds everything but the URL lists. The journals are read once:
+    failed URLs wait in a temporary file, in memory up to 1 MB, until the
+    visited ones are written. The file is replaced in one step once complete.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f, \
+            tempfile.SpooledTemporaryFile(max_size=2 ** 20, mode='w+', encoding='utf-8') as failed:
+        # The summary's own closing brace is replaced by the two lists
+        f.write(json.dumps(summary, indent=2, ensure_ascii=False)[:-2])
+        f.write(',\n  "visited_urls": [')
+        separator = '\n    '
+        for journal in journals:
+            for entry in iter_journal(journal):
+                url = json.dumps(entry['url'], ensure_ascii=False)
+                f.write(separator + url)
+                separator = ',\n    '
+                if entry['outcome'] == 'failed':
+                    failed.write(url + '\n')
+        f.write('\n  ],\n  "failed_urls": [' if separator != '\n    ' else '],\n  "failed_urls": [')
+
+        failed.seek(0)
+        separator = '\n    '
+        for url in failed:
+            f.write(separator + url[:-1])
+            separator = ',\n    '
+        f.write('\n  ]\n}' if separator != '\n    ' else ']\n}')
+    os.replace(tmp_path, path)
+
+
+class CrawlJournal:
+    """Append-only JSONL log of page outcomes, with periodic checkpoints"""
+
+    def __init__(self, state_dir, checkpoint_interval=60.0):
+        self.path = Path(state_dir) / 'crawl_journal.jsonl'
+        self.checkpoint_path = Path(state_dir) / 'crawl_checkpoint.json'
+        self.checkpoint_interval = checkpoint_interval
+        self.run_id = None
+        self.file = None
+        self.totals = None
+        self.last_checkpoint = time.monotonic()
+
+    def journal_run(self):
+        """Run id in the header line of the existing journal, or None"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.loads(f.readline()).get('run')
+        except (OSError, ValueError):
+            return None
+
+    def open(self, run_id, resumed):
+        """Start journaling a run, continuing the journal of an interrupted one"""
+        self.close()
+        self.run_id = run_id
+        self.totals = dict.fromkeys(OUTCOMES, 0)
+        self.totals['bytes'] = 0
+
+        if resumed and self.journal_run() == run_id:
+            # Totals so far, and cut off a last line the crash left half-written
+            length = 0
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    length += len(line)
+                    entry = json.loads(line)
+                    if 'url' in entry:
+                        self.totals[entry['outcome']] += 1
+                        self.totals['bytes'] += entry.get('bytes', 0)
+            self.file = open(self.path, 'r+', encoding='utf-8')
+            self.file.truncate(length)
+            self.file.seek(length)
+            return
+
+        if self.path.exists():
+            os.replace(self.path, self.path.with_name('crawl_journal.previous.jsonl'))
+        self.file = open(self.path, 'w', encoding='utf-8')
+        self.write({'run': run_id, 'started': datetime.now().isoformat(timespec='seconds')})
+
+    def write(self, entry):
+        # Flushed per line: a crash loses at most the page being written
+        self.file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.file.flush()
+
+    def record(self, url, outcome, status=None, size=0, content_hash=None, links=None, timings=None,
+               error=None, duplicate_of=None):
+        """Append one page outcome; timings are seconds per request phase"""
+        entry = {'url': url, 'outcome': outcome}
+        if status is not None:
+            entry['status'] = status
+        if size:
+            entry['bytes'] = size
+        if content_hash:
+            entry['hash'] = content_hash
+        if links is not None:
+            entry['links'] = links
+        if timings:
+            entry['ms'] = {phase: round(seconds * 1000, 1) for phase, seconds in timings.items()}
+        if error is not None:
+            entry['error'] = error
+        if duplicate_of:
+            entry['duplicate_of'] = duplicate_of
+        entry['at'] = datetime.now().isoformat(timespec='seconds')
+        self.write(entry)
+        self.totals[outcome] += 1
+        self.totals['bytes'] += size
+
+    def maybe_checkpoint(self, **extra):
+        """Write a checkpoint once checkpoint_interval seconds have passed since the last one"""
+        if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint(**extra)
+
+    def checkpoint(self, **extra):
+        """Write the running totals and the journal length to crawl_checkpoint.json
+
+        extra adds fields, such as the frontier size or, at the end of the run,
+        the summary.
+        """
+        self.last_checkpoint = time.monotonic()
+        os.fsync(self.file.fileno())
+        checkpoint = {
+            'run': self.run_id,
+            'updated': datetime.now().isoformat(timespec='seconds'),
+            'journal_bytes': self.file.tell(),
+            'pages': {outcome: self.totals[outcome] for outcome in OUTCOMES},
+            'bytes': self.totals['bytes'],
+            **extra,
+        }
+        tmp_path = self.checkpoint_path.with_name(f'{self.checkpoint_path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
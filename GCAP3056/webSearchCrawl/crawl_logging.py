@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Background Logging for the OFCA Crawler
+Keeps log output off the crawl threads. Log calls only put the record on a
+queue; a listener thread formats it and writes it to crawl_log.txt and the
+console:
+
+    crawl threads --QueueHandler--> queue --QueueListener thread--> file, console
+
+Lines are plain text or, with log_format='json', one JSON object per line
+carrying the page URL as its own field. The per-page INFO lines (crawling,
+saved, links found, ...) can be sampled: with log_sample=0.1 they are
+written for one page in ten, chosen by a hash of the URL so every line of a
+sampled page is kept. Progress lines, warnings and errors are never sampled.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import zlib
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMATS = ('text', 'json')
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """QueueHandler leaving all formatting to the listener thread
+
+    The stock prepare() formats the message on the logging thread and clears
+    exc_info. The queue never leaves the process, so records go on it as
+    they are, with their args and exc_info, for the listener's formatters.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with the page URL when the record has one"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        url = getattr(record, 'url', None)
+        if url:
+            entry['url'] = url
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def make_formatter(log_format):
+    """The formatter for a log format name"""
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format {log_format!r}, choose one of {', '.join(LOG_FORMATS)}")
+    return JSONFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+
+
+def start_background_logging(log_file, level=logging.INFO, log_format='text'):
+    """Route the root logger through a queue to a file and the console, written by a background thread
+
+    Like logging.basicConfig, this does nothing if the root logger already
+    has handlers, e.g. from an earlier crawler in the same process. The
+    queue is drained when the process exits.
+    """
+    global _listener
+    formatter = make_formatter(log_format)
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(BackgroundQueueHandler(log_queue))
+    root.setLevel(level)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Runs before logging's own atexit hook, which would close the handlers first
+    atexit.register(stop_background_logging)
+
+
+def stop_background_logging():
+    """Write out the queued records and stop the listener thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+def page_sampled(url, rate):
+    """Whether the per-page lines of a URL are logged at a sampling rate between 0 and 1"""
+    return rate >= 1.0 or zlib.crc32(url.encode('utf-8')) < rate * 2 ** 32
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Crawl Metrics for the OFCA Crawler
+Times every page request phase by phase and aggregates the timings into
+histograms, so it is clear where crawl time goes:
+
+    queue_wait  URL taken from the frontier -> request sent (rate limits, breaker)
+    connect     opening a new connection, TLS included (reused connections skip it)
+    ttfb        request sent -> response headers in, less any connect time
+    download    reading the body
+    parse       extracting links
+    save        writing the page to disk or WARC
+
+Response status codes, errors and body bytes are counted alongside. The
+metrics are rewritten every few seconds to crawl_metrics.prom (Prometheus
+text format, e.g. for node_exporter's textfile collector) or
+crawl_metrics.json.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+PHASES = ('queue_wait', 'connect', 'ttfb', 'download', 'parse', 'save')
+# Upper bounds in seconds, Prometheus-style; the last bucket is +Inf
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_FORMATS = ('prometheus', 'json')
+
+
+class Histogram:
+    """Counts of observations per bucket, with their sum"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations up to it) pairs, ending with +Inf"""
+        total = 0
+        bounds = list(self.buckets) + [float('inf')]
+        pairs = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower = 0.0
+        previous = 0
+        for bound, total in self.cumulative():
+            if total >= rank:
+                if bound == float('inf'):
+                    return lower
+                within = (rank - previous) / (total - previous) if total > previous else 1.0
+                return lower + (bound - lower) * within
+            lower, previous = bound, total
+        return lower
+
+
+class CrawlMetrics:
+    """Phase histograms and counters for one crawl, written to a file periodically
+
+    Safe to update from the fetch threads; path=None keeps the metrics in
+    memory only, for the crawl summary.
+    """
+
+    def __init__(self, path=None, format='prometheus', interval=30.0):
+        if format not in METRICS_FORMATS:
+            raise ValueError(f"Unknown metrics format {format!r}, choose one of {', '.join(METRICS_FORMATS)}")
+        self.path = Path(path) if path else None
+        self.format = format
+        self.interval = interval
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.statuses = {}
+        self.errors = {}
+        self.bytes = 0
+        self.last_write = time.monotonic()
+        self._lock = threading.Lock()
+
+    def observe(self, phase, seconds):
+        """Record the duration of one request phase"""
+        with self._lock:
+            self.phases[phase].observe(max(seconds, 0.0))
+
+    @contextmanager
+    def timer(self, phase, record=None):
+        """Time the body of a with statement as one phase, also stored in the dict record"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            seconds = time.monotonic() - started
+            self.observe(phase, seconds)
+            if record is not None:
+                record[phase] = seconds
+
+    def count_response(self, status):
+        """Count a response by status code"""
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def count_bytes(self, size):
+        """Count body bytes read"""
+        with self._lock:
+            self.bytes += size
+
+    def count_error(self, error):
+        """Count a request that failed before or while its body was read, by exception type"""
+        name = type(error).__name__
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def maybe_write(self, pages=None):
+        """Rewrite the metrics file once `interval` seconds have passed since the last time"""
+        if self.path and time.monotonic() - self.last_write >= self.interval:
+            self.write(pages)
+
+    def write(self, pages=None):
+        """Rewrite the metrics file; pages adds page counts such as the crawl stats"""
+        if not self.path:
+            return
+        self.last_write = time.monotonic()
+        text = self.prometheus_text(pages) if self.format == 'prometheus' else json.dumps(
+            self.as_dict(pages), indent=2)
+        # Replaced in one step, so a scraper never reads half a file
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    def prometheus_text(self, pages=None):
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = ['# HELP ofca_crawl_phase_seconds Duration of each page request phase.',
+                     '# TYPE ofca_crawl_phase_seconds histogram']
+            for phase, histogram in self.phases.items():
+                for bound, total in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'ofca_crawl_phase_seconds_bucket{{phase="{phase}",le="{le}"}} {total}')
+                lines.append(f'ofca_crawl_phase_seconds_sum{{phase="{phase}"}} {histogram.sum:.6f}')
+                lines.append(f'ofca_crawl_phase_seconds_count{{phase="{phase}"}} {histogram.count}')
+
+            lines += ['# HELP ofca_crawl_responses_total Responses received, by HTTP status.',
+                      '# TYPE ofca_crawl_responses_total counter']
+            lines += [f'ofca_crawl_responses_total{{status="{status}"}} {count}'
+                      for status, count in sorted(self.statuses.items())]
+            lines += ['# HELP ofca_crawl_errors_total Requests that failed before or while the body was read, by error.',
+                      '# TYPE ofca_crawl_errors_total counter']
+            lines += [f'ofca_crawl_errors_total{{error="{error}"}} {count}'
+                      for error, count in sorted(self.errors.items())]
+            lines += ['# HELP ofca_crawl_body_bytes_total Response body bytes read.',
+                      '# TYPE ofca_crawl_body_bytes_total counter',
+                      f'ofca_crawl_body_bytes_total {self.bytes}']
+
+        if pages:
+            lines += ['# HELP ofca_crawl_pages Pages handled so far, by outcome.',
+                      '# TYPE ofca_crawl_pages gauge']
+            lines += [f'ofca_crawl_pages{{outcome="{outcome}"}} {count}' for outcome, count in pages.items()]
+        return '\n'.join(lines) + '\n'
+
+    def as_dict(self, pages=None):
+        """The metrics as a JSON-serialisable dict"""
+        with self._lock:
+            return {
+                'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'phases': {phase: {
+                    'count': histogram.count,
+                    'sum_seconds': round(histogram.sum, 6),
+                    'buckets': {('+Inf' if bound == float('inf') else str(bound)): total
+                                for bound, total in histogram.cumulative()},
+                } for phase, histogram in self.phases.items()},
+                'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                'errors': dict(self.errors),
+                'body_bytes': self.bytes,
+                'pages': dict(pages or {}),
+            }
+
+    def summary(self):
+        """Per-phase totals and estimated percentiles for crawl_summary.json"""
+        with self._lock:
+            phases = {}
+            for phase, histogram in self.phases.items():
+                if not histogram.count:
+                    continue
+                phases[phase] = {
+                    'count': histogram.count,
+                    'total_seconds': round(histogram.sum, 3),
+                    'mean_ms': round(1000 * histogram.sum / histogram.count, 2),
+                    'p50_ms': round(1000 * histogram.quantile(0.5), 2),
+                    'p95_ms': round(1000 * histogram.quantile(0.95), 2),
+                }
+            return {'phases': phases,
+                    'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                    'errors': dict(self.errors), 'body_bytes': self.bytes}
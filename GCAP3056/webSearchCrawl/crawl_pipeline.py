@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Staged Crawl Pipeline for the OFCA Crawler
+Runs fetching, link extraction and saving as separate stages so the network,
+the CPU and the disk are all kept busy:
+
+    coordinator -> fetch threads -> parse threads/process pool -> writer -> coordinator
+
+Stages are connected by bounded queues, so a slow stage blocks the one feeding
+it instead of letting pages pile up in memory. The coordinator thread owns the
+frontier and the crawl state database.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+from link_extractors import get_link_extractor
+from near_duplicates import page_fingerprint
+
+_STOP = object()
+_process_extractors = {}
+
+
+def parse_links(html_content, page_url, link_parser, fingerprint=False):
+    """Process-pool task: return the absolute link URLs found on a page, and its SimHash if asked for"""
+    if link_parser not in _process_extractors:
+        _process_extractors[link_parser] = get_link_extractor(link_parser)
+    links = _process_extractors[link_parser].extract(html_content, page_url)
+    return links, page_fingerprint(html_content) if fingerprint else None
+
+
+class CrawlPipeline:
+    """Fetch, parse and write stages driving an OFCACrawler"""
+
+    def __init__(self, crawler, fetch_workers=8, parse_workers=None, queue_size=16,
+                 per_host_limit=4, delay=0.0):
+        self.crawler = crawler
+        self.logger = crawler.logger
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 2
+        self.limiter = crawler.make_rate_limiter(per_host_limit, delay)
+
+        self.queues = {
+            'fetch': queue.Queue(maxsize=queue_size),
+            'parse': queue.Queue(maxsize=queue_size),
+            'write': queue.Queue(maxsize=queue_size),
+        }
+        self.peak_depth = dict.fromkeys(self.queues, 0)
+        # Results go back to the coordinator unbounded, so the writer never
+        # blocks; the coordinator caps how many pages are in the pipeline
+        self.results = queue.Queue()
+        self.max_in_pipeline = 3 * queue_size + fetch_workers + self.parse_workers + 1
+        self.threads = []
+
+    def put(self, stage, item):
+        """Put an item on a stage queue, blocking while it is full"""
+        self.queues[stage].put(item)
+        self.peak_depth[stage] = max(self.peak_depth[stage], self.queues[stage].qsize())
+
+    def queue_depths(self):
+        """Current depth of every stage queue"""
+        return {stage: q.qsize() for stage, q in self.queues.items()}
+
+    def fetch_worker(self):
+        """Fetch stage: download pages and pass HTML on to the parse stage"""
+        while True:
+            item = self.queues['fetch'].get()
+            if item is _STOP:
+                return
+            url, headers, queued = item
+            try:
+                with self.limiter.hold(urlparse(url).netloc):
+                    self.crawler.log_page(url, "Crawling: %s", url)
+                    response = self.crawler.fetch_page(url, headers, queued)
+            except Exception as e:
+                # Any error must still come back, or the coordinator waits forever
+                self.results.put(('failed', url, e))
+                continue
+
+            # Unchanged and non-HTML pages have nothing to parse or write
+            if response.status_code == 304 or not self.crawler.is_html(response):
+                self.results.put(('fetched', url, response))
+            else:
+                self.put('parse', (url, response))
+
+    def parse_worker(self, pool, link_parser):
+        """Parse stage: extract links, and fingerprint near-duplicates, in the process pool"""
+        fingerprint = self.crawler.near_duplicates is not None
+        while True:
+            item = self.queues['parse'].get()
+            if item is _STOP:
+                return
+            url, response = item
+            try:
+                with self.crawler.metrics.timer('parse', response.timings):
+                    links = pool.submit(parse_links, response.text, url, link_parser, fingerprint).result()
+            except Exception as e:
+                self.logger.error(f"Error extracting links from {url}: {e}")
+                links = ([], None)
+            self.put('write', (url, response, links))
+
+    def writer(self):
+        """Write stage: save HTML pages to disk"""
+        while True:
+            item = self.queues['write'].get()
+            if item is _STOP:
+                return
+            url, response, (links, fingerprint) = item
+            with self.crawler.metrics.timer('save', response.timings):
+                content_hash = self.crawler.save_response(url, response)
+            self.results.put(('saved', url, (response, content_hash, links, fingerprint)))
+
+    def handle_result(self, kind, url, payload):
+        """Apply a finished page to the crawler and return its links"""
+        crawler = self.crawler
+        if kind == 'fresh':
+            return payload
+        if kind == 'failed':
+            crawler.record_failure(url, payload)
+            return set()
+        if kind == 'fetched':
+            return crawler.process_response(url, payload)
+
+        response, content_hash, raw_links, fingerprint = payload
+        # Only counts the bytes: the fetch stage has already checked it is HTML
+        crawler.accept_response(url, response)
+        return crawler.record_page(url, response, content_hash, crawler.filter_links(raw_links, url), fingerprint)
+
+    def start(self, pool):
+        """Start the worker threads of every stage"""
+        stages = ([('fetch', self.fetch_worker, ())] * self.fetch_workers
+                  + [('parse', self.parse_worker, (pool, self.crawler.link_extractor.name))] * self.parse_workers
+                  + [('write', self.writer, ())])
+        for stage, target, args in stages:
+            thread = threading.Thread(target=target, args=args, name=f'{stage}-stage', daemon=True)
+            thread.start()
+            self.threads.append((stage, thread))
+
+    def stop(self):
+        """Shut the stages down in order once the pipeline is empty"""
+        for stage in self.queues:
+            workers = [thread for name, thread in self.threads if name == stage]
+            for _ in workers:
+                self.queues[stage].put(_STOP)
+            for thread in workers:
+                thread.join()
+
+    def run(self, max_pages):
+        """Crawl up to max_pages pages through the pipeline"""
+        crawler = self.crawler
+        frontier = crawler.start_crawl()
+        in_pipeline = 0
+        completed = 0
+
+        crawler.configure_connection_pool(self.fetch_workers)
+        self.logger.info(f"Starting pipelined crawl of {crawler.base_url}")
+        self.logger.info(f"Max pages: {max_pages}, Fetch workers: {self.fetch_workers}, "
+                         f"Parse workers: {self.parse_workers}")
+
+        # Spawned rather than forked: the stage threads are already running
+        pool = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+        self.start(pool)
+        try:
+            while frontier or in_pipeline:
+                # Keep the pipeline full, up to its capacity
+                while (frontier and in_pipeline < self.max_in_pipeline
+                       and not crawler.budget_exhausted(max_pages)):
+                    current_url = frontier.pop()
+                    if current_url in crawler.visited_urls:
+                        continue
+                    crawler.visited_urls.add(current_url)
+                    fresh_links = crawler.fresh_links(current_url)
+                    if fresh_links is not None:
+                        # Nothing to fetch; report it back like a finished page
+                        self.results.put(('fresh', current_url, fresh_links))
+                    else:
+                        self.put('fetch', (current_url, crawler.conditional_headers(current_url),
+                                           time.monotonic()))
+                    in_pipeline += 1
+
+                if not in_pipeline:
+                    break
+
+                kind, url, payload = self.results.get()
+                in_pipeline -= 1
+                completed += 1
+
+                # Add new links to crawl queue
+                new_links = frontier.add_links(url, self.handle_result(kind, url, payload))
+                crawler.finish_page(url, new_links)
+
+                # Progress update
+                if completed % 10 == 0:
+                    depths = ', '.join(f"{stage}={depth}" for stage, depth in self.queue_depths().items())
+                    self.logger.info(f"Progress: {len(crawler.visited_urls) - in_pipeline} pages crawled, "
+                                     f"{len(frontier)} remaining in queue, queue depths: {depths}, "
+                                     f"{self.limiter.describe()}")
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        self.stop()
+        pool.shutdown()
+        crawler.crawl_stats['pipeline'] = {
+            'fetch_workers': self.fetch_workers,
+            'parse_workers': self.parse_workers,
+            'peak_queue_depth': dict(self.peak_depth),
+        }
+        crawler.finish_crawl()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Persistent Crawl State for the OFCA Crawler
+Keeps the crawl frontier and the visited/failed pages in a single SQLite file,
+updated in one transaction per finished page, so an interrupted crawl can be
+resumed without downloading the pages it already saved. The same file holds
+a per-URL manifest of validators and extracted links that outlives each run,
+used to re-crawl with conditional GETs
+"""
+
+import json
+import sqlite3
+from datetime import datetime
+
+
+class CrawlStateStore:
+    """SQLite-backed frontier and visited-page store"""
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.create_tables()
+        self.run_id = None
+
+    def create_tables(self):
+        """Create the state tables if this is a new database"""
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    base_url TEXT NOT NULL,
+                    started_at TEXT NOT NULL,
+                    finished_at TEXT
+                )''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    depth INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    lastmod TEXT
+                )''')
+            self.add_missing_columns('urls', {'lastmod': 'TEXT'})
+            self.conn.execute('CREATE INDEX IF NOT EXISTS urls_status ON urls (status)')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS manifest (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT NOT NULL,
+                    local_path TEXT NOT NULL,
+                    links TEXT NOT NULL,
+                    fetched_at TEXT NOT NULL
+                )''')
+
+    def add_missing_columns(self, table, columns):
+        """Add columns introduced after a state file was first created"""
+        existing = {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+        for name, column_type in columns.items():
+            if name not in existing:
+                self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+    def unfinished_run(self, base_url):
+        """Return (id, started_at) of the latest run that never finished, if any"""
+        row = self.conn.execute(
+            'SELECT id, started_at, finished_at FROM runs WHERE base_url = ? ORDER BY id DESC LIMIT 1',
+            (base_url,)).fetchone()
+        if row and row[2] is None:
+            return row[0], datetime.fromisoformat(row[1])
+        return None
+
+    def begin_run(self, base_url, seeds, resume=True):
+        """Start or resume a run; return its start time and whether it was resumed
+
+        An unfinished run for the same base URL is continued when `resume`
+        is set. Otherwise the URL table is cleared and seeded afresh from
+        `seeds`, an iterable of (url, lastmod) pairs that is only consumed
+        for a new run, so it can lazily stream from sitemaps.
+        """
+        previous = self.unfinished_run(base_url) if resume else None
+        if previous:
+            self.run_id, started_at = previous
+            return started_at, True
+
+        started_at = datetime.now()
+        with self.conn:
+            self.conn.execute('DELETE FROM urls')
+            cursor = self.conn.execute('INSERT INTO runs (base_url, started_at) VALUES (?, ?)',
+                                       (base_url, started_at.isoformat()))
+            self.run_id = cursor.lastrowid
+            now = started_at.isoformat()
+            self.conn.executemany(
+                'INSERT INTO urls (url, depth, status, updated_at, lastmod) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (url) DO UPDATE SET lastmod = COALESCE(excluded.lastmod, urls.lastmod)',
+                ((url, 0, self.PENDING, now, lastmod.isoformat() if lastmod else None)
+                 for url, lastmod in seeds))
+        return started_at, False
+
+    def _add_pending(self, urls, depth):
+        now = datetime.now().isoformat()
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO urls (url, depth, status, updated_at) VALUES (?, ?, ?, ?)',
+            ((url, depth, self.PENDING, now) for url in urls))
+
+    def add_pending(self, urls, depth):
+        """Queue URLs found by another process, e.g. another shard of the crawl"""
+        with self.conn:
+            self._add_pending(urls, depth)
+
+    def complete_page(self, url, failed, new_links):
+        """Record a finished page and queue its new links in one transaction"""
+        now = datetime.now().isoformat()
+        with self.conn:
+            row = self.conn.execute('SELECT depth FROM urls WHERE url = ?', (url,)).fetchone()
+            depth = row[0] if row else 0
+            self.conn.execute(
+                'INSERT INTO urls (url, depth, status, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (url) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at',
+                (url, depth, self.FAILED if failed else self.DONE, now))
+            self._add_pending(new_links, depth + 1)
+
+    def finish_run(self):
+        """Mark the current run as finished, so the next one starts afresh"""
+        with self.conn:
+            self.conn.execute('UPDATE runs SET finished_at = ? WHERE id = ?',
+                              (datetime.now().isoformat(), self.run_id))
+
+    def urls_with_status(self, status):
+        """Return the URLs currently in the given status, oldest first"""
+        rows = self.conn.execute('SELECT url FROM urls WHERE status = ? ORDER BY rowid', (status,))
+        return [row[0] for row in rows]
+
+    def pending_urls(self):
+        """Return (url, depth) for every URL still waiting to be crawled, oldest first"""
+        rows = self.conn.execute('SELECT url, depth FROM urls WHERE status = ? ORDER BY rowid', (self.PENDING,))
+        return [(row[0], row[1]) for row in rows]
+
+    def lastmod(self, url):
+        """Return the sitemap lastmod recorded for a URL as an aware datetime, or None"""
+        row = self.conn.execute('SELECT lastmod FROM urls WHERE url = ?', (url,)).fetchone()
+        return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+    def all_urls(self):
+        """Return every URL discovered in the current run"""
+        return [row[0] for row in self.conn.execute('SELECT url FROM urls')]
+
+    def manifest_entry(self, url):
+        """Return the manifest record of a previously saved page, or None"""
+        row = self.conn.execute(
+            'SELECT etag, last_modified, content_hash, local_path, links, fetched_at '
+            'FROM manifest WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'etag': row[0],
+            'last_modified': row[1],
+            'content_hash': row[2],
+            'local_path': row[3],
+            'links': json.loads(row[4]),
+            'fetched_at': row[5],
+        }
+
+    def manifest_entries(self):
+        """Yield (url, content_hash, local_path, fetched_at) for every saved page"""
+        yield from self.conn.execute('SELECT url, content_hash, local_path, fetched_at FROM manifest')
+
+    def update_manifest(self, url, etag, last_modified, content_hash, local_path, links):
+        """Record the validators, content hash and links of a freshly saved page"""
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO manifest '
+                '(url, etag, last_modified, content_hash, local_path, links, fetched_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, content_hash, str(local_path),
+                 json.dumps(sorted(links)), datetime.now().isoformat()))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Document Downloads for the OFCA Crawler
+PDFs and office documents linked from crawled pages are fetched in a lane of
+their own, beside the HTML crawl rather than in its frontier:
+
+    crawl --document links--> queue --download threads--> ofca_crawl/en/.../report.pdf
+                                                   \\--> on_download(entry), on a handoff thread
+
+The lane has its own threads and its own connection pool, so a 50 MB PDF
+never holds up a page. Each request still takes a start slot from the
+crawl's per-host rate limiter, so pages and documents together keep to the
+crawl's delay and Crawl-delay, but only a slot no page fetch is waiting
+for: with a delay, documents fill the gaps the pages leave. max_bandwidth
+caps the bytes per second the lane takes from the link the crawl shares,
+5 MB/s by default. Each file is streamed into a
+.part file under the crawl state's downloads/ directory. A download cut
+short, by an error or by the crawler stopping, resumes where it left off
+with a Range request; If-Range makes the server send the whole file instead
+if it has changed since. A finished file gets a SHA-256 and is moved into
+the page tree.
+
+downloads.sqlite3 is the manifest: one row per document with its state,
+size, checksum, content type and the page it was found on. It is written
+out as download_manifest.json at the end of the crawl, and the next crawl
+picks up whatever is still pending or failed on a transient error (a
+timeout, a dropped connection, a 429 or 5xx). Documents already downloaded,
+and those rejected for good (a 404 or 410, say, or over the size limit),
+are not fetched again.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import HostRateLimiter, parse_retry_after
+from retry_policy import RetryPolicy
+
+DOCUMENT_EXTENSIONS = ('.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx')
+
+_STOP = None
+
+
+class DocumentTooLarge(requests.RequestException):
+    """A document larger than the lane's max_size"""
+
+
+class DownloadStore:
+    """SQLite manifest of documents and their download state, shared by the download threads"""
+
+    PENDING = 'pending'
+    DONE = 'done'
+    # Failed on a transient error, tried again by the next crawl
+    FAILED = 'failed'
+    # Failed for good, e.g. not found or too large
+    REJECTED = 'rejected'
+    FIELDS = ('url', 'status', 'found_on', 'local_path', 'bytes', 'sha256', 'content_type', 'validator',
+              'resumed', 'error', 'updated_at')
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._lock = threading.Lock()
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS downloads (
+                    url TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    found_on TEXT,
+                    local_path TEXT NOT NULL,
+                    bytes INTEGER NOT NULL DEFAULT 0,
+                    sha256 TEXT,
+                    content_type TEXT,
+                    validator TEXT,
+                    resumed INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at TEXT NOT NULL
+                )''')
+
+    def add(self, url, found_on, local_path):
+        """Record a newly found document; return False if it is already known"""
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO downloads (url, status, found_on, local_path, updated_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (url, self.PENDING, found_on, str(local_path), datetime.now().isoformat()))
+            return cursor.rowcount > 0
+
+    def update(self, url, **fields):
+        fields['updated_at'] = datetime.now().isoformat()
+        with self._lock, self.conn:
+            self.conn.execute(f"UPDATE downloads SET {', '.join(f'{name} = ?' for name in fields)} WHERE url = ?",
+                              (*fields.values(), url))
+
+    def entry(self, url):
+        with self._lock:
+            row = self.conn.execute(f"SELECT {', '.join(self.FIELDS)} FROM downloads WHERE url = ?",
+                                    (url,)).fetchone()
+        return dict(zip(self.FIELDS, row)) if row else None
+
+    def urls_with_status(self, status):
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT url FROM downloads WHERE status = ? ORDER BY rowid', (status,))]
+
+    def entries(self):
+        """Every document in the manifest, in the order found"""
+        with self._lock:
+            rows = self.conn.execute(f"SELECT {', '.join(self.FIELDS)} FROM downloads ORDER BY rowid").fetchall()
+        return [dict(zip(self.FIELDS, row)) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            return dict(self.conn.execute('SELECT status, COUNT(*) FROM downloads GROUP BY status'))
+
+    def close(self):
+        self.conn.close()
+
+
+class DocumentDownloader:
+    """Download lane for the documents a crawl finds
+
+    local_path maps a document URL to where it is saved, and headers are
+    sent with every request. on_download is called with the manifest entry
+    of every finished file, one at a time on a thread of its own, so slow
+    handlers (such as a PDF to Markdown converter) hold up neither the
+    downloads nor the crawl.
+    """
+
+    def __init__(self, state_dir, local_path, headers=None, workers=2, delay=0.0, host_delay=None,
+                 retries=3, backoff=1.0, max_size=500 * 2 ** 20, max_bandwidth=5 * 2 ** 20,
+                 chunk_size=256 * 2 ** 10, on_download=None, logger=None):
+        self.part_dir = Path(state_dir) / 'downloads'
+        self.part_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = Path(state_dir) / 'download_manifest.json'
+        self.store = DownloadStore(Path(state_dir) / 'downloads.sqlite3')
+        self.local_path = local_path
+        self.workers = workers
+        self.max_size = max_size
+        # Bytes per second for the whole lane, None for no limit
+        self.max_bandwidth = max_bandwidth
+        self.bandwidth_clock = 0.0
+        self.chunk_size = chunk_size
+        self.on_download = on_download
+        self.logger = logger
+
+        # A session of its own, made by start(); documents are asked for
+        # uncompressed, so byte ranges mean what they say
+        self.headers = dict(headers or {}, **{'Accept': '*/*', 'Accept-Encoding': 'identity'})
+        self.session = None
+        # Spaces the lane's own requests, also when there is no crawl to pace it
+        self.rate_limiter = HostRateLimiter(per_host_limit=workers, delay=delay, host_delay=host_delay)
+        # The crawl's own limiter, set by start(), for pacing shared with the pages
+        self.pacer = None
+        self.retry_policy = RetryPolicy(retries=retries, backoff=backoff)
+
+        self.queue = queue.Queue()
+        self.handoff = queue.Queue()
+        self.threads = []
+        self.stats = {'found': 0, 'downloaded': 0, 'failed': 0, 'resumed': 0, 'bytes': 0,
+                      'handed_off': 0, 'handoff_errors': 0}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self.running = False
+        self.started = None
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def start(self, pacer=None):
+        """Start the download threads, queueing what an earlier crawl left pending or failed on
+
+        pacer is the crawl's rate limiter: every download also waits there
+        for a start slot no page fetch has booked, so the crawl and the lane
+        do not each take the host's full request rate, and pages go first. Starting a running lane only sets the
+        pacer, and a lane stopped by close() starts again with a new session.
+        """
+        with self._start_lock:
+            if pacer:
+                self.pacer = pacer
+            if self.running:
+                return
+            self.running = True
+            self.started = self.started or time.monotonic()
+
+            # A connection per download thread
+            self.session = requests.Session()
+            self.session.headers.update(self.headers)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, self.workers), max_retries=0)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+            for status in (DownloadStore.PENDING, DownloadStore.FAILED):
+                for url in self.store.urls_with_status(status):
+                    self.queue.put(url)
+            self.threads = [threading.Thread(target=self.work, name=f'download-{i}', daemon=True)
+                            for i in range(self.workers)]
+            if self.on_download:
+                self.threads.append(threading.Thread(target=self.hand_off, name='download-handoff', daemon=True))
+            for thread in self.threads:
+                thread.start()
+
+    def add(self, url, found_on=None):
+        """Queue a document link, unless it is known from this or an earlier crawl
+
+        The lane starts on the first document, e.g. one found by a single
+        crawl_page call outside a crawl.
+        """
+        # Started first, as starting queues every pending document
+        self.start()
+        if self.store.add(url, found_on, self.local_path(url)):
+            self.count('found')
+            self.queue.put(url)
+
+    def pending(self):
+        """Documents queued or downloading"""
+        return self.queue.unfinished_tasks
+
+    def work(self):
+        """Download thread: fetch queued documents until told to stop"""
+        while True:
+            url = self.queue.get()
+            try:
+                if url is _STOP:
+                    return
+                self.download(url)
+            finally:
+                self.queue.task_done()
+
+    def download(self, url):
+        """Fetch one document, retrying transient errors from where the last attempt stopped"""
+        for attempt in range(self.retry_policy.retries + 1):
+            try:
+                entry = self.fetch(url)
+            except requests.RequestException as e:
+                transient = self.retry_policy.is_transient(e)
+                if transient and attempt < self.retry_policy.retries:
+                    self.retry_policy.count('retries')
+                    time.sleep(self.retry_policy.delay(attempt))
+                    continue
+                if transient:
+                    self.retry_policy.count('gave_up')
+                elif isinstance(e, DocumentTooLarge):
+                    self.part_path(url).unlink(missing_ok=True)
+                self.fail(url, e, transient)
+                return
+            except OSError as e:
+                # A full or unwritable disk may be fixed by the next crawl
+                self.fail(url, e, transient=True)
+                return
+            if attempt:
+                self.retry_policy.count('recovered')
+            self.count('downloaded')
+            if self.logger:
+                self.logger.info(f"Downloaded: {url} ({entry['bytes']:,} bytes)", extra={'url': url})
+            if self.on_download:
+                self.handoff.put(entry)
+            return
+
+    def fail(self, url, error, transient):
+        """Mark a document failed, to be tried again by the next crawl only if transient"""
+        status = DownloadStore.FAILED if transient else DownloadStore.REJECTED
+        self.store.update(url, status=status, error=str(error))
+        self.count('failed')
+        if self.logger:
+            action = 'download' if isinstance(error, requests.RequestException) else 'save'
+            self.logger.error(f"Failed to {action} {url}: {error}", extra={'url': url})
+
+    def part_path(self, url):
+        """Where a document is downloaded to before it is complete"""
+        return self.part_dir / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.part')
+
+    def fetch(self, url):
+        """Make one attempt at a document, resuming a partial download; return its manifest entry"""
+        entry = self.store.entry(url)
+        part_path = self.part_path(url)
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {}
+        if offset and entry['validator']:
+            headers = {'Range': f'bytes={offset}-', 'If-Range': entry['validator']}
+
+        host = urlparse(url).netloc
+        with self.rate_limiter.hold(host):
+            if self.pacer:
+                self.pacer.wait_spare(host)
+            response = self.session.get(url, headers=headers, stream=True, timeout=30)
+        with response:
+            self.rate_limiter.record(host, status=response.status_code,
+                                     retry_after=parse_retry_after(response.headers.get('retry-after')))
+            if response.status_code == 416 and offset:
+                # The part file is already as long as the document; start over
+                part_path.unlink()
+                return self.fetch(url)
+            response.raise_for_status()
+            resumed = response.status_code == 206 and response.headers.get(
+                'content-range', '').startswith(f'bytes {offset}-')
+            if not resumed:
+                offset = 0
+            declared = response.headers.get('content-length', '')
+            if declared.isdigit() and offset + int(declared) > self.max_size:
+                raise DocumentTooLarge(f"{url} is {offset + int(declared):,} bytes, "
+                                       f"over the {self.max_size:,} byte limit")
+
+            # If-Range needs a strong validator: an ETag that is not weak, else the date
+            etag = response.headers.get('etag', '')
+            validator = etag if etag and not etag.startswith('W/') else response.headers.get('last-modified')
+            self.store.update(url, validator=validator, content_type=response.headers.get('content-type'))
+
+            size = offset
+            with open(part_path, 'ab' if resumed else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise DocumentTooLarge(f"{url} is over the {self.max_size:,} byte limit")
+                    f.write(chunk)
+                    self.count('bytes', len(chunk))
+                    self.throttle(len(chunk))
+
+        if resumed:
+            self.count('resumed')
+        sha256 = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(self.chunk_size), b''):
+                sha256.update(block)
+
+        local_path = Path(entry['local_path'])
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(part_path, local_path)
+        except OSError:
+            # The state directory may be on another file system
+            shutil.move(str(part_path), str(local_path))
+        self.store.update(url, status=DownloadStore.DONE, bytes=size, sha256=sha256.hexdigest(),
+                          resumed=int(resumed) + entry['resumed'], error=None)
+        return self.store.entry(url)
+
+    def throttle(self, size):
+        """Sleep while the lane is ahead of max_bandwidth, counting size bytes just read"""
+        if not self.max_bandwidth:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.bandwidth_clock = max(self.bandwidth_clock, now) + size / self.max_bandwidth
+            wait = self.bandwidth_clock - now
+        if wait > 0:
+            time.sleep(wait)
+
+    def hand_off(self):
+        """Handoff thread: pass finished downloads to on_download in the order they finish"""
+        while True:
+            entry = self.handoff.get()
+            if entry is _STOP:
+                return
+            try:
+                self.on_download(entry)
+                self.count('handed_off')
+            except Exception as e:
+                self.count('handoff_errors')
+                if self.logger:
+                    self.logger.error(f"on_download failed for {entry['url']}: {e}", extra={'url': entry['url']})
+
+    def close(self):
+        """Finish the queued downloads and handoffs, stop the threads and write the manifest
+
+        The manifest database stays open for summary(), and for start() or
+        add() to run the lane again.
+        """
+        with self._start_lock:
+            if self.running:
+                for _ in range(self.workers):
+                    self.queue.put(_STOP)
+                for thread in self.threads[:self.workers]:
+                    thread.join()
+                if self.on_download:
+                    self.handoff.put(_STOP)
+                    self.threads[-1].join()
+                self.session.close()
+                self.running = False
+            self.write_manifest()
+
+    def write_manifest(self):
+        """Write the manifest to download_manifest.json, replaced in one step"""
+        tmp_path = self.manifest_path.with_name(f'{self.manifest_path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.store.entries(), f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def summary(self):
+        """Counts, pace and retries for crawl_summary.json"""
+        with self._lock:
+            summary = dict(self.stats)
+        seconds = time.monotonic() - self.started if self.started else None
+        summary.update(
+            workers=self.workers,
+            max_bandwidth=self.max_bandwidth,
+            manifest=self.store.counts(),
+            megabytes_per_second=round(summary['bytes'] / seconds / 2 ** 20, 2) if seconds else None,
+            retries=self.retry_policy.summary(),
+        )
+        return summary
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+HTTP Client Backends for the OFCA Crawler
+The layer OFCACrawler fetches pages through. Every backend sends a GET and
+returns a requests.Response as soon as the headers are in, with the body
+still unread, so streaming, saving, WARC output and retries work the same
+whichever client made the request:
+
+    'requests'  requests.Session, HTTP/1.1 with one connection per request in flight
+    'httpx'     httpx.Client with HTTP/2, many requests multiplexed over a few
+                connections (optional: pip install "httpx[http2]")
+
+robots.txt and sitemaps are always read through the crawler's requests
+session. Responses carry a connect_time attribute: the seconds spent
+opening a new connection for the request, or None if one was reused.
+"""
+
+import threading
+import time
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Connection-level headers, which HTTP/2 forbids
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+# Time spent connecting by the current thread's request; urllib3 connects
+# on the thread that sends the request
+_connect_timer = threading.local()
+
+
+class TimedConnectionMixin:
+    """Records how long connect() takes, TLS handshake included"""
+
+    def connect(self):
+        started = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect_timer.seconds = (getattr(_connect_timer, 'seconds', None) or 0.0) + time.monotonic() - started
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record their connect time"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+
+class RequestsBackend:
+    """Fetches through the crawler's requests.Session"""
+
+    name = 'requests'
+
+    def __init__(self, session):
+        self.session = session
+
+    def configure_pool(self, pool_size):
+        """Give every request thread a keep-alive connection of its own
+
+        A few hosts (the site, plus sitemaps or redirects elsewhere) are
+        pooled at once. Retries are left to the crawler, which paces them.
+        """
+        adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size), max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, headers=None, timeout=30):
+        """Send a GET; return the response with its body unread"""
+        _connect_timer.seconds = None
+        response = self.session.get(url, headers=headers, timeout=timeout, stream=True)
+        response.connect_time = _connect_timer.seconds
+        return response
+
+    def summary(self):
+        return {'backend': self.name}
+
+
+class HttpxBody:
+    """Stands in for a requests response's raw stream, reading from httpx"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def stream(self, chunk_size, decode_content=True):
+        import httpx
+
+        try:
+            if decode_content:
+                yield from self.response.iter_bytes(chunk_size)
+            else:
+                yield from self.response.iter_raw(chunk_size)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.DecodingError as e:
+            raise requests.exceptions.ContentDecodingError(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+    def close(self):
+        self.response.close()
+
+
+class HttpxBackend:
+    """Fetches through an httpx.Client speaking HTTP/2 where the server does
+
+    Over https the protocol is negotiated by ALPN. prior_knowledge=True
+    speaks HTTP/2 straight away, also over plain http (h2c), e.g. to a
+    local test server.
+    """
+
+    name = 'httpx'
+
+    def __init__(self, session, http2=True, prior_knowledge=False):
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError('The httpx backend needs httpx with HTTP/2 support: pip install "httpx[http2]"')
+        self.httpx = httpx
+        self.http2 = http2
+        self.prior_knowledge = prior_knowledge
+        self.headers = {name: value for name, value in session.headers.items()
+                        if name.lower() not in HOP_BY_HOP_HEADERS}
+        self.versions = Counter()
+        self._lock = threading.Lock()
+        self.client = None
+        self.configure_pool(1)
+
+    def configure_pool(self, pool_size):
+        """Allow up to pool_size connections; HTTP/2 rarely needs more than one"""
+        if self.client:
+            self.client.close()
+        limits = self.httpx.Limits(max_connections=max(1, pool_size), max_keepalive_connections=max(1, pool_size))
+        self.client = self.httpx.Client(http1=not self.prior_knowledge, http2=self.http2, headers=self.headers,
+                                        limits=limits, follow_redirects=True)
+
+    def get(self, url, headers=None, timeout=30):
+        """Send a GET; return it as a requests.Response with its body unread"""
+        httpx = self.httpx
+        events = {}
+
+        def trace(event, info):
+            events[event] = time.monotonic()
+
+        request = self.client.build_request('GET', url, headers=headers, timeout=timeout,
+                                            extensions={'trace': trace})
+        try:
+            response = self.client.send(request, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+        except httpx.HTTPError as e:
+            raise requests.RequestException(str(e)) from e
+
+        with self._lock:
+            self.versions[response.http_version] += 1
+
+        converted = requests.Response()
+        converted.status_code = response.status_code
+        converted.reason = response.reason_phrase
+        converted.headers = CaseInsensitiveDict(response.headers)
+        converted.encoding = get_encoding_from_headers(converted.headers)
+        converted.url = str(response.url)
+        converted.raw = HttpxBody(response)
+        converted.connect_time = None
+        for step in ('connection.connect_tcp', 'connection.start_tls'):
+            if f'{step}.complete' in events:
+                converted.connect_time = ((converted.connect_time or 0.0)
+                                          + events[f'{step}.complete'] - events[f'{step}.started'])
+        # What the WARC request record describes
+        converted.request = requests.Request(
+            'GET', str(response.request.url), headers=dict(response.request.headers)).prepare()
+        return converted
+
+    def summary(self):
+        with self._lock:
+            return {'backend': self.name, 'http_versions': dict(self.versions)}
+
+
+HTTP_BACKENDS = {
+    RequestsBackend.name: RequestsBackend,
+    HttpxBackend.name: HttpxBackend,
+}
+
+
+def get_http_backend(name, session, **options):
+    """Create the HTTP backend registered under name, sharing the crawler's session headers"""
+    try:
+        backend_class = HTTP_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown HTTP backend {name!r}, choose from {sorted(HTTP_BACKENDS)}")
+    return backend_class(session, **options)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Language Mirrors for the OFCA Crawler
+OFCA publishes the same site three times, in English, Traditional Chinese and
+Simplified Chinese, under parallel path trees, and every page links to its
+two mirrors through the language switcher:
+
+    /en/consumer_focus/index.html  <->  /tc/consumer_focus/index.html
+                                   <->  /sc/consumer_focus/index.html
+
+With a primary language set, links are only followed within the primary
+tree (and pages outside any language tree). Links into the other trees are
+recorded as mirrors of the primary page with the same path, and then
+
+    'tail'       queued behind every primary page, so they are fetched once
+                 the primary tree is done, and their own links into the
+                 other trees are not followed
+    'on_demand'  not queued; OFCACrawler.fetch_variant fetches one when asked
+
+The mapping is kept in language_mirrors.json, and crawl_summary.json counts
+the pages fetched per language.
+"""
+
+import json
+import os
+from collections import Counter
+from urllib.parse import urlparse
+
+LANGUAGES = ('en', 'tc', 'sc')
+MIRROR_POLICIES = ('tail', 'on_demand')
+
+
+def url_language(url):
+    """The language tree a URL is in, from its first path segment, or None"""
+    segment = urlparse(url).path.lstrip('/').split('/', 1)[0]
+    return segment if segment in LANGUAGES else None
+
+
+def mirror_url(url, language):
+    """The URL of the same page in another language tree"""
+    parsed = urlparse(url)
+    current = url_language(url)
+    if current is None:
+        raise ValueError(f"{url} is not in a language tree")
+    path = f'/{language}' + parsed.path.lstrip('/')[len(current):]
+    return parsed._replace(path=path).geturl()
+
+
+class LanguageMirrors:
+    """Mapping of primary-language pages to their mirrors, and link routing by language"""
+
+    def __init__(self, path, primary='en', policy='tail'):
+        if primary not in LANGUAGES:
+            raise ValueError(f"Unknown language {primary!r}, choose one of {', '.join(LANGUAGES)}")
+        if policy not in MIRROR_POLICIES:
+            raise ValueError(f"Unknown mirror policy {policy!r}, choose one of {', '.join(MIRROR_POLICIES)}")
+        self.path = path
+        self.primary = primary
+        self.policy = policy
+        # Primary URL -> {language: mirror URL} for every mirror link seen,
+        # also in earlier runs
+        self.variants = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.variants = json.load(f)
+        except (OSError, ValueError):
+            pass
+        # Language (or 'none') -> outcome -> pages
+        self.fetched = {}
+        self.stats = {'mirror_links': 0}
+
+    def is_primary(self, url):
+        """Whether a URL is in the primary tree or outside all language trees"""
+        return url_language(url) in (self.primary, None)
+
+    def is_mirror(self, url):
+        return not self.is_primary(url)
+
+    def record(self, url):
+        """Record a link into another language tree against its primary page"""
+        language = url_language(url)
+        self.variants.setdefault(mirror_url(url, self.primary), {})[language] = url
+
+    def route(self, url, links):
+        """The links of a page to follow; links into the other trees are recorded
+
+        Those are followed from primary pages under 'tail', and never from
+        mirror pages, so the other trees are not crawled link by link.
+        """
+        follow = set()
+        for link in links:
+            if self.is_primary(link):
+                follow.add(link)
+                continue
+            self.record(link)
+            self.stats['mirror_links'] += 1
+            if self.policy == 'tail' and self.is_primary(url):
+                follow.add(link)
+        return follow
+
+    def count(self, url, outcome):
+        """Count a finished page against its language"""
+        counts = self.fetched.setdefault(url_language(url) or 'none', Counter())
+        counts[outcome] += 1
+
+    def variant(self, url, language):
+        """The known mirror of a primary page in a language, else the URL with the same path"""
+        return self.variants.get(url, {}).get(language) or mirror_url(url, language)
+
+    def save(self):
+        """Write the mapping to language_mirrors.json, replaced in one step"""
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.variants, f, indent=1, sort_keys=True, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        """Settings, per-language page counts and mapping size for crawl_summary.json"""
+        return dict(
+            self.stats,
+            primary=self.primary,
+            policy=self.policy,
+            pages_with_mirrors=len(self.variants),
+            fetched={language: dict(counts, total=sum(counts.values()))
+                     for language, counts in sorted(self.fetched.items())},
+        )
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Link Extraction Backends for the OFCA Crawler
+Each backend returns the absolute URLs of a page's <a href> links, resolved
+against the page's <base href> when it has one. OFCACrawler.extract_links
+then normalizes and filters them.
+"""
+
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+
+class SoupLinkExtractor:
+    """Builds a full BeautifulSoup tree with the pure-Python html.parser"""
+
+    name = 'html.parser'
+
+    def extract(self, html_content, page_url):
+        soup = BeautifulSoup(html_content, 'html.parser')
+
+        base = soup.find('base', href=True)
+        base_url = urljoin(page_url, base['href']) if base else page_url
+
+        return [urljoin(base_url, link['href']) for link in soup.find_all('a', href=True)]
+
+
+class LxmlLinkExtractor:
+    """Parses with libxml2 and walks only the <a> and <base> elements"""
+
+    name = 'lxml'
+
+    def __init__(self):
+        # Pages are handed over as UTF-8 bytes: lxml rejects str input that
+        # carries its own encoding declaration
+        self.parser = etree.HTMLParser(encoding='utf-8', remove_comments=True)
+
+    def extract(self, html_content, page_url):
+        if isinstance(html_content, str):
+            html_content = html_content.encode('utf-8')
+
+        root = etree.fromstring(html_content, self.parser)
+        if root is None:
+            return []
+
+        base_href = None
+        hrefs = []
+        for element in root.iter('a', 'base'):
+            href = element.get('href')
+            if href is None:
+                continue
+            if element.tag == 'a':
+                hrefs.append(href)
+            elif base_href is None:
+                # As in browsers, the first <base href> applies to every link
+                base_href = href
+
+        base_url = urljoin(page_url, base_href) if base_href is not None else page_url
+        return [urljoin(base_url, href) for href in hrefs]
+
+
+LINK_EXTRACTORS = {
+    SoupLinkExtractor.name: SoupLinkExtractor,
+    LxmlLinkExtractor.name: LxmlLinkExtractor,
+}
+
+
+def get_link_extractor(name):
+    """Create the link extraction backend registered under name"""
+    try:
+        return LINK_EXTRACTORS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown link parser {name!r}, choose from {sorted(LINK_EXTRACTORS)}")
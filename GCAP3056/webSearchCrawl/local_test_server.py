@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+"""
+Local Test Server for the OFCA Crawler
+Serves a generated website on localhost so crawls can be run and timed
+without touching www.ofca.gov.hk. Besides the page tree, the site can
+include what makes real crawls slow or wrong:
+
+    duplicates      "print version" URLs serving a byte-identical copy of a page
+    variants        "archive" copies of a page under /en/archive/ with a different
+                    date and navigation, linking on to archive copies of its children
+    languages       /tc/ and /sc/ mirror trees of the /en/ pages, each page linking
+                    to its mirrors like a language switcher
+    gzip            pages sent with Content-Encoding: gzip to clients accepting it
+    documents       links to PDFs under /en/files/, served with byte ranges; with
+                    document_cutoff the first response for each is cut off
+    traps           .html URLs that actually serve large binary files
+    disallowed      links into /private/, which robots.txt forbids
+    error_rate      random 503s; outage drops connections for a while
+    max_rate        429 with Retry-After above a request rate
+
+Every request is counted by kind in `site.requests`.
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Words for the generated page text
+VOCABULARY = ('telecommunications licensing spectrum management consumer protection broadband mobile '
+              'network operator satellite broadcasting numbering interconnection tariff complaint '
+              'regulation consultation frequency assignment auction radio station fixed carrier '
+              'service quality coverage roaming emergency code practice guideline statement '
+              'decision market competition cable television internet exchange universal').split()
+
+
+class SyntheticSite:
+    """A generated site of `pages` linked pages laid out like the OFCA tree"""
+
+    def __init__(self, pages=200, fanout=5, latency=0.05, sitemap=True, lastmod='2024-01-01',
+                 crawl_delay=None, downloads=0, download_size=5 * 2 ** 20, max_rate=None,
+                 error_rate=0.0, outage=None, seed=0, page_size=0, duplicates=0.0, traps=0,
+                 disallowed=0, variants=0.0, languages=False, gzip=False, documents=0,
+                 document_size=2 * 2 ** 20, document_cutoff=None):
+        self.pages = pages
+        self.fanout = fanout
+        self.latency = latency
+        self.sitemap = sitemap
+        self.lastmod = lastmod
+        self.crawl_delay = crawl_delay
+        # The first `downloads` pages also link to a large binary file whose
+        # URL has no extension, so only its Content-Type gives it away
+        self.downloads = downloads
+        self.download_size = download_size
+        # Requests per second served before answering 429 with Retry-After
+        self.max_rate = max_rate
+        self.recent_requests = deque()
+        self.lock = threading.Lock()
+        # Fraction of page requests answered with a 503, and an optional
+        # (start, duration) window in seconds after the first request during
+        # which connections are dropped without any response
+        self.error_rate = error_rate
+        self.outage = outage
+        self.random = random.Random(seed)
+        self.started = None
+        # Pages padded with text to about page_size bytes; a `duplicates`
+        # fraction of them also linked as a print version with the same body,
+        # and a `variants` fraction as an archive copy whose text only differs
+        # in its date and navigation; the first `traps` pages link to a binary
+        # file dressed up as .html, and the first `disallowed` pages into /private/
+        self.page_size = page_size
+        self.duplicate_ids = set(random.Random(seed).sample(range(1, pages), int((pages - 1) * duplicates)))
+        self.variant_ids = set(random.Random(seed + 1).sample(range(1, pages), int((pages - 1) * variants)))
+        self.traps = traps
+        self.disallowed = disallowed
+        self.languages = ('en', 'tc', 'sc') if languages else ('en',)
+        self.gzip = gzip
+        # The first `documents` pages link to a PDF of document_size bytes,
+        # which answers Range requests; the first response for each is
+        # dropped after document_cutoff bytes, if set
+        self.documents = documents
+        self.document_size = document_size
+        self.document_cutoff = document_cutoff
+        self.cut_documents = set()
+        self.document_filler = None
+        self.requests = Counter()
+        self.rendered = {}
+        self.gzipped = {}
+
+    def page_path(self, page_id):
+        """URL path of a page; page 0 is the crawler's seed page"""
+        if page_id == 0:
+            return '/en/home/index.html'
+        return f'/en/page/{page_id}.html'
+
+    def page_id(self, path):
+        """Map a URL path back to its page number, or None if it does not exist"""
+        if path == '/en/home/index.html':
+            return 0
+        if path.startswith('/en/page/') and path.endswith('.html'):
+            try:
+                page_id = int(path[len('/en/page/'):-len('.html')])
+            except ValueError:
+                return None
+            if 0 < page_id < self.pages:
+                return page_id
+        return None
+
+    def render(self, page_id, archived=False, language='en'):
+        """Render a page linking to its children in the page tree and back home
+
+        An archived copy has the same text under another date and links to
+        the archived copies of the children instead. A mirror page in another
+        language links within its own tree.
+        """
+        children = range(page_id * self.fanout + 1, page_id * self.fanout + self.fanout + 1)
+        if archived:
+            links = [self.page_path(0)] + [f'/en/archive/{c}.html' for c in children if c < self.pages]
+            return self.layout(page_id, links, f'2023-{page_id % 12 + 1:02d}-15', 'Archive')
+        if language != 'en':
+            links = [self.page_path(0)] + [self.page_path(c) for c in children if c < self.pages]
+            links = [f'/{language}{link[3:]}' for link in links]
+            links += [f'/{other}{self.page_path(page_id)[3:]}' for other in self.languages if other != language]
+            return self.layout(page_id, links, self.lastmod, 'Home')
+
+        links = [self.page_path(0)] + [self.page_path(c) for c in children if c < self.pages]
+        if page_id in self.variant_ids:
+            links.append(f'/en/archive/{page_id}.html')
+        if page_id < self.downloads:
+            links.append(f'/en/download/{page_id}')
+        if page_id < self.documents:
+            links.append(f'/en/files/{page_id}.pdf')
+        if page_id in self.duplicate_ids:
+            links.append(f'/en/print/{page_id}.html')
+        if page_id < self.traps:
+            links.append(f'/en/media/{page_id}.html')
+        if page_id < self.disallowed:
+            links.append(f'/private/{page_id}.html')
+        links += [f'/{other}{self.page_path(page_id)[3:]}' for other in self.languages[1:]]
+        return self.layout(page_id, links, self.lastmod, 'Home')
+
+    def layout(self, page_id, links, date, section):
+        """Page HTML: navigation, then the main text padded to about page_size bytes
+
+        The padding does not depend on the navigation, so copies of a page
+        with other links have the same text.
+        """
+        anchors = '\n'.join(f'<li><a href="{link}">Page {link}</a></li>' for link in links)
+        page = (f'<!DOCTYPE html>\n<html><head><title>Page {page_id}</title></head>\n'
+                f'<body><nav><a href="/en/home/index.html">{section}</a>\n<ul>\n{anchors}\n</ul></nav>\n'
+                f'<main><h1>Page {page_id}</h1>\n<p class="date">Last revision date: {date}</p>\n')
+        # Sentences of the page's own, so pages are not near-duplicates of
+        # each other, and compress about as well as real text
+        words = random.Random(page_id)
+        paragraphs = []
+        size = 256
+        while True:
+            paragraph = f'<p>Page {page_id}: {" ".join(words.choices(VOCABULARY, k=12))}.</p>\n'
+            if size + len(paragraph) > self.page_size:
+                break
+            paragraphs.append(paragraph)
+            size += len(paragraph)
+        return page + ''.join(paragraphs) + '</main></body></html>\n'
+
+    def page_body(self, page_id, archived=False, language='en'):
+        """Rendered page bytes, cached since pages never change"""
+        key = page_id, archived, language
+        if key not in self.rendered:
+            self.rendered[key] = self.render(page_id, archived, language).encode('utf-8')
+        return self.rendered[key]
+
+    def gzipped_body(self, body):
+        """A page body gzipped as a web server would, cached like the pages"""
+        if body not in self.gzipped:
+            self.gzipped[body] = gzip.compress(body, compresslevel=6, mtime=0)
+        return self.gzipped[body]
+
+    def binary_file(self, path):
+        """Content type of a binary file served at path, or None
+
+        Downloads have no extension; traps look like pages.
+        """
+        if path.startswith('/en/download/'):
+            self.requests['download'] += 1
+            return 'application/octet-stream'
+        if path.startswith('/en/media/') and path.endswith('.html'):
+            self.requests['trap'] += 1
+            return 'application/pdf'
+        return None
+
+    def document_body(self, document_id):
+        """Bytes of a document, the same on every request
+
+        Documents differ in their first line only; the filler after it is
+        made once, so serving one costs little more than a copy.
+        """
+        if self.document_filler is None:
+            block = hashlib.sha256(b'document').digest() * 2048
+            self.document_filler = (block * (self.document_size // len(block) + 1))[:self.document_size]
+        head = f'%PDF-1.4\n% document {document_id}\n'.encode('ascii')
+        return head + self.document_filler[len(head):]
+
+    def document(self, path, range_header=None, if_range=None):
+        """Answer a request for a document as (status, headers, body, cutoff), or None
+
+        Honours 'Range: bytes=N-', and If-Range against the document's ETag.
+        cutoff is the number of body bytes to send before dropping the
+        connection, or None to send them all.
+        """
+        if not (path.startswith('/en/files/') and path.endswith('.pdf')):
+            return None
+        try:
+            document_id = int(path[len('/en/files/'):-len('.pdf')])
+        except ValueError:
+            return None
+        if not 0 <= document_id < self.documents:
+            return None
+        self.requests['document'] += 1
+
+        body = self.document_body(document_id)
+        etag = f'"document-{document_id}"'
+        headers = {'Content-Type': 'application/pdf', 'ETag': etag, 'Accept-Ranges': 'bytes'}
+        status = 200
+        if range_header and range_header.startswith('bytes=') and range_header.endswith('-') \
+                and if_range in (None, etag):
+            self.requests['document_range'] += 1
+            start = int(range_header[len('bytes='):-1])
+            if start >= len(body):
+                headers.update({'Content-Range': f'bytes */{len(body)}', 'Content-Length': '0'})
+                return 416, headers, b'', None
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+            body = body[start:]
+        headers['Content-Length'] = str(len(body))
+
+        cutoff = None
+        with self.lock:
+            if self.document_cutoff is not None and document_id not in self.cut_documents:
+                self.cut_documents.add(document_id)
+                cutoff = min(self.document_cutoff, len(body))
+        return status, headers, body, cutoff
+
+    def overloaded(self):
+        """Count a request and tell whether it goes over max_rate"""
+        if self.max_rate is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            while self.recent_requests and self.recent_requests[0] < now - 1.0:
+                self.recent_requests.popleft()
+            if len(self.recent_requests) >= self.max_rate:
+                return True
+            self.recent_requests.append(now)
+            return False
+
+    def failure(self):
+        """'outage', 'error' or None for the next page request"""
+        with self.lock:
+            now = time.monotonic()
+            if self.started is None:
+                self.started = now
+            if self.outage and 0 <= now - self.started - self.outage[0] < self.outage[1]:
+                return 'outage'
+            if self.error_rate and self.random.random() < self.error_rate:
+                return 'error'
+        return None
+
+    def robots_txt(self, base_url):
+        """robots.txt served by the test site"""
+        text = 'User-agent: *\nDisallow: /private/\n'
+        if self.crawl_delay is not None:
+            text += f'Crawl-delay: {self.crawl_delay}\n'
+        if self.sitemap:
+            text += f'Sitemap: {base_url}/sitemap_index.xml\n'
+        return text
+
+    def sitemap_index(self, base_url):
+        """Sitemap index pointing at the page sitemap"""
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+                f'<sitemap><loc>{base_url}/sitemap_pages.xml</loc></sitemap>\n'
+                '</sitemapindex>\n')
+
+    def sitemap_pages(self, base_url):
+        """Sitemap listing every page with the site's lastmod date"""
+        entries = ''.join(f'<url><loc>{base_url}{self.page_path(i)}</loc>'
+                          f'<lastmod>{self.lastmod}</lastmod></url>\n' for i in range(self.pages))
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+                f'{entries}</urlset>\n')
+
+    def respond(self, path, base_url, if_none_match=None, accept_encoding=''):
+        """Answer a request for path as (status, headers, body), or None to drop the connection
+
+        Binary files are left to the server, which streams them.
+        """
+        if path == '/robots.txt':
+            self.requests['robots'] += 1
+            return self.text_response(200, 'text/plain', self.robots_txt(base_url))
+        if self.sitemap and path in ('/sitemap_index.xml', '/sitemap_pages.xml'):
+            self.requests['sitemap'] += 1
+            sitemap = self.sitemap_index if path == '/sitemap_index.xml' else self.sitemap_pages
+            return self.text_response(200, 'application/xml', sitemap(base_url))
+        if path.startswith('/private/'):
+            # Served all the same: counting these catches robots.txt violations
+            self.requests['disallowed'] += 1
+            return self.text_response(200, 'text/html', '<html><body>Private</body></html>')
+
+        language = path[1:3] if path[3:4] == '/' and path[1:3] in self.languages[1:] else 'en'
+        if language != 'en':
+            path = '/en' + path[3:]
+        page_id = self.page_id(path)
+        archived = path.startswith('/en/archive/') and language == 'en'
+        if page_id is None and path.startswith('/en/print/'):
+            page_id = self.page_id(path.replace('/en/print/', '/en/page/'))
+            if page_id not in self.duplicate_ids:
+                page_id = None
+        elif page_id is None and archived:
+            page_id = self.page_id(path.replace('/en/archive/', '/en/page/'))
+        if page_id is None:
+            self.requests['not_found'] += 1
+            return self.text_response(404, 'text/html', '<html><body>Not found</body></html>')
+        if language != 'en':
+            self.requests[f'page_{language}'] += 1
+        else:
+            self.requests['duplicate' if path.startswith('/en/print/') else 'variant' if archived else 'page'] += 1
+
+        failure = self.failure()
+        if failure == 'outage':
+            return None
+        if failure == 'error':
+            return self.text_response(503, 'text/html', '<html><body>Service unavailable</body></html>')
+        if self.overloaded():
+            return self.text_response(429, 'text/html', '<html><body>Too many requests</body></html>',
+                                      headers={'Retry-After': '1'})
+
+        body = self.page_body(page_id, archived, language)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if if_none_match == etag:
+            return 304, {'ETag': etag, 'Content-Length': '0'}, b''
+        headers = {'Content-Type': 'text/html; charset=utf-8', 'ETag': etag}
+        if self.gzip and 'gzip' in accept_encoding:
+            body = self.gzipped_body(body)
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(body))
+        return 200, headers, body
+
+    def text_response(self, status, content_type, text, headers=None):
+        """(status, headers, body) of a UTF-8 text response"""
+        body = text.encode('utf-8')
+        response_headers = {'Content-Type': content_type, 'Content-Length': str(len(body))}
+        response_headers.update(headers or {})
+        return status, response_headers, body
+
+
+class SyntheticSiteHandler(BaseHTTPRequestHandler):
+    """Request handler serving the pages of `server.site`"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle's algorithm the
+    # body would wait for the client's delayed ACK of the headers (~40 ms)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        site = self.server.site
+        if site.latency:
+            time.sleep(site.latency)
+
+        content_type = site.binary_file(self.path)
+        if content_type:
+            self.send_download(content_type, site.download_size)
+            return
+        document = site.document(self.path, self.headers.get('Range'), self.headers.get('If-Range'))
+        if document:
+            self.send_document(*document)
+            return
+
+        base_url = f"http://{self.headers.get('Host')}"
+        response = site.respond(self.path, base_url, self.headers.get('If-None-Match'),
+                                self.headers.get('Accept-Encoding', ''))
+        if response is None:
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+
+        status, headers, body = response
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_download(self, content_type, size, chunk_size=64 * 1024):
+        """Stream `size` bytes of binary data, stopping if the client hangs up"""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = b'\0' * chunk_size
+        try:
+            for start in range(0, size, chunk_size):
+                self.wfile.write(chunk[:size - start])
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def send_document(self, status, headers, body, cutoff):
+        """Send a document response, dropping the connection after cutoff bytes if set"""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body[:cutoff])
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            return
+        if cutoff is not None:
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+
+    def log_message(self, format, *args):
+        """Keep the server quiet; the crawler does the logging"""
+
+
+class SyntheticSiteServer(ThreadingHTTPServer):
+    """Threaded server that takes clients hanging up mid-response in its stride"""
+
+    def handle_error(self, request, client_address):
+        # The crawler drops connections on purpose, e.g. after the headers
+        # of a non-HTML response
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def start_server(site, host='127.0.0.1', port=0):
+    """Start serving `site` on a background thread and return (server, base_url)"""
+    server = SyntheticSiteServer((host, port), SyntheticSiteHandler)
+    server.daemon_threads = True
+    server.site = site
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+class SyntheticSiteASGI:
+    """ASGI application serving `site`, counting the connections clients open"""
+
+    def __init__(self, site):
+        self.site = site
+        self.connections = set()
+        self.http_versions = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while (await receive())['type'] != 'lifespan.shutdown':
+                await send({'type': 'lifespan.startup.complete'})
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+        # Every connection comes from a port of its own
+        self.connections.add(tuple(scope['client']))
+        version = scope['http_version']
+        self.http_versions[version] = self.http_versions.get(version, 0) + 1
+        if self.site.latency:
+            await asyncio.sleep(self.site.latency)
+
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        path = scope['path']
+        content_type = self.site.binary_file(path)
+        document = self.site.document(path, headers.get('range'), headers.get('if-range'))
+        if content_type:
+            response = 200, {'Content-Type': content_type,
+                             'Content-Length': str(self.site.download_size)}, b'\0' * self.site.download_size
+        elif document:
+            status, response_headers, body, cutoff = document
+            response = status, response_headers, body[:cutoff]
+        else:
+            base_url = f"http://{headers.get('host', '%s:%d' % tuple(scope['server']))}"
+            response = self.site.respond(path, base_url, headers.get('if-none-match'),
+                                         headers.get('accept-encoding', ''))
+        if response is None:
+            # Resets the stream, or the connection over HTTP/1.1
+            raise ConnectionAbortedError(path)
+
+        status, response_headers, body = response
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in response_headers.items()]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class HTTP2Server:
+    """Hypercorn serving a SyntheticSiteASGI app on a background thread"""
+
+    def __init__(self, app, host, port):
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+
+        self.app = app
+        config = Config()
+        config.bind = [f'{host}:{port}']
+        config.loglevel = 'WARNING'
+        config.accesslog = None
+        # One connection may carry every request the crawler has in flight
+        config.h2_max_concurrent_streams = 1000
+        self.loop = asyncio.new_event_loop()
+        self.stopping = asyncio.Event()
+        self.started = threading.Event()
+
+        async def run():
+            self.started.set()
+            try:
+                await serve(app, config, shutdown_trigger=self.stopping.wait)
+            except Exception:
+                # Clients still holding connections when the server stops
+                pass
+
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(run(),), daemon=True)
+        self.thread.start()
+        self.started.wait()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.set_exception_handler, lambda loop, context: None)
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join(timeout=10)
+
+
+def start_http2_server(site, host='127.0.0.1', port=0):
+    """Serve `site` over HTTP/1.1 and HTTP/2 (h2c) and return (server, base_url)
+
+    Needs Hypercorn (pip install hypercorn). server.app counts the client
+    connections and the HTTP versions of the requests served.
+    """
+    if not port:
+        with socket.socket() as probe:
+            probe.bind((host, 0))
+            port = probe.getsockname()[1]
+    server = HTTP2Server(SyntheticSiteASGI(site), host, port)
+    base_url = f"http://{host}:{port}"
+    # Hypercorn binds its socket once the loop is running
+    for _ in range(100):
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic site for crawler testing")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument('--page-size', type=int, default=0, help="approximate bytes per page")
+    parser.add_argument('--duplicates', type=float, default=0.0, help="fraction of pages with a print copy")
+    parser.add_argument('--variants', type=float, default=0.0,
+                        help="fraction of pages with a near-duplicate archive copy")
+    parser.add_argument('--languages', action='store_true', help="serve /tc/ and /sc/ mirror trees")
+    parser.add_argument('--gzip', action='store_true', help="gzip pages for clients accepting it")
+    parser.add_argument('--documents', type=int, default=0, help="pages linking to a PDF")
+    parser.add_argument('--traps', type=int, default=0, help="pages linking to binary files named .html")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of page requests failing with 503")
+    args = parser.parse_args()
+
+    site = SyntheticSite(args.pages, args.fanout, args.latency, page_size=args.page_size,
+                         duplicates=args.duplicates, traps=args.traps, error_rate=args.error_rate,
+                         variants=args.variants, languages=args.languages, gzip=args.gzip,
+                         documents=args.documents)
+    server, base_url = start_server(site, port=args.port)
+    print(f"Serving {args.pages} pages at {base_url} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
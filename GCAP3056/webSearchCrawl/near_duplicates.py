@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Detection for the OFCA Crawler
+Fingerprints the main text of every page with a 64-bit SimHash over word
+shingles, so pages that differ only in navigation, dates or other page
+chrome get fingerprints a few bits apart. Navigation, headers, footers and
+scripts are left out of the text, and so are numbers; Chinese text is
+shingled by character.
+
+A page whose fingerprint is at most max_distance bits from an earlier
+page's is a near-duplicate of it. The threshold is given as a similarity,
+1 - distance / 64, so 0.95 allows 3 bits. Lookups use a banded index: the
+64 bits are cut into max_distance + 1 bands, and two fingerprints within
+max_distance bits must agree on at least one whole band, so only pages
+sharing a band with the new one are compared:
+
+    fingerprint  | band 0 | band 1 | band 2 | band 3 |   (threshold 0.95)
+                      \\        \\        \\        \\
+                    one dict per band: band bits -> fingerprints
+
+Near-duplicates are grouped into clusters around the first page seen.
+"""
+
+import hashlib
+import re
+
+from lxml import html as lxml_html
+
+# Elements that are page chrome rather than content
+CHROME_ELEMENTS = ('script', 'style', 'noscript', 'template', 'nav', 'header', 'footer', 'aside', 'form')
+# Where a page's main text is, in order of preference; the body otherwise
+MAIN_CONTENT = ('//main', '//*[@role="main"]', '//*[@id="content"]', '//*[@id="main"]')
+# Lowercase English words and single Chinese characters, the languages of
+# the site (a full Unicode letter class is slower by half); numbers are left
+# out, as dates and counters change between otherwise identical pages
+TOKEN_PATTERN = re.compile(r'[a-z]+|[\u3400-\u9fff]')
+MASK64 = 2 ** 64 - 1
+
+
+def main_text(page):
+    """The visible text of a page's main content, without navigation and other chrome"""
+    try:
+        try:
+            document = lxml_html.document_fromstring(page)
+        except ValueError:
+            # A str may not carry an XML encoding declaration
+            document = lxml_html.document_fromstring(page.encode('utf-8'))
+    except Exception:
+        return ''
+    for element in document.iter(*CHROME_ELEMENTS):
+        element.drop_tree()
+    for xpath in MAIN_CONTENT:
+        found = document.xpath(xpath)
+        if found:
+            return ' '.join(element.text_content() for element in found)
+    body = document.find('body')
+    return (body if body is not None else document).text_content()
+
+
+def _mix(value):
+    """splitmix64 finaliser, spreading every input bit over the whole word"""
+    value = (value ^ (value >> 30)) * 0xbf58476d1ce4e5b9 & MASK64
+    value = (value ^ (value >> 27)) * 0x94d049bb133111eb & MASK64
+    return value ^ (value >> 31)
+
+
+def word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def simhash(tokens):
+    """64-bit SimHash of the three-word shingles of a list of words, or None if there are too few words"""
+    if len(tokens) < 3:
+        return None
+    # Each distinct word is hashed once, and each distinct shingle combines its word hashes
+    word_hashes = {word: word_hash(word) for word in set(tokens)}
+    hashes = [word_hashes[word] for word in tokens]
+    features = {_mix((a + 3 * b + 5 * c) & MASK64) for a, b, c in set(zip(hashes, hashes[1:], hashes[2:]))}
+
+    # Bit i of the fingerprint is set if most features have it set. The
+    # features' bits are laid out in one string, so each bit position is a
+    # slice to count, instead of 64 steps per feature in Python
+    bits = ''.join([format(feature, '064b') for feature in features])
+    fingerprint = 0
+    for position in range(64):
+        if 2 * bits[position::64].count('1') > len(features):
+            fingerprint |= 1 << (63 - position)
+    return fingerprint
+
+
+def page_fingerprint(page, min_words=50):
+    """SimHash of a page's main text, or None for pages with fewer than min_words words
+
+    Short pages are mostly chrome, and would all look alike.
+    """
+    tokens = TOKEN_PATTERN.findall(main_text(page).lower())
+    if len(tokens) < min_words:
+        return None
+    return simhash(tokens)
+
+
+class NearDuplicateIndex:
+    """Banded index of page fingerprints, finding near-duplicates in constant time"""
+
+    def __init__(self, threshold=0.95):
+        if not 0.5 <= threshold <= 1.0:
+            raise ValueError(f"Near-duplicate threshold must be between 0.5 and 1.0, not {threshold}")
+        self.threshold = threshold
+        self.max_distance = int(round((1.0 - threshold) * 64, 6))
+        bands = self.max_distance + 1
+        # (shift, mask) of each band, as equal as 64 bits allow
+        widths = [64 // bands + (1 if band < 64 % bands else 0) for band in range(bands)]
+        shifts = [sum(widths[:band]) for band in range(bands)]
+        self.bands = [(shift, (1 << width) - 1) for shift, width in zip(shifts, widths)]
+        self.tables = [{} for _ in self.bands]
+        # Fingerprint -> URL of the first page with it, and that page's near-duplicates
+        self.originals = {}
+        self.clusters = {}
+        self.stats = {'pages_checked': 0, 'near_duplicates': 0, 'outlinks_skipped': 0}
+
+    def check(self, url, fingerprint):
+        """Return the URL of an earlier page the page nearly duplicates, or None after indexing it"""
+        self.stats['pages_checked'] += 1
+        keys = [(fingerprint >> shift) & mask for shift, mask in self.bands]
+        for table, key in zip(self.tables, keys):
+            for other in table.get(key, ()):
+                if bin(fingerprint ^ other).count('1') <= self.max_distance:
+                    original = self.originals[other]
+                    self.clusters.setdefault(original, []).append(url)
+                    self.stats['near_duplicates'] += 1
+                    return original
+
+        self.originals[fingerprint] = url
+        for table, key in zip(self.tables, keys):
+            table.setdefault(key, []).append(fingerprint)
+        return None
+
+    def summary(self, top=20, examples=10):
+        """Counts and the largest clusters for crawl_summary.json"""
+        largest = sorted(self.clusters.items(), key=lambda cluster: len(cluster[1]), reverse=True)[:top]
+        return dict(
+            self.stats,
+            threshold=self.threshold,
+            max_distance=self.max_distance,
+            clusters=len(self.clusters),
+            largest_clusters=[{'url': original, 'near_duplicates': len(duplicates),
+                               'examples': duplicates[:examples]} for original, duplicates in largest],
+        )
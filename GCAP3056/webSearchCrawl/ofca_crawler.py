@@ -6,39 +6,183 @@ Downloads all accessible pages to a local directory structure
 """
 
 import requests
-from bs4 import BeautifulSoup
 import os
 import time
-import urllib.robotparser
+import asyncio
+import contextlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin, urlparse, unquote
 import logging
 from pathlib import Path
 import hashlib
-import json
 from datetime import datetime
 import re
+import zlib
+
+from crawl_frontier import CrawlFrontier
+from crawl_journal import CrawlJournal, iter_journal, write_summary
+from crawl_logging import page_sampled, start_background_logging
+from crawl_metrics import CrawlMetrics
+from crawl_pipeline import CrawlPipeline
+from crawl_state import CrawlStateStore
+from document_downloads import DOCUMENT_EXTENSIONS, DocumentDownloader
+from http_backends import get_http_backend
+from language_mirrors import LanguageMirrors
+from link_extractors import get_link_extractor
+from near_duplicates import NearDuplicateIndex, page_fingerprint
+from page_bodies import get_compressor, gzip_decoder, is_utf8
+from page_store import ContentStore
+from rate_limiter import AdaptiveRateLimiter, HostRateLimiter, parse_retry_after
+from retry_policy import CircuitBreaker, RetryPolicy, error_status
+from search_index import open_crawl_index
+from robots_rules import RobotsPolicy
+from sitemaps import iter_sitemap
+from url_sets import CompactURLSet, open_url_set_store
+from warc_writer import WARCWriter
+
+class BodyTooLarge(requests.RequestException):
+    """A response body larger than the crawler's max_body_size"""
+
 
 class OFCACrawler:
-    def __init__(self, base_url="https://www.ofca.gov.hk", download_dir="ofca_crawl"):
+    # Subclasses may queue pages differently, see sharded_crawl.py
+    frontier_class = CrawlFrontier
+    
+    def __init__(self, base_url="https://www.ofca.gov.hk", download_dir="ofca_crawl", resume=True,
+                 incremental=True, dedup=True, link_parser='lxml', output_format='files',
+                 use_sitemaps=True, robots_ttl=3600, compact_url_sets=False,
+                 url_set_capacity=1_000_000, frontier='bfs', max_depth=None, prefix_quotas=None,
+                 page_score=None, max_bytes=None, max_seconds=None, state_dir=None,
+                 log_level=logging.INFO, max_body_size=10 * 2 ** 20, rate_control='fixed',
+                 max_rate=4.0, retries=3, backoff=1.0, breaker_threshold=5, breaker_cooldown=30.0,
+                 http_backend='requests', http_options=None, metrics_format='prometheus',
+                 metrics_interval=30.0, search_index=False, checkpoint_interval=60.0,
+                 log_format='text', log_sample=1.0, near_duplicates=None, skip_duplicate_links=False,
+                 primary_language=None, mirror_policy='tail', page_compression=None,
+                 download_documents=False, download_workers=2, download_delay=0.0,
+                 max_document_size=500 * 2 ** 20, download_bandwidth=5 * 2 ** 20, on_download=None):
         self.base_url = base_url
         self.download_dir = Path(download_dir)
-        self.visited_urls = set()
-        self.failed_urls = set()
+        # Crawl state, logs and the summary go here, pages to download_dir
+        self.state_dir = Path(state_dir) if state_dir else self.download_dir
+        self.resume = resume
+        self.incremental = incremental
+        self.use_sitemaps = use_sitemaps
+        # Update search_index.sqlite3 with new and changed pages after each
+        # run (see search_index.py)
+        self.search_index = search_index
+        self.max_body_size = max_body_size
+        if rate_control not in ('fixed', 'adaptive'):
+            raise ValueError(f"Unknown rate control {rate_control!r}, choose 'fixed' or 'adaptive'")
+        # 'fixed' spaces requests to a host `delay` seconds apart; 'adaptive'
+        # starts there and finds the pace the server can take, up to max_rate
+        self.rate_control = rate_control
+        self.max_rate = max_rate
+        self.rate_limiter = None
+        self.retry_policy = RetryPolicy(retries=retries, backoff=backoff)
         self.crawl_stats = {
             'pages_crawled': 0,
             'pages_failed': 0,
+            'pages_unchanged': 0,
+            'pages_fresh': 0,
+            'pages_skipped': 0,
+            'sitemap_urls': 0,
+            'bytes_downloaded': 0,
+            'stopped_by': None,
             'start_time': None,
             'end_time': None
         }
         
+        # Order of the frontier and the limits on what a crawl may spend,
+        # on top of each crawl method's max_pages (see crawl_frontier.py)
+        self.frontier_settings = {
+            'mode': frontier,
+            'max_depth': max_depth,
+            'prefix_quotas': prefix_quotas,
+            'score': page_score,
+        }
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.frontier = None
+        
         # Create download directory
         self.download_dir.mkdir(exist_ok=True)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        
+        # URL sets are plain Python sets, or for very large crawls Bloom
+        # filters backed by exact tables in url_sets.sqlite3 (see url_sets.py)
+        self.url_set_capacity = url_set_capacity
+        self.url_set_db = open_url_set_store(self.state_dir / "url_sets.sqlite3") if compact_url_sets else None
+        self.visited_urls = self.new_url_set('visited')
+        self.failed_urls = self.new_url_set('failed')
+        
+        # Setup logging; log_sample is the share of pages whose per-page
+        # INFO lines are written (see crawl_logging.py)
+        self.log_sample = log_sample
+        self.setup_logging(log_level, log_format)
+        
+        # Per-phase request timings, rewritten every metrics_interval seconds
+        # to crawl_metrics.prom or .json (see crawl_metrics.py); None keeps
+        # them for the summary only
+        metrics_path = None
+        if metrics_format:
+            suffix = 'prom' if metrics_format == 'prometheus' else metrics_format
+            metrics_path = self.state_dir / f"crawl_metrics.{suffix}"
+        self.metrics = CrawlMetrics(metrics_path, format=metrics_format or 'prometheus',
+                                    interval=metrics_interval)
+        
+        # Every page outcome is appended to crawl_journal.jsonl once the page
+        # is persisted, with running totals in crawl_checkpoint.json every
+        # checkpoint_interval seconds (see crawl_journal.py)
+        self.journal = CrawlJournal(self.state_dir, checkpoint_interval=checkpoint_interval)
+        self.page_outcomes = {}
+        
+        # Frontier and visited pages survive restarts in crawl_state.sqlite3
+        self.state = CrawlStateStore(self.state_dir / "crawl_state.sqlite3")
+        
+        # Pages go either into a directory tree mirroring the site, where
+        # identical bodies are stored once under blobs/ and hardlinked, or
+        # into gzip-compressed WARC files under warc/. page_compression
+        # ('gzip' or 'zstd') keeps the files compressed, gzipped bodies as
+        # received (see page_bodies.py)
+        self.page_store = None
+        self.warc_writer = None
+        self.page_compressor = None
+        if output_format == 'warc':
+            if page_compression:
+                raise ValueError("page_compression is for output_format='files', WARC files are compressed already")
+            self.warc_writer = WARCWriter(self.state_dir / "warc", dedup=dedup)
+        elif output_format != 'files':
+            raise ValueError(f"Unknown output format {output_format!r}, choose 'files' or 'warc'")
+        elif dedup:
+            self.page_store = ContentStore(self.download_dir)
+        if page_compression:
+            self.page_compressor = get_compressor(page_compression)
         
-        # Setup logging
-        self.setup_logging()
+        # 'lxml' or 'html.parser' (BeautifulSoup), see link_extractors.py
+        self.link_extractor = get_link_extractor(link_parser)
         
-        # Setup robots.txt parser
-        self.setup_robots()
+        # Pages whose main text is at least `near_duplicates` similar to an
+        # earlier page's are marked, and with skip_duplicate_links their
+        # links are not followed (see near_duplicates.py)
+        self.near_duplicates = NearDuplicateIndex(near_duplicates) if near_duplicates else None
+        self.skip_duplicate_links = skip_duplicate_links
+        
+        # With a primary language ('en', 'tc' or 'sc'), links are followed
+        # in that tree only; the other trees' pages are recorded as its
+        # mirrors and crawled after it ('tail') or through fetch_variant
+        # ('on_demand'), see language_mirrors.py
+        self.language_mirrors = None
+        if primary_language:
+            self.language_mirrors = LanguageMirrors(self.state_dir / "language_mirrors.json",
+                                                    primary=primary_language, policy=mirror_policy)
+            if mirror_policy == 'tail':
+                self.frontier_settings['tail'] = self.language_mirrors.is_mirror
+        
+        # Hosts that keep failing get a pause rather than hundreds of failed pages
+        self.circuit_breaker = CircuitBreaker(threshold=breaker_threshold, cooldown=breaker_cooldown,
+                                              logger=self.logger)
         
         # Setup session with headers
         self.session = requests.Session()
@@ -51,37 +195,68 @@ class OFCACrawler:
             'Upgrade-Insecure-Requests': '1'
         })
         
-    def setup_logging(self):
-        """Setup logging configuration"""
-        log_file = self.download_dir / "crawl_log.txt"
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler()
-            ]
-        )
+        # Pages are fetched through 'requests' or, for HTTP/2, 'httpx' (see
+        # http_backends.py), sending the session's headers either way
+        self.http = get_http_backend(http_backend, self.session, **(http_options or {}))
+        self.configure_connection_pool(1)
+        
+        # Setup robots.txt rules, fetched through the session
+        self.setup_robots(robots_ttl)
+        
+        # Links to PDFs and office documents, which are never crawled as
+        # pages, go to a download lane with threads and connections of its
+        # own, handing each finished file to on_download (see
+        # document_downloads.py). download_documents is True for
+        # DOCUMENT_EXTENSIONS, or the extensions to download;
+        # download_bandwidth caps the lane in bytes per second (None for no cap)
+        self.documents = None
+        self.document_extensions = ()
+        if download_documents:
+            self.document_extensions = (DOCUMENT_EXTENSIONS if download_documents is True
+                                        else tuple(extension.lower() for extension in download_documents))
+            self.documents = DocumentDownloader(
+                self.state_dir, self.create_local_path, headers=self.session.headers,
+                workers=download_workers, delay=download_delay, host_delay=self.crawl_delay,
+                retries=retries, backoff=backoff, max_size=max_document_size,
+                max_bandwidth=download_bandwidth, on_download=on_download, logger=self.logger)
+        
+    def setup_logging(self, level=logging.INFO, log_format='text'):
+        """Setup logging configuration
+        
+        Records are formatted and written by a background thread, as 'text'
+        or 'json' lines, to crawl_log.txt and the console.
+        """
+        log_file = self.state_dir / "crawl_log.txt"
+        start_background_logging(log_file, level=level, log_format=log_format)
         self.logger = logging.getLogger(__name__)
         
-    def setup_robots(self):
-        """Setup robots.txt parser"""
-        self.robots_parser = urllib.robotparser.RobotFileParser()
-        self.robots_parser.set_url(urljoin(self.base_url, '/robots.txt'))
-        try:
-            self.robots_parser.read()
-            self.logger.info("Successfully loaded robots.txt")
-        except Exception as e:
-            self.logger.warning(f"Could not load robots.txt: {e}")
+    def log_page(self, url, message, *args):
+        """Log an INFO line about one page, if the page is in the log_sample share
+        
+        The message is only formatted with args if the line is written.
+        """
+        if page_sampled(url, self.log_sample):
+            self.logger.info(message, *args, extra={'url': url})
+        
+    def setup_robots(self, ttl=3600):
+        """Setup robots.txt rules, reloaded through the session every `ttl` seconds"""
+        self.robots = RobotsPolicy(self.session, self.base_url, ttl=ttl, logger=self.logger)
+        self.robots.refresh()
             
     def can_fetch(self, url):
         """Check if URL can be fetched according to robots.txt"""
         try:
-            return self.robots_parser.can_fetch('*', url)
+            return self.robots.can_fetch(url)
         except Exception:
             # If robots.txt check fails, be conservative and allow
             return True
             
+    def crawl_delay(self, host):
+        """Crawl-delay from robots.txt for a host, or 0 if it sets none"""
+        if host != urlparse(self.base_url).netloc:
+            return 0.0
+        return self.robots.crawl_delay or 0.0
+            
     def normalize_url(self, url):
         """Normalize URL for consistent processing"""
         # Remove fragments
@@ -134,46 +309,450 @@ class OFCACrawler:
                 
         return self.download_dir / path
         
-    def save_page(self, url, content):
-        """Save page content to local file"""
+    def save_page(self, url, content, local_path=None):
+        """Save page content to local file
+        
+        content is a str, saved as UTF-8, or bytes saved as they are, by
+        default at create_local_path(url). Returns the SHA-256 of the saved
+        bytes, or None if saving failed.
+        """
         try:
-            local_path = self.create_local_path(url)
-            
-            # Create directory if needed
-            local_path.parent.mkdir(parents=True, exist_ok=True)
+            local_path = local_path or self.create_local_path(url)
+            data = content.encode('utf-8') if isinstance(content, str) else content
             
-            # Save content
-            with open(local_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+            if self.page_store:
+                content_hash = self.page_store.save(data, local_path)
+            else:
+                # Create directory if needed
+                local_path.parent.mkdir(parents=True, exist_ok=True)
                 
-            self.logger.info(f"Saved: {url} -> {local_path}")
-            return True
+                # Save via a temporary file, so a path hardlinked into the
+                # blob store by an earlier run is replaced, not written through
+                tmp_path = local_path.with_name(local_path.name + '.tmp')
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, local_path)
+                content_hash = hashlib.sha256(data).hexdigest()
+                
+            self.log_page(url, "Saved: %s -> %s", url, local_path)
+            return content_hash
             
         except Exception as e:
-            self.logger.error(f"Failed to save {url}: {e}")
-            return False
+            self.logger.error(f"Failed to save {url}: {e}", extra={'url': url})
+            return None
+            
+    def save_response(self, url, response):
+        """Save a fetched HTML page in the configured output format
+        
+        Returns the SHA-256 of the saved content, or None if saving failed.
+        """
+        if self.page_compressor:
+            return self.save_page(url, self.compressed_body(response), self.page_location(url, response))
+        if not self.warc_writer:
+            return self.save_page(url, response.text)
+            
+        try:
+            content_hash = self.warc_writer.write_response(url, response)
+            self.log_page(url, "Archived: %s -> %s", url, self.warc_writer.file_path)
+            return content_hash
+        except Exception as e:
+            self.logger.error(f"Failed to archive {url}: {e}", extra={'url': url})
+            return None
             
+    def compressed_body(self, response):
+        """The body of a response to save with page_compression: as received if kept, else compressed here
+        
+        Compressed here from the decoded text, so the page is UTF-8 like a
+        plain .html file.
+        """
+        if self.kept_as_received(response):
+            return response.raw_body
+        return self.page_compressor.compress(response.text.encode('utf-8'))
+        
+    def kept_as_received(self, response):
+        """Whether a response's body is saved in the gzip it arrived in: only a UTF-8 one"""
+        return getattr(response, 'raw_body', None) is not None and is_utf8(response.encoding)
+        
+    def page_location(self, url, response=None):
+        """Where the saved copy of a page lives: its own file or a WARC file
+        
+        With page_compression, the file's suffix depends on the response:
+        .gz for a body kept as received, else the compressor's.
+        """
+        if self.warc_writer:
+            return self.warc_writer.locate(url)
+        local_path = self.create_local_path(url)
+        if self.page_compressor and response is not None:
+            suffix = '.gz' if self.kept_as_received(response) else self.page_compressor.suffix
+            local_path = local_path.with_name(local_path.name + suffix)
+        return local_path
+        
     def extract_links(self, html_content, base_url):
         """Extract all links from HTML content"""
         try:
-            soup = BeautifulSoup(html_content, 'html.parser')
-            links = set()
-            
             # Find all anchor tags with href
-            for link in soup.find_all('a', href=True):
-                href = link['href']
-                full_url = urljoin(base_url, href)
-                full_url = self.normalize_url(full_url)
-                
-                if self.is_valid_page(full_url):
-                    links.add(full_url)
-                    
-            return links
+            return self.filter_links(self.link_extractor.extract(html_content, base_url), base_url)
             
         except Exception as e:
             self.logger.error(f"Error extracting links from {base_url}: {e}")
             return set()
             
+    def filter_links(self, urls, page_url=None):
+        """Normalize absolute link URLs and keep the ones that should be crawled
+        
+        Document links are queued for download instead, if documents are
+        downloaded; page_url is the page they were found on.
+        """
+        links = set()
+        for full_url in urls:
+            full_url = self.normalize_url(full_url)
+            
+            if self.is_valid_page(full_url):
+                links.add(full_url)
+            elif self.is_document(full_url):
+                self.add_document(full_url, page_url)
+                
+        return links
+        
+    def add_document(self, url, found_on):
+        """Queue a document link for the download lane"""
+        self.documents.add(url, found_on)
+        
+    def is_document(self, url):
+        """Check if URL is a document for the download lane"""
+        if not self.document_extensions or not url.startswith(self.base_url):
+            return False
+        return urlparse(url.lower()).path.endswith(self.document_extensions) and self.can_fetch(url)
+            
+    def conditional_headers(self, url):
+        """Build If-None-Match/If-Modified-Since headers from the page manifest
+        
+        Only sent for pages whose saved copy still exists, because a 304 reply
+        means the local file is reused as-is.
+        """
+        if not self.incremental:
+            return {}
+            
+        entry = self.state.manifest_entry(url)
+        if not entry or not Path(entry['local_path']).exists():
+            return {}
+            
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+        
+    def fetch_page(self, url, headers=None, queued=None):
+        """Fetch a URL and return the response, raising on HTTP errors
+        
+        Transient errors are retried with backoff, see retry_policy.py, and
+        nothing is sent while the host's circuit breaker is open. queued is
+        the time.monotonic() the URL left the frontier, for the queue_wait
+        metric.
+        """
+        host = urlparse(url).netloc
+        waited = None
+        for attempt in itertools.count():
+            self.circuit_breaker.wait(host)
+            if queued is not None and not attempt:
+                waited = time.monotonic() - queued
+                self.metrics.observe('queue_wait', waited)
+            try:
+                response = self.fetch_once(url, headers)
+            except requests.RequestException as e:
+                transient = self.retry_policy.is_transient(e)
+                # A 429 means the host is up but wants us slower, which is
+                # the rate limiter's business
+                self.circuit_breaker.record(host, ok=not transient or error_status(e) == 429)
+                if not transient:
+                    raise
+                if attempt >= self.retry_policy.retries:
+                    self.retry_policy.count('gave_up')
+                    raise
+                    
+                backoff = self.retry_policy.delay(attempt)
+                self.retry_policy.count('retries')
+                self.logger.warning(f"Retrying {url} in {backoff:.1f}s after attempt {attempt + 1} failed: {e}",
+                                    extra={'url': url})
+                time.sleep(backoff)
+                # Retry-After and the host's pace still apply to the retry
+                if self.rate_limiter:
+                    self.rate_limiter.wait(host)
+            else:
+                self.circuit_breaker.record(host, ok=True)
+                if attempt:
+                    self.retry_policy.count('recovered')
+                if waited is not None:
+                    response.timings['queue_wait'] = waited
+                return response
+                
+    def fetch_once(self, url, headers=None):
+        """Make one request for a URL, raising on HTTP errors
+        
+        The body is streamed and only read for HTML pages, up to
+        max_body_size. For anything else the connection is dropped as soon as
+        the headers are in, and the response is returned with an empty body.
+        Phase timings in seconds, for the journal, are kept in response.timings.
+        """
+        started = time.monotonic()
+        try:
+            response = self.http.get(url, headers=headers, timeout=30)
+        except requests.RequestException as e:
+            self.record_fetch(url, started, error=e)
+            raise
+        self.record_fetch(url, started, response=response)
+        
+        response.raw_body = None
+        try:
+            response.raise_for_status()
+            if response.status_code != 304 and self.is_html(response):
+                try:
+                    with self.metrics.timer('download', response.timings):
+                        body = self.read_body(url, response)
+                except requests.RequestException as e:
+                    self.metrics.count_error(e)
+                    raise
+                self.metrics.count_bytes(len(body))
+            else:
+                body = b''
+        finally:
+            response.close()
+            
+        # What requests itself stores once a streamed body has been read
+        response._content = body
+        response._content_consumed = True
+        return response
+        
+    def record_fetch(self, url, started, response=None, error=None):
+        """Tell the metrics and the rate limiter how long a request took and how it ended"""
+        if response is None:
+            self.metrics.count_error(error)
+        else:
+            response.timings = {}
+            connect_time = getattr(response, 'connect_time', None)
+            if connect_time is not None:
+                self.metrics.observe('connect', connect_time)
+                response.timings['connect'] = connect_time
+            response.timings['ttfb'] = time.monotonic() - started - (connect_time or 0.0)
+            self.metrics.observe('ttfb', response.timings['ttfb'])
+            self.metrics.count_response(response.status_code)
+            
+        if self.rate_limiter is None:
+            return
+        host = urlparse(url).netloc
+        if response is None:
+            failed = isinstance(error, (requests.Timeout, requests.ConnectionError))
+            self.rate_limiter.record(host, failed=failed)
+        else:
+            self.rate_limiter.record(host, latency=time.monotonic() - started, status=response.status_code,
+                                     retry_after=parse_retry_after(response.headers.get('retry-after')))
+            
+    def make_rate_limiter(self, per_host_limit, delay):
+        """Create the per-host rate limiter for a crawl, as set by rate_control
+        
+        The document lane starts here too, pacing its requests by this limiter.
+        """
+        if self.rate_control == 'adaptive':
+            self.rate_limiter = AdaptiveRateLimiter(per_host_limit=per_host_limit, delay=delay,
+                                                    host_delay=self.crawl_delay, max_rate=self.max_rate)
+        else:
+            self.rate_limiter = HostRateLimiter(per_host_limit=per_host_limit, delay=delay,
+                                                host_delay=self.crawl_delay)
+        if self.documents:
+            self.documents.start(self.rate_limiter)
+        return self.rate_limiter
+        
+    def is_html(self, response):
+        """Check the Content-Type of a response"""
+        return 'text/html' in response.headers.get('content-type', '').lower()
+        
+    def read_body(self, url, response, chunk_size=64 * 1024):
+        """Read a streamed body in chunks, raising BodyTooLarge past max_body_size
+        
+        The limit applies to the decompressed size, so a small gzip body
+        cannot inflate without bound.
+        """
+        declared = response.headers.get('content-length', '')
+        if declared.isdigit() and int(declared) > self.max_body_size:
+            raise BodyTooLarge(f"{url} declares {int(declared):,} bytes, "
+                               f"over the {self.max_body_size:,} byte limit")
+        if self.page_compressor and response.headers.get('content-encoding', '').strip().lower() == 'gzip':
+            return self.read_gzip_body(url, response, chunk_size)
+            
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            size += len(chunk)
+            if size > self.max_body_size:
+                raise BodyTooLarge(f"{url} is over the {self.max_body_size:,} byte limit")
+            chunks.append(chunk)
+        return b''.join(chunks)
+        
+    def read_gzip_body(self, url, response, chunk_size=64 * 1024):
+        """Read a gzipped body as received into response.raw_body, returning it decompressed
+        
+        Decompressed here rather than by the HTTP client, so the compressed
+        bytes can be saved as they are; max_body_size still applies to the
+        decompressed size.
+        """
+        raw_chunks = []
+        chunks = []
+        size = 0
+        decoder = gzip_decoder()
+        try:
+            for chunk in response.raw.stream(chunk_size, decode_content=False):
+                raw_chunks.append(chunk)
+                while chunk:
+                    if decoder.eof:
+                        # The next gzip member
+                        decoder = gzip_decoder()
+                    data = decoder.decompress(chunk, self.max_body_size + 1 - size)
+                    size += len(data)
+                    if size > self.max_body_size:
+                        raise BodyTooLarge(f"{url} is over the {self.max_body_size:,} byte limit")
+                    chunks.append(data)
+                    chunk = decoder.unconsumed_tail or decoder.unused_data
+        except zlib.error as e:
+            raise requests.exceptions.ContentDecodingError(f"{url} is not valid gzip: {e}")
+        response.raw_body = b''.join(raw_chunks)
+        return b''.join(chunks)
+        
+    def record_failure(self, url, error):
+        """Record a page that could not be fetched"""
+        self.logger.error(f"Failed to crawl {url}: {error}", extra={'url': url})
+        self.crawl_stats['pages_failed'] += 1
+        self.failed_urls.add(url)
+        self.note_outcome(url, 'failed', status=error_status(error), error=str(error))
+        
+    def note_outcome(self, url, outcome, response=None, **details):
+        """Keep a page's outcome for the journal, written once finish_page has persisted the page"""
+        if response is not None:
+            details['status'] = response.status_code
+            details['timings'] = getattr(response, 'timings', None)
+        self.page_outcomes[url] = (outcome, details)
+        if self.language_mirrors:
+            self.language_mirrors.count(url, outcome)
+        
+    def process_response(self, url, response):
+        """Save a fetched page and return the links found on it"""
+        if response.status_code == 304:
+            return self.reuse_unchanged_page(url, response=response)
+            
+        if not self.accept_response(url, response):
+            return set()
+            
+        # Save page
+        with self.metrics.timer('save', response.timings):
+            content_hash = self.save_response(url, response)
+        
+        # Extract links
+        new_links = set()
+        fingerprint = None
+        if content_hash:
+            with self.metrics.timer('parse', response.timings):
+                new_links = self.extract_links(response.text, url)
+                if self.near_duplicates:
+                    fingerprint = page_fingerprint(response.text)
+        
+        return self.record_page(url, response, content_hash, new_links, fingerprint)
+        
+    def accept_response(self, url, response):
+        """Count a downloaded response and check that it is an HTML page"""
+        self.crawl_stats['bytes_downloaded'] += len(response.content)
+        
+        # Check content type; fetch_page has not read the body of other types
+        if not self.is_html(response):
+            self.crawl_stats['pages_skipped'] += 1
+            self.log_page(url, "Skipping non-HTML content: %s", url)
+            self.note_outcome(url, 'skipped', response)
+            return False
+        return True
+        
+    def record_page(self, url, response, content_hash, new_links, fingerprint=None):
+        """Update the stats and manifest for a page handled by save_page
+        
+        Returns the links to follow: none for a near-duplicate page when
+        skip_duplicate_links is set. fingerprint is the page's SimHash, if
+        near-duplicates are detected.
+        """
+        if not content_hash:
+            self.crawl_stats['pages_failed'] += 1
+            self.failed_urls.add(url)
+            self.note_outcome(url, 'failed', response, error='page could not be saved')
+            return set()
+            
+        self.crawl_stats['pages_crawled'] += 1
+        self.log_page(url, "Found %d new links on %s", len(new_links), url)
+        duplicate_of = None
+        if fingerprint is not None:
+            duplicate_of = self.near_duplicates.check(url, fingerprint)
+        self.note_outcome(url, 'crawled', response, size=len(response.content), content_hash=content_hash,
+                          links=len(new_links), duplicate_of=duplicate_of)
+        
+        # The manifest keeps every link, for re-crawls of the page
+        self.state.update_manifest(
+            url,
+            etag=response.headers.get('etag'),
+            last_modified=response.headers.get('last-modified'),
+            content_hash=content_hash,
+            local_path=self.page_location(url, response),
+            links=new_links
+        )
+        
+        if duplicate_of:
+            self.log_page(url, "Near-duplicate of %s: %s", duplicate_of, url)
+            if self.skip_duplicate_links:
+                self.near_duplicates.stats['outlinks_skipped'] += len(new_links)
+                return set()
+        return self.follow_links(url, new_links)
+        
+    def reuse_unchanged_page(self, url, entry=None, response=None):
+        """Keep the saved copy of a page the server reported as not modified
+        
+        response is the 304 response; without one, the page was not fetched
+        at all (see fresh_links).
+        """
+        entry = entry or self.state.manifest_entry(url)
+        self.crawl_stats['pages_crawled'] += 1
+        self.crawl_stats['pages_unchanged'] += 1
+        self.log_page(url, "Unchanged since last crawl: %s", url)
+        
+        # Links were valid when stored, but robots.txt may have changed since
+        links = {link for link in entry['links'] if self.is_valid_page(link)}
+        self.note_outcome(url, 'unchanged' if response is not None else 'fresh', response,
+                          content_hash=entry['content_hash'], links=len(links))
+        return self.follow_links(url, links)
+        
+    def follow_links(self, url, links):
+        """The links of a page to queue, leaving out other language trees if a primary language is set"""
+        if self.language_mirrors is None:
+            return links
+        return self.language_mirrors.route(url, links)
+        
+    def fresh_links(self, url):
+        """Skip fetching pages saved after their sitemap lastmod
+        
+        Returns the stored links of such a page, or None if the page has to
+        be fetched.
+        """
+        if not self.incremental:
+            return None
+            
+        lastmod = self.state.lastmod(url)
+        if lastmod is None:
+            return None
+            
+        entry = self.state.manifest_entry(url)
+        if not entry or not Path(entry['local_path']).exists():
+            return None
+        if datetime.fromisoformat(entry['fetched_at']).astimezone() < lastmod:
+            return None
+            
+        self.crawl_stats['pages_fresh'] += 1
+        return self.reuse_unchanged_page(url, entry)
+        
     def crawl_page(self, url):
         """Crawl a single page"""
         if url in self.visited_urls:
@@ -181,95 +760,384 @@ class OFCACrawler:
             
         self.visited_urls.add(url)
         
+        fresh_links = self.fresh_links(url)
+        if fresh_links is not None:
+            return fresh_links
+            
+        # crawl_site paces requests through the rate limiter; crawl_page
+        # can also be called on its own, without one
+        host = urlparse(url).netloc
+        pacing = self.rate_limiter.hold(host) if self.rate_limiter else contextlib.nullcontext()
+        queued = time.monotonic()
         try:
-            self.logger.info(f"Crawling: {url}")
+            with pacing:
+                self.log_page(url, "Crawling: %s", url)
+                response = self.fetch_page(url, self.conditional_headers(url), queued)
+            return self.process_response(url, response)
             
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
+        except requests.RequestException as e:
+            self.record_failure(url, e)
+            return set()
             
-            # Check content type
-            content_type = response.headers.get('content-type', '').lower()
-            if 'text/html' not in content_type:
-                self.logger.info(f"Skipping non-HTML content: {url}")
-                return set()
-                
-            # Save page
-            if self.save_page(url, response.text):
-                self.crawl_stats['pages_crawled'] += 1
-            else:
-                self.crawl_stats['pages_failed'] += 1
-                self.failed_urls.add(url)
-                return set()
-                
-            # Extract links
-            new_links = self.extract_links(response.text, url)
-            self.logger.info(f"Found {len(new_links)} new links on {url}")
+    def fetch_variant(self, url, language):
+        """Crawl the mirror of a primary-language page in another language
+        
+        For mirrors left out of a crawl with mirror_policy='on_demand', during
+        the crawl or after it. The mirror is recorded like any crawled page:
+        journaled, marked done in the crawl state, so a resumed run does not
+        fetch it again, and counted against its language. Called after the
+        crawl, it also rewrites the summary. Returns the mirror's links into
+        the primary tree, which are only queued while the crawl is running.
+        """
+        if self.language_mirrors is None:
+            raise ValueError("fetch_variant needs a crawler with a primary_language")
+        if self.frontier is None:
+            raise ValueError("fetch_variant needs a crawl started with one of the crawl_site methods")
+        mirror = self.language_mirrors.variant(url, language)
+        if mirror in self.visited_urls:
+            return set()
             
-            return new_links
+        links = self.crawl_page(mirror)
+        if self.journal.file is not None:
+            self.finish_page(mirror, self.frontier.add_links(mirror, links))
+            return links
             
-        except requests.RequestException as e:
-            self.logger.error(f"Failed to crawl {url}: {e}")
-            self.crawl_stats['pages_failed'] += 1
-            self.failed_urls.add(url)
-            return set()
+        # After the crawl: add the page to the finished run's journal and summary
+        self.journal.open(self.state.run_id, resumed=True)
+        self.finish_page(mirror, set())
+        self.language_mirrors.save()
+        self.save_crawl_summary()
+        self.journal.close()
+        return links
+            
+    def new_url_set(self, name, urls=()):
+        """Create an empty URL set of the configured kind, filled from urls"""
+        if self.url_set_db is None:
+            return set(urls)
+        url_set = CompactURLSet(self.url_set_db, name, capacity=self.url_set_capacity)
+        url_set.update(urls)
+        return url_set
+        
+    def start_crawl(self):
+        """Start a new run or resume an interrupted one
+        
+        Returns the crawl frontier, holding the URLs still waiting to be
+        crawled. Pages finished by an interrupted run are restored into
+        visited_urls and failed_urls so they are not fetched again.
+        """
+        self.crawl_stats['start_time'], resumed = self.state.begin_run(
+            self.base_url, self.iter_seed_urls(), self.resume)
+        self.journal.open(self.state.run_id, resumed)
+        
+        done_urls = self.state.urls_with_status(CrawlStateStore.DONE)
+        failed_urls = self.state.urls_with_status(CrawlStateStore.FAILED)
+        self.visited_urls.update(done_urls, failed_urls)
+        self.failed_urls.update(failed_urls)
+        self.crawl_stats['pages_crawled'] = len(done_urls)
+        self.crawl_stats['pages_failed'] = len(failed_urls)
+        
+        pending_urls = self.state.pending_urls()
+        if resumed and self.language_mirrors:
+            # Per-language counts include the pages of the interrupted run
+            for entry in iter_journal(self.journal.path):
+                self.language_mirrors.count(entry['url'], entry['outcome'])
+        if resumed:
+            self.logger.info(f"Resuming interrupted crawl: {len(self.visited_urls)} pages already done, "
+                             f"{len(pending_urls)} in queue")
             
+        all_urls = self.state.all_urls()
+        self.frontier = self.frontier_class(self.new_url_set('discovered', all_urls), **self.frontier_settings)
+        self.frontier.restore(pending_urls, all_urls)
+        
+        # Budgets count from the start of this process, also when resuming
+        self.crawl_stats['stopped_by'] = None
+        self.budget_started = time.monotonic()
+        return self.frontier
+        
+    def budget_exhausted(self, max_pages):
+        """Return which limit stops the crawl before the frontier is empty, or None"""
+        if len(self.visited_urls) >= max_pages:
+            reason = 'max_pages'
+        elif self.max_bytes is not None and self.crawl_stats['bytes_downloaded'] >= self.max_bytes:
+            reason = 'max_bytes'
+        elif self.max_seconds is not None and time.monotonic() - self.budget_started >= self.max_seconds:
+            reason = 'max_seconds'
+        else:
+            return None
+            
+        if self.crawl_stats['stopped_by'] is None:
+            self.crawl_stats['stopped_by'] = reason
+            self.logger.info(f"Crawl budget reached ({reason}), finishing pages in flight")
+        return reason
+        
+    def sitemap_urls(self):
+        """Sitemaps advertised in robots.txt, or /sitemap.xml if there are none"""
+        return self.robots.site_maps() or [urljoin(self.base_url, '/sitemap.xml')]
+        
+    def iter_seed_urls(self):
+        """Yield (url, lastmod) pairs for a new run: the home page, then sitemap entries"""
+        yield urljoin(self.base_url, '/en/home/index.html'), None
+        if not self.use_sitemaps:
+            return
+            
+        for sitemap_url in self.sitemap_urls():
+            self.logger.info(f"Reading sitemap: {sitemap_url}")
+            for loc, lastmod in iter_sitemap(self.session, sitemap_url):
+                url = self.normalize_url(loc)
+                if self.is_valid_page(url) and not self.on_demand_mirror(url):
+                    self.crawl_stats['sitemap_urls'] += 1
+                    yield url, lastmod
+                    
+        self.logger.info(f"Seeded {self.crawl_stats['sitemap_urls']} URLs from sitemaps")
+        
+    def on_demand_mirror(self, url):
+        """Whether a URL is a mirror page left to fetch_variant, recording it if so"""
+        mirrors = self.language_mirrors
+        if mirrors is None or mirrors.policy != 'on_demand' or mirrors.is_primary(url):
+            return False
+        mirrors.record(url)
+        return True
+        
+    def finish_page(self, url, new_links):
+        """Persist a finished page together with the links it added to the frontier"""
+        self.state.complete_page(url, url in self.failed_urls, new_links)
+        # Journaled only now, so the journal never lists a page the state would crawl again
+        outcome = self.page_outcomes.pop(url, None)
+        if outcome:
+            self.journal.record(url, outcome[0], **outcome[1])
+        self.journal.maybe_checkpoint(queued=len(self.frontier))
+        self.metrics.maybe_write(self.page_counts())
+        
+    def page_counts(self):
+        """Pages handled so far by outcome, for the metrics file"""
+        return {outcome: self.crawl_stats[f'pages_{outcome}']
+                for outcome in ('crawled', 'failed', 'unchanged', 'fresh', 'skipped')}
+        
+    def finish_crawl(self):
+        """Mark the run complete and write the summary"""
+        self.crawl_stats['end_time'] = datetime.now()
+        if self.warc_writer:
+            self.warc_writer.flush()
+        self.state.finish_run()
+        self.metrics.write(self.page_counts())
+        if self.search_index:
+            self.update_search_index()
+        if self.language_mirrors:
+            self.language_mirrors.save()
+        if self.documents:
+            if self.documents.pending():
+                self.logger.info(f"Waiting for {self.documents.pending()} document downloads")
+            self.documents.close()
+        self.save_crawl_summary()
+        self.journal.close()
+        
+    def update_search_index(self):
+        """Index the pages saved or changed since the search index was last updated"""
+        index = open_crawl_index(self.state_dir)
+        try:
+            stats = index.update(self.state.manifest_entries(), warc_dirs=[self.state_dir / "warc"])
+        finally:
+            index.close()
+        self.crawl_stats['search_index'] = stats
+        self.logger.info(f"Search index: {stats['indexed']} pages indexed, {stats['unchanged']} unchanged "
+                         f"in {stats['seconds']}s")
+        return stats
+        
     def crawl_site(self, max_pages=1000, delay=1.0):
-        """Crawl the entire site using breadth-first search"""
-        self.crawl_stats['start_time'] = datetime.now()
+        """Crawl the site in frontier order, breadth-first by default
         
-        # Start with the home page
-        urls_to_crawl = {urljoin(self.base_url, '/en/home/index.html')}
-        all_discovered_urls = set(urls_to_crawl)
+        Requests start at least `delay` seconds apart, and never faster than
+        robots.txt's Crawl-delay; with rate_control='adaptive', `delay` is
+        only the starting pace.
+        """
+        frontier = self.start_crawl()
+        limiter = self.make_rate_limiter(per_host_limit=1, delay=delay)
         
         self.logger.info(f"Starting crawl of {self.base_url}")
-        self.logger.info(f"Max pages: {max_pages}, Delay: {delay}s")
+        self.logger.info(f"Max pages: {max_pages}, Delay: {delay}s, Rate control: {self.rate_control}, "
+                         f"Frontier: {frontier.mode}")
         
-        while urls_to_crawl and len(self.visited_urls) < max_pages:
-            current_url = urls_to_crawl.pop()
+        while frontier and not self.budget_exhausted(max_pages):
+            current_url = frontier.pop()
             
             if current_url in self.visited_urls:
                 continue
                 
-            # Crawl the page and get new links
-            new_links = self.crawl_page(current_url)
-            
-            # Add new links to crawl queue
-            for link in new_links:
-                if link not in all_discovered_urls:
-                    urls_to_crawl.add(link)
-                    all_discovered_urls.add(link)
-                    
-            # Rate limiting
-            time.sleep(delay)
+            # Crawl the page and add its new links to the crawl queue
+            new_links = frontier.add_links(current_url, self.crawl_page(current_url))
+            self.finish_page(current_url, new_links)
             
             # Progress update
             if len(self.visited_urls) % 10 == 0:
                 self.logger.info(f"Progress: {len(self.visited_urls)} pages crawled, "
-                               f"{len(urls_to_crawl)} remaining in queue")
+                               f"{len(frontier)} remaining in queue, {limiter.describe()}")
                 
-        self.crawl_stats['end_time'] = datetime.now()
-        self.save_crawl_summary()
+        self.finish_crawl()
+        
+    def configure_connection_pool(self, pool_size):
+        """Size the HTTP backend's connection pool for the number of in-flight requests
+        
+        Connections are kept alive, so none is opened and thrown away per
+        request: one per request thread over HTTP/1.1, while HTTP/2
+        multiplexes them over as few as one.
+        """
+        self.http.configure_pool(pool_size)
+        
+    def crawl_site_async(self, max_pages=1000, concurrency=8, per_host_limit=4, delay=0.0):
+        """Crawl the site with up to `concurrency` requests in flight at once
+        
+        Requests go through the same pooled HTTP backend as crawl_page, run on a
+        thread pool driven by an asyncio event loop. Instead of sleeping after
+        every page, each host gets at most `per_host_limit` concurrent requests
+        whose start times are spaced at least `delay` seconds apart.
+        """
+        asyncio.run(self._crawl_site_async(max_pages, concurrency, per_host_limit, delay))
+        
+    async def _crawl_site_async(self, max_pages, concurrency, per_host_limit, delay):
+        """Event loop body of crawl_site_async"""
+        frontier = self.start_crawl()
+        in_flight = {}
+        
+        limiter = self.make_rate_limiter(per_host_limit, delay)
+        self.configure_connection_pool(concurrency)
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='fetch')
+        
+        self.logger.info(f"Starting async crawl of {self.base_url}")
+        self.logger.info(f"Max pages: {max_pages}, Concurrency: {concurrency}, "
+                         f"Per-host limit: {per_host_limit}, Delay: {delay}s")
+        
+        try:
+            while frontier or in_flight:
+                # Fill the free request slots from the queue
+                while frontier and len(in_flight) < concurrency and not self.budget_exhausted(max_pages):
+                    current_url = frontier.pop()
+                    if current_url in self.visited_urls:
+                        continue
+                    self.visited_urls.add(current_url)
+                    task = asyncio.create_task(self._crawl_page_async(current_url, limiter, executor))
+                    in_flight[task] = current_url
+                    
+                if not in_flight:
+                    break
+                    
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                
+                for task in done:
+                    # Add new links to crawl queue
+                    current_url = in_flight.pop(task)
+                    new_links = frontier.add_links(current_url, task.result())
+                    self.finish_page(current_url, new_links)
+                    
+                # Progress update
+                completed = len(self.visited_urls) - len(in_flight)
+                if completed // 10 > (completed - len(done)) // 10:
+                    self.logger.info(f"Progress: {completed} pages crawled, "
+                                     f"{len(frontier)} remaining in queue, {limiter.describe()}")
+        finally:
+            executor.shutdown(wait=True)
+            
+        self.finish_crawl()
+        
+    async def _crawl_page_async(self, url, limiter, executor):
+        """Fetch one page on the thread pool, then save it and extract its links"""
+        loop = asyncio.get_running_loop()
+        
+        # The manifest is read here: the state database belongs to the loop thread
+        fresh_links = self.fresh_links(url)
+        if fresh_links is not None:
+            return fresh_links
+        headers = self.conditional_headers(url)
+        queued = time.monotonic()
+        
+        async with limiter.slot(urlparse(url).netloc):
+            self.log_page(url, "Crawling: %s", url)
+            try:
+                response = await loop.run_in_executor(executor, self.fetch_page, url, headers, queued)
+            except requests.RequestException as e:
+                self.record_failure(url, e)
+                return set()
+                
+        # Saving and parsing stay on the event loop thread, so the crawl
+        # state is only ever modified from one thread
+        return self.process_response(url, response)
+        
+    def crawl_site_pipelined(self, max_pages=1000, fetch_workers=8, parse_workers=None,
+                             queue_size=16, per_host_limit=4, delay=0.0):
+        """Crawl the site with fetching, link extraction and saving as separate stages
+        
+        Fetch threads feed a process pool that extracts links, which feeds a
+        writer thread; see crawl_pipeline.py. The per-host limits work as in
+        crawl_site_async.
+        """
+        pipeline = CrawlPipeline(self, fetch_workers=fetch_workers, parse_workers=parse_workers,
+                                 queue_size=queue_size, per_host_limit=per_host_limit, delay=delay)
+        pipeline.run(max_pages)
         
     def save_crawl_summary(self):
-        """Save crawl summary and statistics"""
+        """Save crawl summary and statistics
+        
+        Page totals are the journal's and the visited and failed URL lists
+        are streamed from it, so both cover the pages of an interrupted run
+        this one resumed. The summary without the URL lists is kept in the
+        final crawl_checkpoint.json as well.
+        """
+        duration = None
+        if self.crawl_stats['start_time'] and self.crawl_stats['end_time']:
+            duration = (self.crawl_stats['end_time'] - self.crawl_stats['start_time']).total_seconds()
+            
+        totals = self.journal.totals
+        # Unchanged and fresh pages count as crawled, and fresh ones as unchanged
+        pages_crawled = totals['crawled'] + totals['unchanged'] + totals['fresh']
         summary = {
             'base_url': self.base_url,
-            'total_pages_crawled': self.crawl_stats['pages_crawled'],
-            'total_pages_failed': self.crawl_stats['pages_failed'],
+            'total_pages_crawled': pages_crawled,
+            'total_pages_failed': totals['failed'],
+            'total_pages_unchanged': totals['unchanged'] + totals['fresh'],
+            'total_pages_fresh': totals['fresh'],
+            'total_pages_skipped': totals['skipped'],
+            'sitemap_urls': self.crawl_stats['sitemap_urls'],
+            'bytes_downloaded': totals['bytes'],
+            'stopped_by': self.crawl_stats['stopped_by'],
             'start_time': self.crawl_stats['start_time'].isoformat() if self.crawl_stats['start_time'] else None,
             'end_time': self.crawl_stats['end_time'].isoformat() if self.crawl_stats['end_time'] else None,
-            'duration_minutes': ((self.crawl_stats['end_time'] - self.crawl_stats['start_time']).total_seconds() / 60) if self.crawl_stats['start_time'] and self.crawl_stats['end_time'] else None,
-            'visited_urls': list(self.visited_urls),
-            'failed_urls': list(self.failed_urls)
+            'duration_minutes': (duration / 60) if duration else None,
+            'pages_per_second': (pages_crawled / duration) if duration else None,
         }
+        if self.frontier is not None:
+            summary['frontier'] = self.frontier.summary()
+        if self.url_set_db is not None:
+            summary['url_sets'] = {
+                'visited': self.visited_urls.stats(),
+                'failed': self.failed_urls.stats(),
+            }
+        if self.page_store:
+            summary['dedup'] = self.page_store.summary()
+        if self.warc_writer:
+            summary['warc'] = self.warc_writer.summary()
+        summary['robots'] = self.robots.summary()
+        if self.rate_limiter:
+            summary['rate_control'] = self.rate_limiter.summary()
+        summary['http'] = self.http.summary()
+        summary['timings'] = self.metrics.summary()
+        summary['retries'] = dict(self.retry_policy.summary(), circuits=self.circuit_breaker.summary())
+        if self.near_duplicates:
+            summary['near_duplicates'] = self.near_duplicates.summary()
+        if self.language_mirrors:
+            summary['languages'] = self.language_mirrors.summary()
+        if self.documents:
+            summary['documents'] = self.documents.summary()
+        if self.crawl_stats.get('search_index'):
+            summary['search_index'] = self.crawl_stats['search_index']
+        if self.crawl_stats.get('pipeline'):
+            summary['pipeline'] = self.crawl_stats['pipeline']
         
-        summary_file = self.download_dir / "crawl_summary.json"
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, indent=2, ensure_ascii=False)
+        self.journal.checkpoint(queued=len(self.frontier) if self.frontier is not None else 0, summary=summary)
+        summary_file = self.state_dir / "crawl_summary.json"
+        write_summary(summary_file, summary, [self.journal.path])
             
         self.logger.info(f"Crawl completed! Summary saved to {summary_file}")
-        self.logger.info(f"Pages crawled: {self.crawl_stats['pages_crawled']}")
-        self.logger.info(f"Pages failed: {self.crawl_stats['pages_failed']}")
+        self.logger.info(f"Pages crawled: {pages_crawled}")
+        self.logger.info(f"Pages failed: {totals['failed']}")
 
 
 def main():
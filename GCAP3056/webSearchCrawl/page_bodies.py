@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Compressed Page Bodies for the OFCA Crawler
+With page_compression set, saved pages stay compressed on disk. A UTF-8
+body the server sent gzipped is kept as received, instead of being
+decompressed, decoded to str and encoded again; any other body is decoded,
+encoded as UTF-8 and compressed by the crawler:
+
+    Content-Encoding: gzip, UTF-8  ->  page.html.gz   the bytes as received
+    anything else                  ->  page.html.gz   page_compression='gzip'
+                                       page.html.zst  page_compression='zstd' (pip install zstandard)
+
+So a saved page is UTF-8 however it was stored, like a plain .html file,
+also when the site sent it in Big5 or GB2312. read_page returns the
+decompressed bytes of a saved page whichever way it was stored, recognising
+gzip and zstd by their magic bytes, so it also reads the blobs of a
+deduplicated store:
+
+    from page_bodies import read_page
+    html = read_page('ofca_crawl/en/home/index.html')   # finds index.html.gz
+"""
+
+import codecs
+import gzip
+import os
+import zlib
+from pathlib import Path
+
+PAGE_COMPRESSIONS = ('gzip', 'zstd')
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+# Suffixes a saved page may have, tried in this order by find_page
+PAGE_SUFFIXES = ('.gz', '.zst', '')
+
+
+class GzipCompressor:
+    name = 'gzip'
+    suffix = '.gz'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        # mtime=0 keeps the output, and so the content hash, the same for the same page
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+
+class ZstdCompressor:
+    """zstd through the optional zstandard package"""
+
+    name = 'zstd'
+    suffix = '.zst'
+
+    def __init__(self, level=3):
+        zstandard = _import_zstandard()
+        self.level = level
+        self.compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('zstd page compression needs the zstandard package: pip install zstandard')
+    return zstandard
+
+
+def get_compressor(name, level=None):
+    """The compressor for a page_compression name, at its default level unless given"""
+    compressors = {'gzip': GzipCompressor, 'zstd': ZstdCompressor}
+    if name not in compressors:
+        raise ValueError(f"Unknown page compression {name!r}, choose one of {', '.join(PAGE_COMPRESSIONS)}")
+    return compressors[name]() if level is None else compressors[name](level)
+
+
+def is_utf8(charset):
+    """Whether bytes in a response charset are UTF-8 as they are"""
+    try:
+        return codecs.lookup(charset or '').name in ('utf-8', 'ascii')
+    except LookupError:
+        return False
+
+
+def gzip_decoder():
+    """An incremental decoder for a gzip stream"""
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def decompress(data):
+    """Decompress gzip or zstd data; anything else is returned as it is"""
+    if data[:2] == GZIP_MAGIC:
+        # A server may send several gzip members, which gzip reads in turn
+        return gzip.decompress(data)
+    if data[:4] == ZSTD_MAGIC:
+        return _import_zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def find_page(path):
+    """The file a page saved as path was stored in: path itself or path with .gz or .zst"""
+    path = Path(path)
+    if path.suffix in ('.gz', '.zst'):
+        return path
+    for suffix in PAGE_SUFFIXES:
+        candidate = path.with_name(path.name + suffix)
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(f"No saved page at {path}")
+
+
+def read_page(path):
+    """The decompressed bytes of a saved page, plain or compressed"""
+    with open(find_page(path), 'rb') as f:
+        return decompress(f.read())
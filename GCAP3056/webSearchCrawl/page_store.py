@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Page Store for the OFCA Crawler
+Stores every distinct page body once, keyed by its SHA-256, and links the
+URL-shaped paths from create_local_path to those blobs, so the same content
+reached under several URLs takes disk space only once
+"""
+
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+
+class ContentStore:
+    """SHA-256 addressed blob store with hardlinked URL paths"""
+
+    def __init__(self, root):
+        self.blob_dir = Path(root) / 'blobs'
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.stats = {
+            'pages_saved': 0,
+            'blobs_written': 0,
+            'duplicate_pages': 0,
+            'bytes_saved': 0,
+            'bytes_written': 0,
+        }
+
+    def blob_path(self, digest):
+        """Location of the blob holding content with the given SHA-256"""
+        return self.blob_dir / digest[:2] / digest
+
+    def put(self, data):
+        """Store bytes unless an identical blob exists; return (digest, is_new)"""
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.blob_path(digest)
+
+        # Duplicates are detected from the hash, before anything is written
+        if blob.exists():
+            return digest, False
+
+        blob.parent.mkdir(exist_ok=True)
+        # Named per process: the workers of a sharded crawl share one store
+        tmp_path = blob.with_name(f'{blob.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, blob)
+        return digest, True
+
+    def save(self, data, local_path):
+        """Store a page body and make local_path point at its blob; return the digest"""
+        digest, is_new = self.put(data)
+        self.link(self.blob_path(digest), Path(local_path))
+
+        self.stats['pages_saved'] += 1
+        self.stats['bytes_saved'] += len(data)
+        if is_new:
+            self.stats['blobs_written'] += 1
+            self.stats['bytes_written'] += len(data)
+        else:
+            self.stats['duplicate_pages'] += 1
+        return digest
+
+    def link(self, blob, local_path):
+        """Hardlink local_path to blob, copying where hardlinks are unsupported"""
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        if local_path.exists():
+            if os.path.samefile(local_path, blob):
+                return
+            # Replace rather than overwrite, which would write through into
+            # the blob the old path is linked to
+            local_path.unlink()
+
+        try:
+            os.link(blob, local_path)
+        except OSError:
+            shutil.copyfile(blob, local_path)
+
+    def summary(self):
+        """Dedup statistics for crawl_summary.json"""
+        summary = dict(self.stats)
+        summary['dedup_ratio'] = (self.stats['bytes_saved'] / self.stats['bytes_written']
+                                  if self.stats['bytes_written'] else None)
+        return summary
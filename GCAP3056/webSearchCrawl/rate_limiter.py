@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Per-Host Rate Limiting for the OFCA Crawler
+Limits how many requests may be in flight against one host and how closely
+together they may start, replacing the single global sleep between pages.
+AdaptiveRateLimiter adjusts the pace per host from the responses it gets.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Seconds of completed requests the reported request rate is averaged over
+RATE_WINDOW = 10.0
+
+
+def parse_retry_after(value, limit=3600.0):
+    """Seconds to wait from a Retry-After header (seconds or HTTP date), or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), limit)
+
+
+class HostRateLimiter:
+    """Politeness limit applied separately to every host"""
+
+    def __init__(self, per_host_limit=2, delay=0.0, host_delay=None):
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.delay = max(0.0, float(delay))
+        # Optional callable giving a host's own minimum delay, e.g. Crawl-delay
+        self.host_delay = host_delay
+        self._semaphores = {}
+        self._thread_semaphores = {}
+        self._next_start = {}
+        self._completions = deque()
+        self._lock = threading.Lock()
+
+    def _semaphore(self, host):
+        """Return the asyncio concurrency semaphore for a host"""
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._semaphores[host]
+
+    def _thread_semaphore(self, host):
+        """Return the threading concurrency semaphore for a host"""
+        with self._lock:
+            if host not in self._thread_semaphores:
+                self._thread_semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._thread_semaphores[host]
+
+    def _reserve_start(self, host):
+        """Book the next start slot for a host and return how long to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self._interval(host)
+            return start - now
+
+    def _interval(self, host):
+        """Minimum time between request starts against a host"""
+        delay = self.delay
+        if self.host_delay:
+            delay = max(delay, self.host_delay(host) or 0.0)
+        return delay
+
+    def record(self, host, latency=None, status=None, retry_after=None, failed=False):
+        """Report how a request to host went
+
+        latency is the time to the response headers, and failed marks a
+        timeout or connection error. A Retry-After delay holds back every
+        request to the host that has not started yet.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._completions.append(now)
+            while self._completions[0] < now - RATE_WINDOW:
+                self._completions.popleft()
+            if retry_after:
+                self._next_start[host] = max(self._next_start.get(host, now), now + retry_after)
+            self._adapt(host, now, latency, status, retry_after, failed)
+
+    def _adapt(self, host, now, latency, status, retry_after, failed):
+        """Hook for limiters that change their pace, called under the lock"""
+
+    def request_rate(self):
+        """Requests completed per second over the last RATE_WINDOW seconds"""
+        with self._lock:
+            now = time.monotonic()
+            recent = sum(1 for finished in self._completions if finished >= now - RATE_WINDOW)
+        return recent / RATE_WINDOW
+
+    def describe(self):
+        """Current pace for the progress log"""
+        return f"{self.request_rate():.1f} req/s"
+
+    def summary(self):
+        """Settings and pace for crawl_summary.json"""
+        return {'mode': 'fixed', 'per_host_limit': self.per_host_limit, 'delay': self.delay,
+                'request_rate': self.request_rate()}
+
+    @asynccontextmanager
+    async def slot(self, host):
+        """Wait until a request to host may start, holding a slot while it runs"""
+        async with self._semaphore(host):
+            wait = self._reserve_start(host)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield
+
+    @contextmanager
+    def hold(self, host):
+        """Blocking version of slot() for worker threads"""
+        with self._thread_semaphore(host):
+            self.wait(host)
+            yield
+
+    def wait(self, host):
+        """Block a worker thread until its next request to host may start"""
+        wait = self._reserve_start(host)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _reserve_spare(self, host):
+        """Book a start slot for host only if it is free now; else return the wait until it is"""
+        with self._lock:
+            now = time.monotonic()
+            next_start = self._next_start.get(host, now)
+            if next_start > now:
+                return next_start - now
+            self._next_start[host] = now + self._interval(host)
+            return 0.0
+
+    def wait_spare(self, host):
+        """Block a background thread until host has a start slot no other request has booked
+
+        For lower-priority requests: a request already waiting for its slot
+        always goes first, and while others keep booking every slot the
+        background thread keeps waiting.
+        """
+        while True:
+            wait = self._reserve_spare(host)
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter(HostRateLimiter):
+    """Per-host pace found by additive increase / multiplicative decrease
+
+    Each host starts at one request per `delay` seconds (or initial_rate).
+    Every response that arrives quickly adds about `increase` requests per
+    second to the host's rate each second. A 429 or 503, a timeout or
+    connection error, or smoothed latency above latency_factor times the
+    fastest seen cuts the rate by `decrease`, at most once per round trip.
+    The rate never exceeds max_rate, nor the pace set by robots.txt
+    Crawl-delay, and per_host_limit still caps the requests in flight, so
+    concurrency widens with the rate only up to that ceiling.
+    """
+
+    # Latencies below this never count as congestion, whatever the baseline
+    MIN_LATENCY = 0.05
+
+    def __init__(self, per_host_limit=2, delay=0.0, host_delay=None, max_rate=4.0, min_rate=0.05,
+                 initial_rate=None, increase=0.5, decrease=0.5, latency_factor=2.0):
+        super().__init__(per_host_limit=per_host_limit, delay=0.0, host_delay=host_delay)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        if initial_rate is None:
+            initial_rate = 1.0 / delay if delay > 0 else 1.0
+        self.initial_rate = min(max(initial_rate, min_rate), max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self._hosts = {}
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = {'rate': self.initial_rate, 'latency': None, 'base_latency': None,
+                                 'last_decrease': 0.0, 'decreases': 0, 'retry_afters': 0}
+        return self._hosts[host]
+
+    def _interval(self, host):
+        interval = 1.0 / self._host(host)['rate']
+        if self.host_delay:
+            interval = max(interval, self.host_delay(host) or 0.0)
+        return interval
+
+    def _adapt(self, host, now, latency, status, retry_after, failed):
+        state = self._host(host)
+        if latency is not None:
+            state['latency'] = latency if state['latency'] is None else 0.8 * state['latency'] + 0.2 * latency
+            state['base_latency'] = min(state['base_latency'] or latency, latency)
+        if retry_after:
+            state['retry_afters'] += 1
+
+        slow = (state['latency'] is not None and
+                state['latency'] > self.latency_factor * max(state['base_latency'], self.MIN_LATENCY))
+        if failed or status in (429, 503) or slow:
+            # Responses already in flight report the same congestion, so
+            # back off at most once per round trip
+            if now - state['last_decrease'] >= (state['latency'] or 0.0):
+                state['rate'] = max(self.min_rate, state['rate'] * self.decrease)
+                state['last_decrease'] = now
+                state['decreases'] += 1
+        else:
+            state['rate'] = min(self.max_rate, state['rate'] + self.increase / state['rate'])
+
+    def allowed_rate(self):
+        """Sum of the hosts' current request rate limits"""
+        with self._lock:
+            return sum(state['rate'] for state in self._hosts.values()) or self.initial_rate
+
+    def describe(self):
+        return f"{self.request_rate():.1f} req/s (limit {self.allowed_rate():.1f} req/s)"
+
+    def summary(self):
+        with self._lock:
+            hosts = {host: {'rate': round(state['rate'], 3),
+                            'smoothed_latency': state['latency'],
+                            'base_latency': state['base_latency'],
+                            'decreases': state['decreases'],
+                            'retry_afters': state['retry_afters']}
+                     for host, state in self._hosts.items()}
+        return {'mode': 'adaptive', 'per_host_limit': self.per_host_limit, 'max_rate': self.max_rate,
+                'request_rate': self.request_rate(), 'hosts': hosts}
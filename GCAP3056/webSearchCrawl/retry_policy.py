@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Retries and Circuit Breaking for the OFCA Crawler
+Transient failures (timeouts, dropped connections, 429 and 5xx responses) are
+retried after a jittered exponential backoff instead of failing the page for
+good. A per-host circuit breaker pauses all requests to a host that keeps
+failing, then lets a single probe request through to see if it is back.
+"""
+
+import logging
+import random
+import threading
+import time
+
+import requests
+
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+def error_status(error):
+    """HTTP status behind a requests exception, or None for network errors"""
+    response = getattr(error, 'response', None)
+    return response.status_code if response is not None else None
+
+
+class RetryPolicy:
+    """Which errors are retried, how often, and how long to wait in between"""
+
+    def __init__(self, retries=3, backoff=1.0, max_backoff=60.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {'retries': 0, 'recovered': 0, 'gave_up': 0}
+        self._lock = threading.Lock()
+
+    def is_transient(self, error):
+        """Whether a failed request may succeed if tried again"""
+        if isinstance(error, (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+            return True
+        return error_status(error) in TRANSIENT_STATUSES
+
+    def delay(self, attempt):
+        """Backoff before retry number attempt + 1: half fixed, half random
+
+        The random half keeps workers that failed together from retrying in
+        lockstep.
+        """
+        ceiling = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def count(self, outcome):
+        """Count a retry, a page that succeeded after retries, or one given up on"""
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def summary(self):
+        with self._lock:
+            return dict(self.stats, max_retries=self.retries)
+
+
+class CircuitBreaker:
+    """Per-host breaker: closed, open after `threshold` failures in a row, then half-open
+
+    While a host's circuit is open, wait() blocks the threads that want to
+    send it requests rather than failing their pages. After `cooldown`
+    seconds one probe request is let through: if it succeeds the circuit
+    closes, and if it fails it opens again for twice as long, up to
+    max_cooldown.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0, max_cooldown=600.0, logger=None):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.logger = logger or logging.getLogger(__name__)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = {'failures': 0, 'open_until': None, 'cooldown': self.cooldown,
+                                 'probe_started': None, 'opened': 0, 'seconds_open': 0.0}
+        return self._hosts[host]
+
+    def wait(self, host):
+        """Block while the host's circuit is open; return once a request may go"""
+        while True:
+            with self._lock:
+                state = self._host(host)
+                now = time.monotonic()
+                if state['open_until'] is None:
+                    return
+                # A probe that never reported back must not block the host forever
+                probing = state['probe_started'] is not None and now - state['probe_started'] < state['cooldown']
+                if now >= state['open_until'] and not probing:
+                    state['probe_started'] = now
+                    return
+                pause = max(state['open_until'] - now, 0.0)
+            time.sleep(min(max(pause, 0.1), 1.0))
+
+    def record(self, host, ok):
+        """Report whether the host answered a request"""
+        with self._lock:
+            state = self._host(host)
+            now = time.monotonic()
+            if ok:
+                if state['open_until'] is not None:
+                    self.logger.info(f"Circuit for {host} closed, requests resume")
+                    state['seconds_open'] += now - (state['open_until'] - state['cooldown'])
+                state.update(failures=0, open_until=None, probe_started=None, cooldown=self.cooldown)
+                return
+
+            state['failures'] += 1
+            if state['probe_started'] is not None:
+                # The probe failed: stay open, for longer
+                state['seconds_open'] += now - (state['open_until'] - state['cooldown'])
+                state['cooldown'] = min(self.max_cooldown, state['cooldown'] * 2)
+            elif state['open_until'] is not None or state['failures'] < self.threshold:
+                return
+            state['open_until'] = now + state['cooldown']
+            state['probe_started'] = None
+            state['opened'] += 1
+            self.logger.warning(f"Circuit for {host} opened after {state['failures']} failures, "
+                                f"pausing requests for {state['cooldown']:.0f}s")
+
+    def summary(self):
+        with self._lock:
+            return {host: {'opened': state['opened'], 'open': state['open_until'] is not None,
+                           'seconds_open': round(state['seconds_open'], 1)}
+                    for host, state in self._hosts.items()}
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Compiled robots.txt Rules for the OFCA Crawler
+Parses robots.txt once into a prefix trie of plain rules plus a list of
+compiled wildcard rules, and caches the decision for every path it is asked
+about. Matching follows RFC 9309: the longest matching rule wins, and Allow
+wins a tie. robots.txt is fetched through the crawler's session and reloaded
+once its TTL expires.
+"""
+
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import unquote, urljoin, urlparse
+
+
+class RobotsRules:
+    """The Allow/Disallow rules, Crawl-delay and sitemaps for one user agent"""
+
+    def __init__(self, rules=(), crawl_delay=None, sitemaps=(), allow_all=False, disallow_all=False):
+        self.crawl_delay = crawl_delay
+        self.sitemaps = list(sitemaps)
+        self.allow_all = allow_all
+        self.disallow_all = disallow_all
+
+        # Plain prefixes go into a trie of dicts; a node's None key holds the
+        # verdict of the rule ending there. '*' and '$' rules become regexes.
+        self.trie = {}
+        self.wildcards = []
+        for allow, pattern in rules:
+            pattern = unquote(pattern)
+            if '*' in pattern or pattern.endswith('$'):
+                self.wildcards.append((len(pattern), allow, self.compile_pattern(pattern)))
+            else:
+                node = self.trie
+                for char in pattern:
+                    node = node.setdefault(char, {})
+                # Allow wins when the same prefix is both allowed and disallowed
+                node[None] = node.get(None, False) or allow
+
+    @staticmethod
+    def compile_pattern(pattern):
+        anchored = pattern.endswith('$')
+        if anchored:
+            pattern = pattern[:-1]
+        regex = '.*'.join(re.escape(part) for part in pattern.split('*'))
+        return re.compile(regex + ('$' if anchored else ''))
+
+    def is_allowed(self, path):
+        """Decide a (decoded) path plus query string against the rules"""
+        if self.allow_all:
+            return True
+        if self.disallow_all:
+            return False
+
+        best_length, best_allow = -1, True
+        node = self.trie
+        if None in node:
+            best_length, best_allow = 0, node[None]
+        for depth, char in enumerate(path, 1):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                best_length, best_allow = depth, node[None]
+
+        for length, allow, regex in self.wildcards:
+            if (length > best_length or (length == best_length and allow)) and regex.match(path):
+                best_length, best_allow = length, allow
+
+        return best_allow
+
+    @classmethod
+    def parse(cls, text, user_agent='*'):
+        """Parse robots.txt, keeping the group that applies to user_agent"""
+        agent = user_agent.lower()
+        groups = []
+        sitemaps = []
+        current = None
+        in_agent_lines = False
+
+        for line in text.splitlines():
+            line = line.split('#', 1)[0].strip()
+            if ':' not in line:
+                continue
+            field, value = (part.strip() for part in line.split(':', 1))
+            field = field.lower()
+
+            if field == 'sitemap':
+                sitemaps.append(value)
+            elif field == 'user-agent':
+                # Consecutive User-agent lines share one group
+                if not in_agent_lines:
+                    current = {'agents': [], 'rules': [], 'crawl_delay': None}
+                    groups.append(current)
+                current['agents'].append(value.lower())
+                in_agent_lines = True
+                continue
+            elif current is not None and field in ('allow', 'disallow'):
+                # An empty Disallow allows everything and adds no rule
+                if value:
+                    current['rules'].append((field == 'allow', value))
+            elif current is not None and field == 'crawl-delay':
+                try:
+                    current['crawl_delay'] = float(value)
+                except ValueError:
+                    pass
+            in_agent_lines = False
+
+        # A group naming our agent beats the '*' group
+        chosen = [g for g in groups if any(a != '*' and a in agent for a in g['agents'])]
+        if not chosen:
+            chosen = [g for g in groups if '*' in g['agents']]
+
+        rules = [rule for group in chosen for rule in group['rules']]
+        delays = [group['crawl_delay'] for group in chosen if group['crawl_delay'] is not None]
+        return cls(rules, crawl_delay=max(delays) if delays else None, sitemaps=sitemaps)
+
+
+class RobotsPolicy:
+    """robots.txt for one site, fetched through a session and cached"""
+
+    def __init__(self, session, base_url, user_agent='*', ttl=3600, cache_size=16384, logger=None):
+        self.session = session
+        self.robots_url = urljoin(base_url, '/robots.txt')
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.logger = logger
+        self.rules = None
+        self.fetched_at = None
+        self.lock = threading.Lock()
+        self.decide = lru_cache(maxsize=cache_size)(self._decide)
+
+    def log(self, level, message):
+        if self.logger:
+            self.logger.log(level, message)
+
+    def refresh(self):
+        """Fetch robots.txt and recompile the rules
+
+        As in urllib.robotparser: 401/403 disallows everything, any other
+        client error allows everything. On a server or network error the
+        previous rules are kept, and nothing is allowed if there are none.
+        """
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        try:
+            response = self.session.get(self.robots_url, timeout=30)
+            if response.status_code in (401, 403):
+                rules = RobotsRules(disallow_all=True)
+            elif 400 <= response.status_code < 500:
+                rules = RobotsRules(allow_all=True)
+            else:
+                response.raise_for_status()
+                rules = RobotsRules.parse(response.text, self.user_agent)
+            self.log(logging.INFO, "Successfully loaded robots.txt")
+        except Exception as e:
+            self.log(logging.WARNING, f"Could not load robots.txt: {e}")
+            rules = self.rules or RobotsRules(disallow_all=True)
+
+        self.rules = rules
+        self.fetched_at = time.monotonic()
+        self.decide.cache_clear()
+
+    def is_stale(self):
+        return self.rules is None or time.monotonic() - self.fetched_at > self.ttl
+
+    def ensure_fresh(self):
+        """Reload robots.txt once its TTL has passed, from one thread only"""
+        if self.is_stale():
+            with self.lock:
+                if self.is_stale():
+                    self._refresh()
+
+    def _decide(self, path):
+        return self.rules.is_allowed(path)
+
+    def can_fetch(self, url):
+        """Check a URL against the cached robots.txt rules"""
+        self.ensure_fresh()
+        parsed = urlparse(url)
+        path = unquote(parsed.path or '/')
+        if parsed.query:
+            path += '?' + unquote(parsed.query)
+        return self.decide(path)
+
+    @property
+    def crawl_delay(self):
+        self.ensure_fresh()
+        return self.rules.crawl_delay
+
+    def site_maps(self):
+        """Sitemap URLs listed in robots.txt, or None like urllib.robotparser"""
+        self.ensure_fresh()
+        return self.rules.sitemaps or None
+
+    def summary(self):
+        """Rule and cache statistics for crawl_summary.json"""
+        info = self.decide.cache_info()
+        return {
+            'crawl_delay': self.rules.crawl_delay if self.rules else None,
+            'rules': len(self.rules.wildcards) + self.count_trie_rules(self.rules.trie) if self.rules else 0,
+            'decision_cache_hits': info.hits,
+            'decision_cache_misses': info.misses,
+        }
+
+    @staticmethod
+    def count_trie_rules(node):
+        return (None in node) + sum(RobotsPolicy.count_trie_rules(child)
+                                    for key, child in node.items() if key is not None)
@@ -18,8 +18,13 @@ def run_limited_crawl():
     crawler.crawl_site(max_pages=50, delay=2.0)
     print(f"Limited crawl completed! Check {crawler.download_dir} for results.")
 
-def run_full_crawl():
-    """Run a comprehensive crawl of the entire site"""
+def run_full_crawl(per_host_limit=1, delay=1.5, max_rate=1 / 1.5):
+    """Run a comprehensive crawl of the entire site
+    
+    The defaults keep to one request at a time, one every 1.5s. More
+    requests in flight or a shorter delay have to be asked for, e.g.
+    run_full_crawl(per_host_limit=4, delay=0.5, max_rate=2.0).
+    """
     print("Starting full OFCA crawl...")
     print("Warning: This may take several hours and use significant disk space!")
     
@@ -30,11 +35,15 @@ def run_full_crawl():
     
     crawler = OFCACrawler(
         base_url="https://www.ofca.gov.hk",
-        download_dir="ofca_crawl_full"
+        download_dir="ofca_crawl_full",
+        rate_control='adaptive',
+        max_rate=max_rate
     )
     
-    # More comprehensive settings for full crawl
-    crawler.crawl_site(max_pages=2000, delay=1.5)
+    # More comprehensive settings for full crawl: starting at one request
+    # every `delay` seconds and slowing down if the server struggles, but
+    # never faster than max_rate requests per second
+    crawler.crawl_site_async(max_pages=2000, concurrency=4, per_host_limit=per_host_limit, delay=delay)
     print(f"Full crawl completed! Check {crawler.download_dir} for results.")
 
 def run_custom_crawl():
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Full-Text Search Index for the OFCA Crawler
+Extracts the title and visible text of every saved page, in parallel, into
+an SQLite FTS5 index next to the crawl state (search_index.sqlite3), with
+the page's URL, crawl time and content hash. Updating the index after a
+re-crawl only re-reads the pages whose content hash has changed.
+
+    python search_index.py index --crawl-dir ofca_crawl_full
+    python search_index.py search "spectrum auction" --crawl-dir ofca_crawl_full
+
+Pages saved as files, plain or compressed, and pages archived in WARC files
+are all indexed.
+Queries use the FTS5 syntax: words, "exact phrases", OR, NOT, prefix*.
+"""
+
+import argparse
+import codecs
+import itertools
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from lxml import html as lxml_html
+
+from page_bodies import read_page
+from warc_writer import iter_index, parse_http_response, read_record
+
+# Elements whose text is never shown on the page
+HIDDEN_ELEMENTS = ('script', 'style', 'noscript', 'template')
+
+
+def page_text(body, encoding='utf-8'):
+    """Return the (title, visible text) of an HTML page"""
+    try:
+        try:
+            document = lxml_html.document_fromstring(body.decode(encoding, 'replace'))
+        except ValueError:
+            # A str may not carry an XML encoding declaration; let lxml decode it
+            document = lxml_html.document_fromstring(body)
+    except Exception:
+        return '', ''
+    for element in document.iter(*HIDDEN_ELEMENTS):
+        element.drop_tree()
+    title = document.findtext('.//title') or ''
+    body_element = document.find('body')
+    text = (body_element if body_element is not None else document).text_content()
+    return ' '.join(title.split()), ' '.join(text.split())
+
+
+def extract_page(source):
+    """Process-pool task: read a saved page and return its (title, text), or None if it is gone
+
+    source is ('file', path) or ('warc', warc_path, offset).
+    """
+    # Saved files are UTF-8, also compressed ones (see page_bodies.py);
+    # archived bodies are as the server sent them
+    encoding = 'utf-8'
+    try:
+        if source[0] == 'warc':
+            _, block = read_record(source[1], source[2])
+            _, headers, body = parse_http_response(block)
+            content_type = {name.lower(): value for name, value in headers.items()}.get('content-type', '')
+            match = re.search(r'charset=["\']?([\w-]+)', content_type)
+            if match:
+                encoding = codecs.lookup(match.group(1)).name
+        else:
+            body = read_page(source[1])
+    except LookupError:
+        # An unknown charset; UTF-8 is the likeliest
+        pass
+    except (OSError, EOFError, KeyError, ValueError, zlib.error):
+        return None
+    return page_text(body, encoding)
+
+
+def warc_locations(warc_dir):
+    """Map each archived URL to the (warc_path, offset) of its latest response body
+
+    Revisit records point at the earlier response with the same payload.
+    """
+    warc_dir = Path(warc_dir)
+    latest = {}
+    bodies = {}
+    for entry in iter_index(warc_dir):
+        latest[entry['a']] = entry
+        if entry['m'] != 'warc/revisit':
+            bodies[entry['k']] = (str(warc_dir / entry['g']), int(entry['V']))
+    return {url: bodies[entry['k']] for url, entry in latest.items() if entry['k'] in bodies}
+
+
+class SearchIndex:
+    """FTS5 index of crawled pages, weighted towards title matches"""
+
+    def __init__(self, db_path, tokenizer='unicode61 remove_diacritics 2'):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    id INTEGER PRIMARY KEY,
+                    url TEXT UNIQUE NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    crawled_at TEXT NOT NULL
+                )''')
+            # 'trigram' also finds words in Chinese text, which has no spaces
+            self.conn.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(title, body, tokenize='{tokenizer}')")
+
+    def indexed_hashes(self):
+        """url -> content hash of every indexed page"""
+        return dict(self.conn.execute('SELECT url, content_hash FROM pages'))
+
+    def update(self, manifest, warc_dirs=(), workers=None):
+        """Bring the index in line with a crawl manifest; return what changed
+
+        manifest yields (url, content_hash, local_path, fetched_at) for every
+        saved page, and warc_dirs are where a WARC crawl archived them. Pages
+        whose hash is already indexed are skipped, and pages no longer in the
+        manifest are dropped.
+        """
+        started = time.perf_counter()
+        indexed = self.indexed_hashes()
+        locations = {}
+        for warc_dir in warc_dirs:
+            if Path(warc_dir, 'index.cdx').exists():
+                locations.update(warc_locations(warc_dir))
+
+        changed = []
+        seen = set()
+        for url, content_hash, local_path, fetched_at in manifest:
+            seen.add(url)
+            if indexed.get(url) == content_hash:
+                continue
+            if url in locations:
+                source = ('warc',) + locations[url]
+            else:
+                source = ('file', local_path)
+            changed.append((url, content_hash, fetched_at, source))
+        removed = [url for url in indexed if url not in seen]
+
+        stats = {'indexed': 0, 'unchanged': len(seen) - len(changed), 'missing': 0, 'removed': len(removed)}
+        if changed:
+            # Spawned, like the crawl pipeline's parsers: the caller may have threads running
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 2,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                texts = pool.map(extract_page, [page[3] for page in changed], chunksize=32)
+                with self.conn:
+                    for (url, content_hash, fetched_at, _), text in zip(changed, texts):
+                        if text is None:
+                            stats['missing'] += 1
+                            continue
+                        self.store(url, content_hash, fetched_at, *text)
+                        stats['indexed'] += 1
+        with self.conn:
+            for url in removed:
+                self.delete(url)
+
+        stats['seconds'] = round(time.perf_counter() - started, 2)
+        stats['pages'] = self.conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+        return stats
+
+    def store(self, url, content_hash, crawled_at, title, text):
+        """Add or replace one page"""
+        self.delete(url)
+        cursor = self.conn.execute('INSERT INTO pages (url, content_hash, crawled_at) VALUES (?, ?, ?)',
+                                   (url, content_hash, crawled_at))
+        self.conn.execute('INSERT INTO pages_fts (rowid, title, body) VALUES (?, ?, ?)',
+                          (cursor.lastrowid, title, text))
+
+    def delete(self, url):
+        row = self.conn.execute('SELECT id FROM pages WHERE url = ?', (url,)).fetchone()
+        if row:
+            self.conn.execute('DELETE FROM pages_fts WHERE rowid = ?', row)
+            self.conn.execute('DELETE FROM pages WHERE id = ?', row)
+
+    def search(self, query, limit=10):
+        """Return the best matches for a query, with a snippet of each
+
+        Title matches count five times as much as body matches. A query that
+        is not valid FTS5 syntax is searched for as plain words.
+        """
+        sql = ('SELECT pages.url, pages_fts.title, pages.crawled_at, '
+               "snippet(pages_fts, 1, '[', ']', ' ... ', 16), bm25(pages_fts, 5.0, 1.0) AS rank "
+               'FROM pages_fts JOIN pages ON pages.id = pages_fts.rowid '
+               'WHERE pages_fts MATCH ? ORDER BY rank LIMIT ?')
+        try:
+            rows = self.conn.execute(sql, (query, limit)).fetchall()
+        except sqlite3.OperationalError:
+            words = ' '.join('"%s"' % word.replace('"', '""') for word in re.findall(r'\w+', query))
+            rows = self.conn.execute(sql, (words, limit)).fetchall() if words else []
+        return [{'url': url, 'title': title, 'crawled_at': crawled_at, 'snippet': snippet, 'score': -rank}
+                for url, title, crawled_at, snippet, rank in rows]
+
+    def optimize(self):
+        """Merge the index segments, e.g. after a large update"""
+        with self.conn:
+            self.conn.execute("INSERT INTO pages_fts (pages_fts) VALUES ('optimize')")
+
+    def close(self):
+        self.conn.close()
+
+
+def open_crawl_index(state_dir, tokenizer='unicode61 remove_diacritics 2'):
+    """The search index belonging to a crawl's state directory"""
+    return SearchIndex(Path(state_dir) / 'search_index.sqlite3', tokenizer=tokenizer)
+
+
+def index_crawl(state_dir, workers=None, tokenizer='unicode61 remove_diacritics 2'):
+    """Update the search index of a crawl from its crawl_state.sqlite3 manifest
+
+    For a sharded crawl, pass its download directory: the manifests of all
+    shards under shards/ go into one index there.
+    """
+    from crawl_state import CrawlStateStore
+
+    state_dir = Path(state_dir)
+    state_dirs = [path.parent for path in [state_dir / 'crawl_state.sqlite3',
+                                           *sorted(state_dir.glob('shards/*/crawl_state.sqlite3'))]
+                  if path.exists()]
+    if not state_dirs:
+        raise FileNotFoundError(f"No crawl_state.sqlite3 in {state_dir}")
+
+    states = [CrawlStateStore(path / 'crawl_state.sqlite3') for path in state_dirs]
+    index = open_crawl_index(state_dir, tokenizer)
+    try:
+        manifest = itertools.chain.from_iterable(state.manifest_entries() for state in states)
+        return index.update(manifest, warc_dirs=[path / 'warc' for path in state_dirs], workers=workers)
+    finally:
+        index.close()
+        for state in states:
+            state.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search over crawled OFCA pages")
+    parser.add_argument('--crawl-dir', default='ofca_crawl_full',
+                        help="the crawl's state directory (its download_dir unless state_dir was set)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    index_parser = commands.add_parser('index', help="index new and changed pages")
+    index_parser.add_argument('--workers', type=int, help="text extraction processes (default: CPU count)")
+    index_parser.add_argument('--tokenizer', default='unicode61 remove_diacritics 2',
+                              help="FTS5 tokenizer for a new index, e.g. trigram for Chinese pages")
+    search_parser = commands.add_parser('search', help="search the index")
+    search_parser.add_argument('query')
+    search_parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        stats = index_crawl(args.crawl_dir, workers=args.workers, tokenizer=args.tokenizer)
+        print(f"Indexed {stats['indexed']} pages, {stats['unchanged']} unchanged, {stats['removed']} removed, "
+              f"{stats['missing']} missing on disk in {stats['seconds']}s ({stats['pages']} pages in the index)")
+        return
+
+    index = open_crawl_index(args.crawl_dir)
+    started = time.perf_counter()
+    results = index.search(args.query, limit=args.limit)
+    elapsed = time.perf_counter() - started
+    for number, result in enumerate(results, 1):
+        print(f"{number:>2}. {result['title'] or '(untitled)'}\n    {result['url']}  (crawled {result['crawled_at'][:10]})")
+        print(f"    {result['snippet']}\n")
+    print(f"{len(results)} results in {elapsed * 1000:.1f} ms")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
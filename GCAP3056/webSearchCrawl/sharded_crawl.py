@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Sharded Multi-Process Crawling for the OFCA Crawler
+Splits one crawl across several worker processes, each with its own GIL,
+session, connection pool and share of the per-host rate limits. Every URL
+belongs to exactly one shard, chosen by a hash of the URL:
+
+    coordinator --start--> worker 0 .. worker N-1
+    worker i --links owned by j--> inbox of worker j
+    worker i --document links owned by j--> inbox of worker j --> download lane of j
+
+Each worker runs crawl_site_async over its own shard, keeping its crawl state,
+log and summary under <download_dir>/shards/shard-NN/, while the pages
+themselves all go into the shared download directory. Once every worker is
+idle and no links are in transit, the workers stop and the coordinator merges
+their summaries and journals into <download_dir>/crawl_summary.json.
+"""
+
+import hashlib
+import json
+import math
+import multiprocessing
+import queue
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from crawl_frontier import CrawlFrontier
+from crawl_journal import write_summary
+from ofca_crawler import OFCACrawler
+
+_STOP = None
+
+
+def shard_of(url, num_shards):
+    """Shard owning a URL; stable across processes and runs"""
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % num_shards
+
+
+class ShardRouter:
+    """Queues and shared counters connecting the workers of a sharded crawl
+
+    `pending` counts active workers plus link batches in transit. A worker
+    gives up its unit when it runs out of pages, and takes it back by
+    consuming a batch, so the count only reaches zero once the whole crawl
+    has run dry. Whoever brings it to zero tells every worker to stop.
+    """
+
+    def __init__(self, num_shards, context):
+        self.num_shards = num_shards
+        self.inboxes = [context.Queue() for _ in range(num_shards)]
+        self.pending = context.Value('i', num_shards)
+        # Pages visited by each worker, for the shared max_pages
+        self.page_counts = context.Array('i', num_shards)
+
+    def owner(self, url):
+        return shard_of(url, self.num_shards)
+
+    def send(self, shard, links, depth):
+        """Pass links to the worker owning them"""
+        self.put(shard, ('links', links, depth))
+
+    def send_documents(self, shard, urls, found_on):
+        """Pass document links to the worker owning them, to download in its lane"""
+        self.put(shard, ('documents', urls, found_on))
+
+    def put(self, shard, item):
+        with self.pending.get_lock():
+            self.pending.value += 1
+        self.inboxes[shard].put(item)
+
+    def release(self):
+        """Give up one unit of pending work, stopping everyone at zero"""
+        with self.pending.get_lock():
+            self.pending.value -= 1
+            finished = self.pending.value == 0
+        if finished:
+            for inbox in self.inboxes:
+                inbox.put(_STOP)
+
+    def retire(self, shard, active):
+        """Take a worker out of the crawl, discarding links sent to it until the end"""
+        if active:
+            self.release()
+        while self.inboxes[shard].get() is not _STOP:
+            self.release()
+
+
+class ShardFrontier(CrawlFrontier):
+    """Frontier of one shard: queues its own links and routes the rest
+
+    While the shard has nothing to crawl and no pages in progress, checking
+    the frontier blocks until another worker sends links or the crawl ends.
+    """
+
+    def attach(self, router, shard, state, documents=None):
+        self.router = router
+        self.shard = shard
+        self.inbox = router.inboxes[shard]
+        self.state = state
+        # The shard's document download lane, if documents are downloaded
+        self.documents = documents
+        self.routed_documents = set()
+        self.active = True
+        self.finished = False
+        self.stats.update(routed_out=0, routed_in=0)
+        if documents:
+            self.stats.update(documents_routed_out=0, documents_routed_in=0)
+
+    def __bool__(self):
+        self.receive(block=False)
+        while not self.heap and not self.in_progress and not self.finished:
+            self.receive(block=True)
+        return bool(self.heap)
+
+    def add_links(self, url, links):
+        depth = self.in_progress.get(url, 0) + 1
+        own_links = []
+        foreign_links = defaultdict(list)
+        for link in links:
+            shard = self.router.owner(link)
+            if shard == self.shard:
+                own_links.append(link)
+            elif link not in self.discovered:
+                # Remembered here too, so each link is sent to its owner once
+                self.discovered.add(link)
+                foreign_links[shard].append(link)
+
+        for shard, batch in foreign_links.items():
+            self.router.send(shard, batch, depth)
+            self.stats['routed_out'] += len(batch)
+        return super().add_links(url, own_links)
+
+    def add_document(self, url, found_on):
+        """Queue a document link in this shard's lane, or send it to the shard owning it
+
+        Only the owner downloads a document, so one linked from the pages of
+        several shards is fetched once, into its own .part file.
+        """
+        shard = self.router.owner(url)
+        if shard == self.shard:
+            self.documents.add(url, found_on)
+        elif url not in self.routed_documents:
+            self.routed_documents.add(url)
+            self.router.send_documents(shard, [url], found_on)
+            self.stats['documents_routed_out'] += 1
+
+    def receive(self, block):
+        """Queue the links other workers have sent, optionally waiting for some"""
+        if block and self.active:
+            self.active = False
+            self.router.release()
+
+        while True:
+            try:
+                item = self.inbox.get(block=block)
+            except queue.Empty:
+                return
+            if item is _STOP:
+                self.finished = True
+                return
+
+            if self.active:
+                self.router.release()
+            else:
+                self.active = True
+            kind, links, extra = item
+            if kind == 'documents':
+                # extra is the page linking to them
+                self.stats['documents_routed_in'] += len(links)
+                for link in links:
+                    self.documents.add(link, extra)
+            else:
+                # extra is their depth
+                self.stats['routed_in'] += len(links)
+                # Stored as pending straight away, so a resumed run still has them
+                self.state.add_pending(self.queue_links(links, extra), extra)
+            block = False
+
+    def close(self):
+        """Leave the crawl, e.g. once a budget is spent"""
+        if not self.finished:
+            self.router.retire(self.shard, self.active)
+            self.finished = True
+
+
+class ShardCrawler(OFCACrawler):
+    """OFCACrawler crawling the URLs of one shard"""
+
+    frontier_class = ShardFrontier
+
+    def __init__(self, shard, router, **kwargs):
+        self.shard = shard
+        self.router = router
+        super().__init__(**kwargs)
+
+    def iter_seed_urls(self):
+        # Every worker reads the sitemaps and keeps its own share of them
+        for url, lastmod in super().iter_seed_urls():
+            if self.router.owner(url) == self.shard:
+                yield url, lastmod
+
+    def start_crawl(self):
+        frontier = super().start_crawl()
+        frontier.attach(self.router, self.shard, self.state, self.documents)
+        return frontier
+
+    def add_document(self, url, found_on):
+        self.frontier.add_document(url, found_on)
+
+    def crawl_delay(self, host):
+        # N workers each waiting N times Crawl-delay keep the site's pace
+        return super().crawl_delay(host) * self.router.num_shards
+
+    def budget_exhausted(self, max_pages):
+        counts = self.router.page_counts
+        counts[self.shard] = len(self.visited_urls)
+        return super().budget_exhausted(max_pages - (sum(counts) - counts[self.shard]))
+
+
+def run_shard(shard, router, crawler_kwargs, crawl_kwargs):
+    """Worker process: crawl one shard with crawl_site_async"""
+    crawler = None
+    try:
+        crawler = ShardCrawler(shard, router, **crawler_kwargs)
+        crawler.crawl_site_async(**crawl_kwargs)
+    finally:
+        # A worker leaving early must keep draining its inbox, or the others
+        # would wait forever for it to take its links
+        if crawler is not None and crawler.frontier is not None:
+            crawler.frontier.close()
+        else:
+            router.retire(shard, active=True)
+
+
+class ShardedCrawl:
+    """Coordinator running an OFCACrawler crawl across several processes
+
+    crawler_kwargs are passed to every worker's OFCACrawler, so they must be
+    picklable (a page_score has to be a module-level function). Prefix quotas
+    are split evenly between the workers.
+    """
+
+    def __init__(self, num_workers=4, download_dir="ofca_crawl", **crawler_kwargs):
+        self.num_workers = num_workers
+        self.download_dir = Path(download_dir)
+        self.crawler_kwargs = dict(crawler_kwargs, download_dir=download_dir)
+        # Adaptive rate control aims for the ceiling, so each worker gets a share
+        self.crawler_kwargs['max_rate'] = crawler_kwargs.get('max_rate', 4.0) / num_workers
+        if crawler_kwargs.get('prefix_quotas'):
+            self.crawler_kwargs['prefix_quotas'] = {
+                prefix: math.ceil(quota / num_workers)
+                for prefix, quota in crawler_kwargs['prefix_quotas'].items()}
+
+    def shard_dir(self, shard):
+        return self.download_dir / 'shards' / f'shard-{shard:02d}'
+
+    def run(self, max_pages=1000, concurrency=8, per_host_limit=4, delay=0.0):
+        """Crawl up to max_pages pages in total
+
+        concurrency applies to each worker. per_host_limit and delay are for
+        the crawl as a whole and are divided between the workers.
+        """
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        context = multiprocessing.get_context('spawn')
+        router = ShardRouter(self.num_workers, context)
+        crawl_kwargs = {
+            'max_pages': max_pages,
+            'concurrency': concurrency,
+            'per_host_limit': max(1, per_host_limit // self.num_workers),
+            'delay': delay * self.num_workers,
+        }
+
+        workers = []
+        for shard in range(self.num_workers):
+            crawler_kwargs = dict(self.crawler_kwargs, state_dir=self.shard_dir(shard))
+            worker = context.Process(target=run_shard, name=f'shard-{shard:02d}',
+                                     args=(shard, router, crawler_kwargs, crawl_kwargs))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        return self.merge_summaries()
+
+    def merge_summaries(self):
+        """Combine the workers' summaries into one crawl_summary.json and return it
+        
+        Each worker's summary is read from its final checkpoint, and the URL
+        lists are streamed from the workers' journals straight into the file,
+        so they are left out of the returned summary.
+        """
+        shards = {}
+        for shard in range(self.num_workers):
+            checkpoint_file = self.shard_dir(shard) / 'crawl_checkpoint.json'
+            if checkpoint_file.exists():
+                with open(checkpoint_file, encoding='utf-8') as f:
+                    checkpoint = json.load(f)
+                if 'summary' in checkpoint:
+                    shards[shard] = checkpoint['summary']
+        journals = [self.shard_dir(shard) / 'crawl_journal.jsonl' for shard in shards]
+
+        def total(key):
+            return sum(shard[key] or 0 for shard in shards.values())
+
+        start_times = [shard['start_time'] for shard in shards.values() if shard['start_time']]
+        end_times = [shard['end_time'] for shard in shards.values() if shard['end_time']]
+        duration = None
+        if start_times and end_times:
+            duration = (datetime.fromisoformat(max(end_times))
+                        - datetime.fromisoformat(min(start_times))).total_seconds()
+
+        stopped_by = [shard['stopped_by'] for shard in shards.values() if shard['stopped_by']]
+        summary = {
+            'base_url': next(iter(shards.values()))['base_url'] if shards else self.crawler_kwargs.get('base_url'),
+            'total_pages_crawled': total('total_pages_crawled'),
+            'total_pages_failed': total('total_pages_failed'),
+            'total_pages_unchanged': total('total_pages_unchanged'),
+            'total_pages_fresh': total('total_pages_fresh'),
+            'total_pages_skipped': total('total_pages_skipped'),
+            # Every worker reads the whole sitemap
+            'sitemap_urls': max((shard['sitemap_urls'] for shard in shards.values()), default=0),
+            'bytes_downloaded': total('bytes_downloaded'),
+            'stopped_by': stopped_by[0] if stopped_by else None,
+            'start_time': min(start_times) if start_times else None,
+            'end_time': max(end_times) if end_times else None,
+            'duration_minutes': (duration / 60) if duration else None,
+            'pages_per_second': (total('total_pages_crawled') / duration) if duration else None,
+            'shards': [{
+                'state_dir': str(self.shard_dir(index)),
+                'pages_crawled': shard['total_pages_crawled'],
+                'pages_failed': shard['total_pages_failed'],
+                'bytes_downloaded': shard['bytes_downloaded'],
+                'stopped_by': shard['stopped_by'],
+                'frontier': shard.get('frontier'),
+                'languages': shard.get('languages'),
+                'documents': shard.get('documents'),
+            } for index, shard in shards.items()],
+        }
+
+        write_summary(self.download_dir / 'crawl_summary.json', summary, journals)
+        return summary
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Sitemap Reading for the OFCA Crawler
+Streams <url> entries out of sitemap.xml files and sitemap indexes, including
+gzip-compressed ones, without holding a whole sitemap in memory
+"""
+
+import gzip
+import logging
+from datetime import datetime
+
+from lxml import etree
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_lastmod(value):
+    """Parse a W3C datetime from <lastmod> into an aware datetime, or None"""
+    if not value:
+        return None
+    value = value.strip().replace('Z', '+00:00')
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # Date-only and naive values are taken as local time
+    return parsed if parsed.tzinfo else parsed.astimezone()
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ''
+
+
+def iter_sitemap(session, sitemap_url, timeout=30, max_depth=3, _seen=None):
+    """Yield (loc, lastmod) for every page listed in a sitemap or sitemap index
+
+    Child sitemaps of an index are read recursively, up to max_depth levels.
+    Unreadable sitemaps are logged and skipped.
+    """
+    seen = _seen if _seen is not None else set()
+    if sitemap_url in seen or max_depth < 0:
+        return
+    seen.add(sitemap_url)
+
+    try:
+        response = session.get(sitemap_url, timeout=timeout, stream=True)
+        response.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Could not load sitemap {sitemap_url}: {e}")
+        return
+
+    child_sitemaps = []
+    try:
+        response.raw.decode_content = True
+        source = response.raw
+        content_type = response.headers.get('content-type', '').lower()
+        if sitemap_url.endswith('.gz') or 'gzip' in content_type:
+            source = gzip.GzipFile(fileobj=response.raw)
+
+        # Only completed <url>/<sitemap> entries are looked at, and each is
+        # cleared straight away so memory does not grow with the sitemap
+        for _, element in etree.iterparse(source, events=('end',), recover=True):
+            name = _local_name(element.tag)
+            if name not in ('url', 'sitemap'):
+                continue
+            loc = element.findtext(f'{SITEMAP_NS}loc') or element.findtext('loc')
+            lastmod = element.findtext(f'{SITEMAP_NS}lastmod') or element.findtext('lastmod')
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+            if not loc:
+                continue
+            if name == 'sitemap':
+                child_sitemaps.append(loc.strip())
+            else:
+                yield loc.strip(), parse_lastmod(lastmod)
+    except Exception as e:
+        logger.warning(f"Error reading sitemap {sitemap_url}: {e}")
+    finally:
+        response.close()
+
+    for child_url in child_sitemaps:
+        yield from iter_sitemap(session, child_url, timeout, max_depth - 1, seen)
@@ -1,29 +1,29 @@
 #!/usr/bin/env python3
 """
 Test script for OFCA Crawler
-Tests basic functionality without doing a full crawl
+Tests basic functionality without doing a full crawl.
+With --offline it runs against the local synthetic site instead of
+www.ofca.gov.hk (see local_test_server.py)
 """
 
 from ofca_crawler import OFCACrawler
-import logging
+from local_test_server import SyntheticSite, start_server
+import argparse
 
-def test_crawler():
+def test_crawler(base_url="https://www.ofca.gov.hk", disallowed_paths=("/App_Code/", "/speedtest/")):
     """Test basic crawler functionality"""
     print("Testing OFCA Crawler...")
     
     # Create crawler with test settings
     crawler = OFCACrawler(
-        base_url="https://www.ofca.gov.hk",
+        base_url=base_url,
         download_dir="test_crawl"
     )
     
     # Test robots.txt
     print(f"Testing robots.txt compliance...")
-    test_urls = [
-        "https://www.ofca.gov.hk/en/home/index.html",  # Should be allowed
-        "https://www.ofca.gov.hk/App_Code/test.html",  # Should be disallowed
-        "https://www.ofca.gov.hk/speedtest/test.html", # Should be disallowed
-    ]
+    test_urls = [f"{base_url}/en/home/index.html"]  # Should be allowed
+    test_urls += [f"{base_url}{path}test.html" for path in disallowed_paths]  # Should be disallowed
     
     for url in test_urls:
         can_fetch = crawler.can_fetch(url)
@@ -31,7 +31,7 @@ def test_crawler():
     
     # Test single page crawl
     print("\nTesting single page crawl...")
-    test_url = "https://www.ofca.gov.hk/en/home/index.html"
+    test_url = f"{base_url}/en/home/index.html"
     
     try:
         links = crawler.crawl_page(test_url)
@@ -51,4 +51,15 @@ def test_crawler():
     print(f"\nTest completed. Files saved in: {crawler.download_dir}")
     
 if __name__ == "__main__":
-    test_crawler()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Test the OFCA crawler")
+    parser.add_argument('--offline', action='store_true', help="test against a local synthetic site")
+    args = parser.parse_args()
+    
+    if args.offline:
+        server, base_url = start_server(SyntheticSite(pages=50, latency=0.0))
+        try:
+            test_crawler(base_url, disallowed_paths=("/private/",))
+        finally:
+            server.shutdown()
+    else:
+        test_crawler()
\ No newline at end of file
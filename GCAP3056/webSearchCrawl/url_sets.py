@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Compact URL Sets for the OFCA Crawler
+A Bloom filter in memory answers most "have we seen this URL?" questions,
+and an exact SQLite table on disk confirms the rest, so the visited, failed
+and discovered sets of a million-URL crawl no longer have to live in Python
+sets of full URL strings.
+
+False positives: a Bloom filter sized for n URLs with bits_per_url bits each
+and k = bits_per_url * ln 2 hash functions says "maybe" for an unseen URL with
+probability about (1 - e^(-k n / m))^k, i.e. 0.1% at the default 14.4 bits
+per URL. A "maybe" is always checked against the exact table, so a false
+positive costs one indexed SQLite lookup and never a wrong answer. Adding more
+URLs than the capacity raises the rate, and with it the number of lookups.
+"""
+
+import hashlib
+import math
+import sqlite3
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        # Two 64-bit halves of one digest give all k positions (double hashing)
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+    def expected_error_rate(self, count):
+        """False positive probability once `count` items have been added"""
+        return (1 - math.exp(-self.num_hashes * count / self.num_bits)) ** self.num_hashes
+
+
+class CompactURLSet:
+    """Set-like URL collection: Bloom filter in memory, exact table on disk
+
+    Supports the operations the crawl loops use on their URL sets: `in`,
+    add, update, len and iteration. Several sets can share one connection,
+    each with its own table.
+    """
+
+    def __init__(self, conn, name, capacity=1_000_000, error_rate=0.001, commit_every=1000):
+        self.conn = conn
+        self.table = f'url_set_{name}'
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.commit_every = commit_every
+        self.pending_writes = 0
+        self.count = 0
+        self.lookups = 0
+        self.false_positives = 0
+
+        self.conn.execute(f'DROP TABLE IF EXISTS {self.table}')
+        self.conn.execute(f'CREATE TABLE {self.table} (url TEXT PRIMARY KEY) WITHOUT ROWID')
+
+    def __contains__(self, url):
+        if url not in self.bloom:
+            return False
+        self.lookups += 1
+        found = self.conn.execute(f'SELECT 1 FROM {self.table} WHERE url = ?', (url,)).fetchone()
+        if found is None:
+            self.false_positives += 1
+        return found is not None
+
+    def add(self, url):
+        # The primary key does the duplicate check, saving a lookup per add
+        cursor = self.conn.execute(f'INSERT OR IGNORE INTO {self.table} (url) VALUES (?)', (url,))
+        if not cursor.rowcount:
+            return
+        self.bloom.add(url)
+        self.count += 1
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_every:
+            self.conn.commit()
+            self.pending_writes = 0
+
+    def update(self, *iterables):
+        for urls in iterables:
+            for url in urls:
+                self.add(url)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for (url,) in self.conn.execute(f'SELECT url FROM {self.table}'):
+            yield url
+
+    def stats(self):
+        """Size and false-positive figures for crawl_summary.json"""
+        return {
+            'urls': self.count,
+            'bloom_bytes': len(self.bloom.bits),
+            'bloom_hashes': self.bloom.num_hashes,
+            'expected_false_positive_rate': self.bloom.expected_error_rate(self.count),
+            'disk_lookups': self.lookups,
+            'false_positives': self.false_positives,
+        }
+
+
+def open_url_set_store(db_path):
+    """Open the scratch database that holds the exact URL tables
+
+    The tables are rebuilt from crawl_state.sqlite3 at the start of every
+    run, so they are written without a journal or fsync.
+    """
+    # Only ever used from the thread driving the crawl, which need not be
+    # the one that created the crawler
+    conn = sqlite3.connect(str(db_path), check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA cache_size=-8192')
+    return conn
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+WARC Output for the OFCA Crawler
+Streams request/response pairs into rotating gzip-compressed WARC 1.1 files
+instead of one .html file per page. Every record is its own gzip member, and
+index.cdx lists the file and byte offset of every response, so a single page
+can be read back without decompressing the whole archive.
+"""
+
+import base64
+import gzip
+import hashlib
+import string
+import uuid
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote, unquote, urlparse
+
+CDX_HEADER = ' CDX N b a m s k S V g\n'
+# CDX fields are separated by spaces, so URLs are written with spaces, other
+# whitespace, non-ASCII characters and '%' itself percent-encoded; reading
+# them back with unquote gives the exact URL
+CDX_URL_SAFE = string.punctuation.replace('%', '')
+
+# requests has already undone these, so they no longer describe the stored body
+DROPPED_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length'}
+
+
+def surt(url):
+    """Sort-friendly URL key used by CDX indexes, e.g. hk,gov,ofca)/en/home"""
+    parsed = urlparse(url.lower())
+    host = parsed.hostname or ''
+    if host.startswith('www.'):
+        host = host[4:]
+    key = ','.join(reversed(host.split('.'))) + ')' + (parsed.path or '/')
+    if parsed.query:
+        key += '?' + parsed.query
+    return key
+
+
+def cdx_quote(url):
+    return quote(url, safe=CDX_URL_SAFE)
+
+
+def cdx_date(date):
+    """14-digit CDX timestamp of a WARC date, e.g. 20250301101502"""
+    return date.replace('-', '').replace(':', '').replace('T', '')[:14]
+
+
+def sha1_digest(data):
+    """WARC-style digest string of some bytes"""
+    return 'sha1:' + base64.b32encode(hashlib.sha1(data).digest()).decode('ascii')
+
+
+class WARCWriter:
+    """Appends WARC records to rotating .warc.gz files and keeps a CDX index"""
+
+    def __init__(self, directory, prefix='ofca', max_file_size=1024 ** 3, dedup=True):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.max_file_size = max_file_size
+        self.dedup = dedup
+        self.index_path = self.directory / 'index.cdx'
+
+        # Payload digest -> (url, date) of the first response carrying it
+        self.payloads = {}
+        self.locations = {}
+        self.stats = {'files': 0, 'responses': 0, 'revisits': 0, 'bytes_written': 0}
+
+        self.file = None
+        self.file_path = None
+        new_index = not self.index_path.exists()
+        self.index = open(self.index_path, 'a', encoding='utf-8')
+        if new_index:
+            self.index.write(CDX_HEADER)
+
+    def open_next_file(self):
+        """Start a new WARC file, numbered after the ones already on disk"""
+        if self.file:
+            self.file.close()
+        number = len(list(self.directory.glob(f'{self.prefix}-*.warc.gz')))
+        self.file_path = self.directory / f'{self.prefix}-{number:05d}.warc.gz'
+        self.file = open(self.file_path, 'ab')
+        self.stats['files'] += 1
+
+        info = (f'software: OFCA Crawler\r\nformat: WARC File Format 1.1\r\n'
+                f'created: {self.now()}\r\n').encode('utf-8')
+        self.write_record('warcinfo', None, info, 'application/warc-fields',
+                          {'WARC-Filename': self.file_path.name})
+
+    def now(self):
+        return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def write_record(self, warc_type, url, block, content_type, extra_headers=None, date=None):
+        """Write one gzip-compressed record and return (offset, length, record_id)"""
+        record_id = f'<urn:uuid:{uuid.uuid4()}>'
+        headers = {
+            'WARC-Type': warc_type,
+            'WARC-Record-ID': record_id,
+            'WARC-Date': date or self.now(),
+        }
+        if url:
+            headers['WARC-Target-URI'] = url
+        headers.update(extra_headers or {})
+        headers['WARC-Block-Digest'] = sha1_digest(block)
+        headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(len(block))
+
+        head = 'WARC/1.1\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers.items()) + '\r\n'
+        member = gzip.compress(head.encode('utf-8') + block + b'\r\n\r\n')
+
+        offset = self.file.tell()
+        self.file.write(member)
+        self.stats['bytes_written'] += len(member)
+        return offset, len(member), record_id
+
+    def write_response(self, url, response):
+        """Archive a fetched page with its request; return the payload's SHA-256"""
+        if self.file is None or self.file.tell() >= self.max_file_size:
+            self.open_next_file()
+
+        body = response.content
+        payload_digest = sha1_digest(body)
+        date = self.now()
+        http_headers = ''.join(f'{name}: {value}\r\n' for name, value in response.headers.items()
+                               if name.lower() not in DROPPED_HEADERS)
+        http_head = (f'HTTP/1.1 {response.status_code} {response.reason}\r\n{http_headers}'
+                     f'Content-Length: {len(body)}\r\n\r\n').encode('iso-8859-1', 'replace')
+
+        original = self.payloads.get(payload_digest) if self.dedup else None
+        if original:
+            # Same body as an earlier response: keep the headers only
+            offset, length, record_id = self.write_record(
+                'revisit', url, http_head, 'application/http;msgtype=response', {
+                    'WARC-Profile': 'http://netpreserve.org/warc/1.1/revisit/identical-payload-digest',
+                    'WARC-Refers-To-Target-URI': original[0],
+                    'WARC-Refers-To-Date': original[1],
+                    'WARC-Payload-Digest': payload_digest,
+                }, date)
+            self.stats['revisits'] += 1
+            mime = 'warc/revisit'
+        else:
+            offset, length, record_id = self.write_record(
+                'response', url, http_head + body, 'application/http;msgtype=response',
+                {'WARC-Payload-Digest': payload_digest}, date)
+            self.payloads[payload_digest] = (url, date)
+            self.stats['responses'] += 1
+            mime = response.headers.get('content-type', '-').split(';')[0].strip() or '-'
+
+        request = response.request
+        request_head = (f'{request.method} {request.path_url} HTTP/1.1\r\n'
+                        + ''.join(f'{name}: {value}\r\n' for name, value in request.headers.items())
+                        + '\r\n').encode('iso-8859-1', 'replace')
+        self.write_record('request', url, request_head, 'application/http;msgtype=request',
+                          {'WARC-Concurrent-To': record_id})
+
+        digest_field = payload_digest.split(':', 1)[1]
+        self.index.write(f'{cdx_quote(surt(url))} {cdx_date(date)} {cdx_quote(url)} {mime} '
+                         f'{response.status_code} {digest_field} {length} {offset} {self.file_path.name}\n')
+        self.locations[url] = self.file_path
+
+        # Hand the record to the OS before the page is marked done
+        self.flush()
+        return hashlib.sha256(body).hexdigest()
+
+    def locate(self, url):
+        """Return (and forget) the WARC file the last response for url went to"""
+        return self.locations.pop(url, self.file_path)
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        self.index.close()
+
+    def summary(self):
+        """Archive statistics for crawl_summary.json"""
+        return dict(self.stats, directory=str(self.directory))
+
+
+def read_record(warc_path, offset):
+    """Read the record at a byte offset; return (warc_headers, block)"""
+    decompressor = zlib.decompressobj(wbits=31)
+    data = b''
+    with open(warc_path, 'rb') as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                break
+            data += decompressor.decompress(chunk)
+
+    head, _, rest = data.partition(b'\r\n\r\n')
+    lines = head.decode('utf-8').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    block = rest[:int(headers['Content-Length'])]
+    return headers, block
+
+
+def parse_http_response(block):
+    """Split a response record block into (status, headers, body)"""
+    head, _, body = block.partition(b'\r\n\r\n')
+    lines = head.decode('iso-8859-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+    return status, headers, body
+
+
+def _index_entry(line):
+    """Parse a CDX line into a dict, with the URL unquoted"""
+    entry = dict(zip(CDX_HEADER.split()[1:], line.rstrip('\n').split(' ')))
+    entry['a'] = unquote(entry['a'])
+    return entry
+
+
+def iter_index(directory):
+    """Yield the entries of a WARC directory's CDX index as dicts, with the URL unquoted"""
+    with open(Path(directory) / 'index.cdx', encoding='utf-8') as f:
+        for line in f:
+            if not line.startswith(' CDX'):
+                yield _index_entry(line)
+
+
+# Parsed index.cdx files, by path: [bytes read, latest entry by URL, responses by payload digest]
+_indexes = {}
+
+
+def load_index(directory):
+    """The CDX index of a WARC directory as (latest entry by URL, responses by payload digest)
+
+    Parsed once and kept; later calls only read the lines appended since,
+    so a page can be looked up while the crawl is still writing.
+    """
+    path = Path(directory) / 'index.cdx'
+    size = path.stat().st_size
+    index = _indexes.get(path)
+    if index is None or size < index[0]:
+        index = _indexes[path] = [0, {}, {}]
+    read, latest, responses = index
+    if size > read:
+        with open(path, 'rb') as f:
+            f.seek(read)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A line still being written
+                    break
+                read += len(line)
+                line = line.decode('utf-8')
+                if line.startswith(' CDX'):
+                    continue
+                entry = _index_entry(line)
+                latest[entry['a']] = entry
+                if entry['m'] != 'warc/revisit':
+                    responses.setdefault(entry['k'], []).append(entry)
+        index[0] = read
+    return latest, responses
+
+
+def load_page(directory, url):
+    """Random access to the latest archived copy of url: (status, headers, body)
+
+    Revisit records are followed to the response they were deduplicated
+    against, found by payload digest and the refers-to URL and date, so an
+    old revisit still returns the body of its time after the page changed.
+    The index is read once per directory (see load_index).
+    """
+    directory = Path(directory)
+    latest, responses = load_index(directory)
+    if url not in latest:
+        raise KeyError(url)
+    latest = latest[url]
+
+    headers, block = read_record(directory / latest['g'], int(latest['V']))
+    status, http_headers, body = parse_http_response(block)
+    if headers['WARC-Type'] == 'revisit':
+        digest = headers['WARC-Payload-Digest'].split(':', 1)[1]
+        refers_to = (headers.get('WARC-Refers-To-Target-URI'), cdx_date(headers.get('WARC-Refers-To-Date', '')))
+        candidates = responses.get(digest)
+        if not candidates:
+            raise KeyError(f"{url}: no response with payload {headers['WARC-Payload-Digest']}")
+        # Any response with the digest has the same body; prefer the one referred to
+        original = next((entry for entry in candidates if (entry['a'], entry['b']) == refers_to), candidates[0])
+        _, block = read_record(directory / original['g'], int(original['V']))
+        _, _, body = parse_http_response(block)
+    return status, http_headers, body